@@ -4,7 +4,9 @@ from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_bcrypt import Bcrypt
-from db_config import DB_CONFIG
+from db_config import (
+    DB_CONFIG, DB_REPLICA_CONFIG, DB_SHARD_CONFIGS, DB_POOL, DB_REPLICA_POOL, DB_SHARD_POOL, SHARD_SCATTER_WORKERS
+)
 from models import db, User, user_schema
 from routes.app_routes import app_routes 
 from routes.admin_routes import admin_routes  
@@ -13,6 +15,24 @@ import jwt
 from dotenv import load_dotenv
 import os
 from utils.auth_utils import create_token
+from utils.write_behind import init_write_behind
+from utils.identity_cache import init_identity_cache
+from utils.response_cache import init_response_cache
+from utils.metrics import init_metrics
+from utils.live_feed import init_live_feed
+from utils.device_sketches import init_device_sketches, rebuild_device_sketches
+from utils.password_pool import (
+    PasswordPoolBusy, init_password_pool, get_password_pool, upgrade_hash, record_login
+)
+from utils.db_routing import REPLICA_BIND, shard_bind, init_db_routing, engine_options
+from utils.sharding import init_sharding, scatter, rebalance_shards
+from utils.migrations import upgrade_schema
+from utils.rollups import GRANULARITIES, compact_rollups
+from utils.device_registry import rebuild_device_registry
+from utils.archive import init_archive
+from utils.lookups import init_lookups
+from utils.retention import apply_retention
+import click
 
 
 load_dotenv()
@@ -26,14 +46,87 @@ bcrypt = Bcrypt(app)
 
 #  Database Config
 app.config['SQLALCHEMY_DATABASE_URI'] = DB_CONFIG
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DB_CONFIG, *DB_POOL)
+binds = {}
+if DB_REPLICA_CONFIG:
+    binds[REPLICA_BIND] = {"url": DB_REPLICA_CONFIG, **engine_options(DB_REPLICA_CONFIG, *DB_REPLICA_POOL)}
+for index, url in enumerate(DB_SHARD_CONFIGS):
+    binds[shard_bind(index)] = {"url": url, **engine_options(url, *DB_SHARD_POOL)}
+if binds:
+    app.config['SQLALCHEMY_BINDS'] = binds
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = SECRET_KEY
 
+#  CellRecord sharding by device_id across the SHARD_DATABASE_URLS binds (none: everything on the primary);
+#  global summaries query the shards in parallel on SHARD_SCATTER_WORKERS threads per worker
+app.config['SHARD_COUNT'] = len(DB_SHARD_CONFIGS)
+app.config['SHARD_SCATTER_WORKERS'] = SHARD_SCATTER_WORKERS
+
+#  bcrypt cost factor for new hashes (existing ones are upgraded on login) and the bounded hashing pool
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_POOL_WORKERS'] = int(os.getenv('PASSWORD_POOL_WORKERS', 2))
+app.config['PASSWORD_POOL_MAX_PENDING'] = int(os.getenv('PASSWORD_POOL_MAX_PENDING', 8))
+app.config['PASSWORD_POOL_WAIT_TIMEOUT'] = float(os.getenv('PASSWORD_POOL_WAIT_TIMEOUT', 1))
+
+#  Write-behind ingestion (optional): submit_data queues rows and returns 202
+app.config['WRITE_BEHIND_ENABLED'] = os.getenv('WRITE_BEHIND', 'false').lower() == 'true'
+app.config['WRITE_BEHIND_QUEUE_SIZE'] = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 10000))
+app.config['WRITE_BEHIND_BATCH_SIZE'] = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 500))
+app.config['WRITE_BEHIND_FLUSH_INTERVAL'] = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 1.0))
+app.config['WRITE_BEHIND_BLOCK_TIMEOUT'] = float(os.getenv('WRITE_BEHIND_BLOCK_TIMEOUT', 0))
+app.config['WRITE_BEHIND_DEAD_LETTER'] = os.getenv('WRITE_BEHIND_DEAD_LETTER')  # NDJSON file of rows that failed alone
+
+#  Verified-identity cache for verify_token (AUTH_CACHE_TTL=0 disables it)
+app.config['AUTH_CACHE_TTL'] = float(os.getenv('AUTH_CACHE_TTL', 60))
+app.config['AUTH_CACHE_SIZE'] = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+
+#  Admin analytics response cache (RESPONSE_CACHE_URL=redis://... shares it between workers)
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE', 'true').lower() == 'true'
+app.config['RESPONSE_CACHE_URL'] = os.getenv('RESPONSE_CACHE_URL')
+app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+app.config['RESPONSE_CACHE_LIVE_TTL'] = float(os.getenv('RESPONSE_CACHE_LIVE_TTL', 15))
+app.config['RESPONSE_CACHE_PAST_AFTER'] = float(os.getenv('RESPONSE_CACHE_PAST_AFTER', 86400))
+app.config['RESPONSE_CACHE_PAST_TTL'] = os.getenv('RESPONSE_CACHE_PAST_TTL')  # seconds, default depends on the backend
+
+#  Request/SQL instrumentation served at /admin/metrics; SLOW_REQUEST_MS > 0 logs slow requests with their SQL
+app.config['METRICS_ENABLED'] = os.getenv('METRICS', 'true').lower() == 'true'
+app.config['SLOW_REQUEST_MS'] = float(os.getenv('SLOW_REQUEST_MS', 0))
+
+#  HyperLogLog sketches of distinct devices per hour/day, operator and network type, merged on ingest.
+#  Pending sketches are flushed every DEVICE_SKETCH_FLUSH_INTERVAL seconds; a killed worker loses at most that.
+app.config['DEVICE_SKETCHES_ENABLED'] = os.getenv('DEVICE_SKETCHES', 'true').lower() == 'true'
+app.config['DEVICE_SKETCH_FLUSH_INTERVAL'] = float(os.getenv('DEVICE_SKETCH_FLUSH_INTERVAL', 5))
+
+#  Server-Sent Events feed at /admin/live_feed; each stream holds a worker thread (see gunicorn.conf.py), so they are capped per worker
+app.config['LIVE_FEED_ENABLED'] = os.getenv('LIVE_FEED', 'true').lower() == 'true'
+app.config['LIVE_FEED_URL'] = os.getenv('LIVE_FEED_URL')  # redis://... so every worker's feed sees every ingest
+app.config['LIVE_FEED_MAX_STREAMS'] = int(os.getenv('LIVE_FEED_MAX_STREAMS', 20))
+app.config['LIVE_FEED_QUEUE_SIZE'] = int(os.getenv('LIVE_FEED_QUEUE_SIZE', 256))
+app.config['LIVE_FEED_INTERVAL'] = float(os.getenv('LIVE_FEED_INTERVAL', 1))
+app.config['LIVE_FEED_HEARTBEAT'] = float(os.getenv('LIVE_FEED_HEARTBEAT', 15))
+
+#  Retention: apply-retention moves raw measurements older than RETENTION_DAYS into compressed day
+#  partitions under ARCHIVE_DIR (shared by all app servers); summaries over archived days read them there
+app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR')
+app.config['ARCHIVE_CACHE_PARTITIONS'] = int(os.getenv('ARCHIVE_CACHE_PARTITIONS', 16))
+app.config['RETENTION_DAYS'] = int(os.getenv('RETENTION_DAYS', 180))
+
 # Initialize SQLAlchemy & Limiter
 
 db.init_app(app)
+init_db_routing(app, db)
+init_lookups(app)
+init_sharding(app)
+init_archive(app)
 limiter = Limiter(key_func=get_remote_address)
 limiter.init_app(app)
+init_write_behind(app)
+init_identity_cache(app)
+init_response_cache(app)
+init_metrics(app)
+init_live_feed(app)
+init_device_sketches(app)
+init_password_pool(app)
 
 # Register app routes
 app.register_blueprint(app_routes)
@@ -50,19 +143,41 @@ def register_user():
     role = "user"  # force role to user, do not allow admin creation here
 
     if not username or not password:
+        record_login("missing_fields")
         return jsonify({"error": "Username and password are required"}), 400
 
     existing_user = User.query.filter_by(username=username).first()
+    release_connection()
     if existing_user:
+        record_login("invalid")
         return jsonify({"error": "Username already exists"}), 409
 
-    new_user = User(username=username, password=password, role=role)
+    try:
+        hashed_password = get_password_pool(app).hash_password(password)
+    except PasswordPoolBusy:
+        return password_pool_busy()
+
+    new_user = User(username=username, role=role, hashed_password=hashed_password)
     db.session.add(new_user)
     db.session.commit()
+    record_login("success")
 
     return jsonify(user_schema.dump(new_user)), 201
 
 
+#  Return the request's connection to the pool before waiting on bcrypt, so a burst of logins cannot
+#  hold every primary connection while ingest waits for one
+def release_connection():
+    db.session.rollback()
+    db.session.close()
+
+
+#  The password pool is saturated: shed the request quickly instead of queueing behind bcrypt
+def password_pool_busy():
+    record_login("busy")
+    return jsonify({"error": "Too many sign-ins in progress, retry shortly"}), 503, {"Retry-After": "1"}
+
+
 @app.route('/login', methods=['POST'])
 @limiter.limit("5 per minute")
 def login_user():
@@ -71,13 +186,23 @@ def login_user():
     password = data.get("password")
 
     if not username or not password:
+        record_login("missing_fields")
         return jsonify({"error": "Missing username or password"}), 400
 
     user = User.query.filter_by(username=username, role='user').first()  # only normal users
-    if not user or not bcrypt.check_password_hash(user.hashed_password, password):
+    user_id, hashed_password = (user.id, user.hashed_password) if user else (None, None)
+    release_connection()
+    try:
+        valid = user_id is not None and get_password_pool(app).check_password(hashed_password, password)
+    except PasswordPoolBusy:
+        return password_pool_busy()
+    if not valid:
+        record_login("invalid")
         return jsonify({"error": "Invalid username or password"}), 403
 
-    token = create_token(user.id)
+    upgrade_hash(user_id, hashed_password, password)
+    record_login("success")
+    token = create_token(user_id)
     return jsonify({"token": token}), 200
 
 
@@ -89,20 +214,85 @@ def admin_login():
     password = data.get("password")
 
     if not username or not password:
+        record_login("missing_fields")
         return jsonify({"error": "Missing username or password"}), 400
 
     user = User.query.filter_by(username=username, role='admin').first()
-    if not user:
+    user_id, hashed_password = (user.id, user.hashed_password) if user else (None, None)
+    release_connection()
+    if user_id is None:
+        record_login("invalid")
         return jsonify({"error": "Admin account not found"}), 403
 
-    if not bcrypt.check_password_hash(user.hashed_password, password):
+    try:
+        valid = get_password_pool(app).check_password(hashed_password, password)
+    except PasswordPoolBusy:
+        return password_pool_busy()
+    if not valid:
+        record_login("invalid")
         return jsonify({"error": "Incorrect password"}), 403
 
-    token = create_token(user.id)
+    upgrade_hash(user_id, hashed_password, password)
+    record_login("success")
+    token = create_token(user_id)
     return jsonify({"admin_token": token}), 200
 
 
 
+#  Schema migration for existing deployments: flask --app app upgrade-db (with the app stopped)
+@app.cli.command('upgrade-db', help=(
+    "Create missing tables, columns and indexes and convert an old-schema cell_record. "
+    "Stop the app first: rows inserted during the conversion would take the ids of rows still to copy. "
+    "An interrupted run resumes where it stopped."
+))
+def upgrade_db():
+    created = upgrade_schema()
+    print(f"Created: {', '.join(created)}" if created else "Schema is up to date")
+
+
+#  Rollup compactor, run periodically (e.g. every few minutes from cron): flask --app app compact-rollups
+#  With shards, every shard compacts the rollups of its own devices
+@app.cli.command('compact-rollups')
+@click.option('--rebuild-from', type=click.DateTime(), default=None,
+              help="Re-aggregate everything from this time (for measurements that arrived very late)")
+def compact_rollups_command(rebuild_from):
+    for granularity in GRANULARITIES:
+        written = sum(scatter(compact_rollups, granularity, rebuild_from=rebuild_from))
+        print(f"{granularity}: {written} rollup rows written")
+
+
+#  Rebuild the device registry from CellRecord (run once after upgrade-db on existing deployments)
+@app.cli.command('rebuild-device-registry')
+def rebuild_device_registry_command():
+    print(f"{rebuild_device_registry()} devices registered")
+
+
+#  Build distinct-device sketches from CellRecord (after upgrade-db on existing deployments)
+@app.cli.command('rebuild-device-sketches')
+@click.option('--since', type=click.DateTime(), default=None, help="Only rebuild buckets from this time on")
+def rebuild_device_sketches_command(since):
+    print(f"{rebuild_device_sketches(since)} sketches merged")
+
+
+#  Move rows to the shard their device hashes to, after appending a URL to SHARD_DATABASE_URLS
+#  (--from-primary: initial move of an unsharded deployment's rows off the primary)
+@app.cli.command('rebalance-shards')
+@click.option('--from-primary', is_flag=True, help="Also move the rows still stored on the primary")
+def rebalance_shards_command(from_primary):
+    for table, moved in rebalance_shards(include_primary=from_primary).items():
+        print(f"{table}: {moved} rows moved")
+
+
+#  Archive old raw measurements, run daily (e.g. from cron): flask --app app apply-retention
+@app.cli.command('apply-retention')
+@click.option('--older-than-days', type=int, default=None, help="Archive days older than this (default RETENTION_DAYS)")
+def apply_retention_command(older_than_days):
+    days = older_than_days if older_than_days is not None else app.config['RETENTION_DAYS']
+    summary = apply_retention(timedelta(days=days))
+    print(f"{summary['records']} records of {summary['days']} days archived, "
+          f"archive covers everything before {summary['archived_until']:%Y-%m-%d}")
+
+
 # Health Check Route
 @app.route('/')
 def home():
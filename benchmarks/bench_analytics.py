@@ -0,0 +1,84 @@
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import setup_app, report, app
+from models import db, CellRecord
+from utils.analytics import load_window, grouped_distribution
+from utils.sharding import insert_records
+
+ROWS = 200000
+WINDOW = (datetime(2025, 3, 1), datetime(2025, 4, 1))
+
+
+def seed():
+    rng = random.Random(42)
+    start = WINDOW[0]
+    rows = [{
+        "operator": rng.choice(["Alfa", "Touch"]),
+        "network_type": rng.choice(["2G", "3G", "4G"]),
+        "signal_power": rng.gauss(-90, 12),
+        "sinr": rng.gauss(12, 6),
+        "timestamp": start + timedelta(seconds=rng.randrange(30 * 86400)),
+        "device_id": f"device-{rng.randrange(500)}",
+        "username": "bench_user",
+    } for _ in range(ROWS)]
+    insert_records(rows)
+    db.session.commit()
+
+
+#  The pattern the summary routes used to follow: ORM objects, Python lists, per-group loops
+def loop_based():
+    records = CellRecord.query.filter(CellRecord.timestamp.between(*WINDOW)).all()
+    groups = {}
+    for rec in records:
+        groups.setdefault(rec.network_type, {"signal_power": [], "sinr": []})
+        groups[rec.network_type]["signal_power"].append(rec.signal_power)
+        groups[rec.network_type]["sinr"].append(rec.sinr)
+    result = {}
+    for group, values in groups.items():
+        result[group] = {}
+        for metric, series in values.items():
+            cuts = statistics.quantiles(series, n=100)
+            result[group][metric] = {
+                "mean": statistics.fmean(series),
+                "std": statistics.pstdev(series),
+                "percentiles": {"p5": cuts[4], "p50": cuts[49], "p95": cuts[94]},
+            }
+    return result
+
+
+def vectorized():
+    arrays = load_window([CellRecord.timestamp.between(*WINDOW)])
+    return grouped_distribution(arrays, ("network_type",))
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    db.session.remove()
+    return time.perf_counter() - start
+
+
+#  Peak Python allocation of one run, in MiB
+def peak_mb(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+    return round(peak / 2 ** 20, 1)
+
+
+if __name__ == '__main__':
+    setup_app()
+    with app.app_context():
+        seed()
+        loop_seconds = timed(loop_based)
+        numpy_seconds = timed(vectorized)
+        numpy_peak = peak_mb(vectorized)
+    report("loop_based", rows=ROWS, seconds=f"{loop_seconds:.3f}")
+    report("numpy", rows=ROWS, seconds=f"{numpy_seconds:.3f}", speedup=f"{loop_seconds / numpy_seconds:.1f}x",
+           peak_mb=numpy_peak)
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from common import setup_app, report, app
+from app import limiter
+from bench_batch_ingest import measurement
+from utils.password_pool import PasswordPool, get_password_pool
+
+SECONDS = 3.0
+LOGIN_THREADS = 8
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))]
+
+
+#  Ingest latency while LOGIN_THREADS clients hammer /login, with the given password pool (None: no burst)
+def bench_ingest(headers, pool):
+    if pool is not None:
+        app.extensions['password_pool'] = pool
+    stop = threading.Event()
+    logins = {}
+
+    def login_loop():
+        client = app.test_client()
+        while not stop.is_set():
+            status = client.post('/login', json={"username": "bench_user", "password": "bench-password"}).status_code
+            logins[status] = logins.get(status, 0) + 1
+
+    threads = [threading.Thread(target=login_loop) for _ in range(LOGIN_THREADS if pool else 0)]
+    for thread in threads:
+        thread.start()
+
+    client = app.test_client()
+    latencies = []
+    deadline = time.perf_counter() + SECONDS
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        client.post('/submit_data', json=measurement(i), headers=headers)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    stop.set()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return latencies, logins
+
+
+if __name__ == '__main__':
+    _, headers = setup_app()
+    limiter.enabled = False
+    configured = get_password_pool(app)
+    scenarios = [
+        ("no logins", None),
+        ("login burst, unbounded", PasswordPool(workers=LOGIN_THREADS, max_pending=LOGIN_THREADS,
+                                                rounds=configured.rounds)),
+        ("login burst, bounded pool", PasswordPool(workers=configured.workers, max_pending=configured.max_pending,
+                                                   wait_timeout=configured.wait_timeout, rounds=configured.rounds)),
+    ]
+    for name, pool in scenarios:
+        latencies, logins = bench_ingest(headers, pool)
+        report(name, ingest_requests=len(latencies),
+               p50_ms=f"{percentile(latencies, 50) * 1000:.2f}", p99_ms=f"{percentile(latencies, 99) * 1000:.2f}",
+               logins=",".join(f"{status}:{count}" for status, count in sorted(logins.items())) or "-")
@@ -0,0 +1,32 @@
+import time
+
+from common import setup_app, report, app
+from utils.auth_utils import verify_token
+from utils.identity_cache import get_identity_cache
+
+CALLS = 5000
+
+
+#  Time CALLS verify_token() calls for one bearer token, with the identity cache on or off
+def bench_verify(headers, use_cache):
+    cache = get_identity_cache(app)
+    if use_cache:
+        app.extensions['identity_cache'] = cache
+    else:
+        app.extensions.pop('identity_cache', None)
+    with app.test_request_context('/stats/operator', headers=headers):
+        start = time.perf_counter()
+        for _ in range(CALLS):
+            verify_token()
+        elapsed = time.perf_counter() - start
+    app.extensions['identity_cache'] = cache
+    return elapsed
+
+
+if __name__ == '__main__':
+    _, headers = setup_app()
+    uncached = bench_verify(headers, use_cache=False)
+    cached = bench_verify(headers, use_cache=True)
+    report("verify_token uncached", calls=CALLS, us_per_call=f"{uncached / CALLS * 1e6:.1f}")
+    report("verify_token cached", calls=CALLS, us_per_call=f"{cached / CALLS * 1e6:.1f}",
+           **get_identity_cache(app).stats())
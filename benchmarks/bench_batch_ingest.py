@@ -0,0 +1,43 @@
+import time
+
+from common import setup_app, report
+
+ROWS = 2000
+BATCH_SIZE = 200
+
+
+def measurement(i):
+    return {
+        "operator": "Alfa" if i % 2 else "Touch",
+        "signal_power": -70.0 - (i % 30),
+        "sinr": 10.0 + (i % 15),
+        "network_type": ["2G", "3G", "4G"][i % 3],
+        "frequency_band": "1800",
+        "cell_id": str(1000 + i % 50),
+        "timestamp": "12 Mar 2025 10:15 AM",
+        "device_mac": "AA:BB:CC:DD:EE:FF",
+        "device_id": f"device-{i % 20}",
+    }
+
+
+def bench_single(client, headers):
+    start = time.perf_counter()
+    for i in range(ROWS):
+        client.post('/submit_data', json=measurement(i), headers=headers)
+    return time.perf_counter() - start
+
+
+def bench_batch(client, headers):
+    start = time.perf_counter()
+    for offset in range(0, ROWS, BATCH_SIZE):
+        batch = [measurement(i) for i in range(offset, offset + BATCH_SIZE)]
+        client.post('/submit_data/batch', json=batch, headers=headers)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    client, headers = setup_app()
+    single = bench_single(client, headers)
+    batch = bench_batch(client, headers)
+    report("single", rows=ROWS, seconds=f"{single:.3f}", rows_per_sec=f"{ROWS / single:.0f}")
+    report("batch", rows=ROWS, batch_size=BATCH_SIZE, seconds=f"{batch:.3f}", rows_per_sec=f"{ROWS / batch:.0f}")
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("RESPONSE_CACHE", "false")  # time the computation, not cache hits
+
+from common import setup_app, report, close, app  # noqa: E402
+from synthetic import SyntheticCellData, load  # noqa: E402
+from utils.cells import load_cells  # noqa: E402
+from utils.rollups import compact_rollups  # noqa: E402
+
+ROWS = 500000
+WINDOW = "start_date=2025-01-01T00:00:00&end_date=2025-01-29T00:00:00"
+
+
+def timed_get(client, headers, url):
+    start = time.perf_counter()
+    response = client.get(url, headers=headers)
+    return time.perf_counter() - start, response.get_json()
+
+
+def main():
+    client, headers = setup_app("bench_admin", "admin")
+    window = (datetime(2025, 1, 1), datetime(2025, 1, 29))
+    with app.app_context():
+        load(SyntheticCellData(seed=42), ROWS)
+
+    # Every raw row first, then whole hours from the per-cell rollups: the answers must not change
+    answers = {}
+    for phase in ("raw rows", "cell rollups"):
+        with app.app_context():
+            if phase == "cell rollups":
+                start = time.perf_counter()
+                written = compact_rollups("cell")
+                report("compact cell rollups", rollups=written, seconds=f"{time.perf_counter() - start:.3f}")
+
+            # Split the route time into reading the window and the per-cell NumPy work
+            start = time.perf_counter()
+            cells = load_cells(*window, {}, (5, 50, 95))
+            load_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            cells.worst("sinr", "p5", 10, 30)
+            rank_seconds = time.perf_counter() - start
+        report(f"load_cells ({phase})", cells=cells.size, seconds=f"{load_seconds:.3f}")
+        report(f"worst rank ({phase})", cells=cells.size, ms=f"{rank_seconds * 1000:.2f}")
+
+        for url in (f"/admin/worst_cells?{WINDOW}&statistic=p5", f"/admin/cell_summary?{WINDOW}"):
+            seconds, payload = timed_get(client, headers, url)
+            answers.setdefault(url, []).append(payload)
+            report(f"{url.split('?')[0]} ({phase})", rows=ROWS, cells=len(payload["cells"]), seconds=f"{seconds:.3f}")
+
+    failures = 0
+    for url, (raw, rolled) in answers.items():
+        same = close(raw, rolled)
+        failures += not same
+        print(f"{'ok  ' if same else 'FAIL'} {url.split('?')[0]}: same answer from rollups as from raw rows")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Measure the compact CellRecord schema against the old one, and check the migration between them.
+
+Loads synthetic measurements into an old-schema cell_record (text categories, username, text IP/MAC)
+and measures its size, insert cost and scan speed; converts it with upgrade_schema() and checks
+every row reads back identically; then measures the compact table the same way, with rows inserted
+fresh through insert_records. Exits non-zero when the converted rows differ.
+"""
+import sys
+import time
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, func, insert, select, text
+
+from common import setup_app, report, app
+from models import db, CellRecord, User
+from synthetic import SyntheticCellData, ensure_users
+from utils.migrations import LEGACY_CELL_RECORD, upgrade_schema
+from utils.sharding import insert_records
+
+ROWS = 200000
+BATCH = 10000
+COLUMNS = ("operator", "signal_power", "sinr", "network_type", "frequency_band", "cell_id", "timestamp",
+           "device_ip", "device_mac", "device_id", "username")
+
+# The cell_record schema before dictionary encoding
+legacy_metadata = MetaData()
+legacy = Table(
+    "cell_record", legacy_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("operator", String(50)),
+    Column("signal_power", Float),
+    Column("sinr", Float),
+    Column("network_type", String(10)),
+    Column("frequency_band", String(50)),
+    Column("cell_id", String(100)),
+    Column("timestamp", DateTime),
+    Column("device_ip", String(50)),
+    Column("device_mac", String(50)),
+    Column("device_id", String(100)),
+    Column("username", String(50), ForeignKey(User.__table__.c.username), nullable=False),
+)
+for name, columns in (
+    ("ix_cell_record_user_device_ts", ("username", "device_id", "timestamp")),
+    ("ix_cell_record_ts_network_type", ("timestamp", "network_type")),
+    ("ix_cell_record_ts_operator", ("timestamp", "operator")),
+    ("ix_cell_record_device_id", ("device_id",)),
+    ("ix_cell_record_cell_ts", ("cell_id", "timestamp")),
+):
+    legacy.append_constraint(db.Index(name, *(legacy.c[column] for column in columns)))
+
+
+#  Bytes of a table and its indexes
+def table_bytes(name):
+    if db.engine.dialect.name == "sqlite":
+        return db.session.execute(text(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+            "(SELECT name FROM sqlite_master WHERE tbl_name = :name)"
+        ), {"name": name}).scalar()
+    db.session.execute(text(f"ANALYZE TABLE {name}"))
+    return db.session.execute(text(
+        "SELECT data_length + index_length FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name = :name"
+    ), {"name": name}).scalar()
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+#  The two scan shapes of the read paths: grouped totals in SQL, and every row of a window as tuples
+def scans(table):
+    grouped = select(table.c.operator, table.c.network_type, func.count(), func.sum(table.c.signal_power)).group_by(
+        table.c.operator, table.c.network_type
+    )
+    rows = select(table.c.operator, table.c.network_type, table.c.device_id, table.c.signal_power, table.c.sinr)
+    group_seconds, _ = timed(lambda: db.session.execute(grouped).all())
+    row_seconds, result = timed(lambda: db.session.execute(rows).all())
+    return group_seconds, row_seconds, len(result)
+
+
+def measure(name, table, insert_seconds):
+    db.session.commit()
+    db.session.execute(text("VACUUM")) if db.engine.dialect.name == "sqlite" else None
+    size = table_bytes(table.name)
+    group_seconds, row_seconds, rows = scans(table)
+    report(name, rows=rows, bytes=size, bytes_per_row=round(size / rows, 1),
+           inserts_per_s=round(ROWS / insert_seconds), grouped_scan_ms=round(group_seconds * 1000, 1),
+           row_scan_rows_per_s=round(rows / row_seconds))
+
+
+def main():
+    setup_app()
+    with app.app_context():
+        ensure_users()
+        batches = list(SyntheticCellData(seed=11, devices=2000).batches(ROWS, BATCH))
+        CellRecord.__table__.drop(db.engine)
+        legacy.create(db.engine)
+
+        start = time.perf_counter()
+        for rows in batches:
+            db.session.execute(insert(legacy), rows)
+            db.session.commit()
+        measure("old schema", legacy, time.perf_counter() - start)
+        reference = db.session.execute(select(*(legacy.c[name] for name in COLUMNS)).order_by(legacy.c.id)).all()
+        db.session.commit()
+
+        start = time.perf_counter()
+        created = upgrade_schema()
+        report("conversion", seconds=round(time.perf_counter() - start, 2), created=len(created))
+        converted = db.session.execute(select(*(getattr(CellRecord, name) for name in COLUMNS)).order_by(CellRecord.id)).all()
+        same = [tuple(row) for row in converted] == [tuple(row) for row in reference]
+        print(f"{'ok  ' if same else 'FAIL'} {len(converted)} converted rows read back as before")
+
+        db.session.execute(text(f"DROP TABLE {LEGACY_CELL_RECORD}"))
+        db.session.query(CellRecord).delete()
+        db.session.commit()
+        start = time.perf_counter()
+        for rows in batches:
+            insert_records(rows)
+            db.session.commit()
+        measure("compact schema", CellRecord.__table__, time.perf_counter() - start)
+
+    if not same:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Latency and peak memory of /stats/signal_timeseries on one device with millions of rows.
+
+    python benchmarks/bench_timeseries.py --rows 5000000
+
+Compares the streaming LTTB route against loading the whole window and downsampling it in memory,
+and checks that both keep the same points. Exits non-zero when they differ.
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select
+
+from common import setup_app, report, app
+from models import db, CellRecord
+from synthetic import ensure_users
+from utils.sharding import insert_records, read_rows
+
+DEVICE = "ts-device"
+START = datetime(2025, 1, 1)
+INTERVAL = timedelta(seconds=10)
+BATCH = 20000
+MAX_POINTS = (100, 500, 2000)
+
+
+#  One device reporting every 10 seconds, signal levels as random walks, ~1% of SINR values missing
+def seed(rows):
+    rng = random.Random(3)
+    signal_power, sinr = -90.0, 10.0
+    for offset in range(0, rows, BATCH):
+        batch = []
+        for i in range(offset, min(offset + BATCH, rows)):
+            signal_power = min(-45.0, max(-135.0, signal_power + rng.gauss(0, 1.5)))
+            sinr = min(35.0, max(-15.0, sinr + rng.gauss(0, 0.8)))
+            batch.append({
+                "device_id": DEVICE, "username": "bench_user", "operator": "Alfa", "network_type": "4G",
+                "signal_power": round(signal_power, 1), "sinr": None if rng.random() < 0.01 else round(sinr, 1),
+                "timestamp": START + i * INTERVAL,
+            })
+        insert_records(batch)
+        db.session.commit()
+
+
+#  Textbook LTTB over whole arrays, the reference for the streaming sampler
+def reference_lttb(times, values, max_points):
+    valid = ~np.isnan(values)
+    times, values = times[valid], values[valid]
+    total = len(times)
+    if total <= max_points:
+        return times.tolist(), values.tolist()
+    every = (total - 2) / (max_points - 2)
+    kept = [0]
+    for bucket in range(max_points - 2):
+        start, end = int(bucket * every) + 1, int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, total)
+        next_time, next_value = times[end:next_end].mean(), values[end:next_end].mean()
+        kept_time, kept_value = times[kept[-1]], values[kept[-1]]
+        areas = np.abs(
+            (kept_time - next_time) * (values[start:end] - kept_value)
+            - (kept_time - times[start:end].astype(float)) * (next_value - kept_value)
+        )
+        kept.append(start + int(np.argmax(areas)))
+    kept.append(total - 1)
+    return times[kept].tolist(), values[kept].tolist()
+
+
+#  The in-memory alternative: every row of the window as tuples, then numpy arrays
+def load_all(window, max_points):
+    rows = read_rows(select(CellRecord.timestamp, CellRecord.signal_power, CellRecord.sinr).where(
+        CellRecord.timestamp.between(*window), CellRecord.username == "bench_user", CellRecord.device_id == DEVICE
+    ), DEVICE)
+    times = np.array([row[0] for row in rows], dtype="datetime64[us]").astype(np.int64)
+    return {
+        metric: reference_lttb(times, np.array([row[index] for row in rows], dtype=float), max_points)
+        for index, metric in ((1, "signal_power"), (2, "sinr"))
+    }
+
+
+def measured(fn):
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000000)
+    args = parser.parse_args()
+
+    client, headers = setup_app()
+    window = (START, START + args.rows * INTERVAL)
+    with app.app_context():
+        ensure_users()
+        db.session.query(CellRecord).filter(CellRecord.device_id == DEVICE).delete()
+        db.session.commit()
+        seed(args.rows)
+
+    query = f"start_date={window[0].isoformat()}&end_date={window[1].isoformat()}&device_id={DEVICE}"
+    failures = 0
+    for max_points in MAX_POINTS:
+        url = f"/stats/signal_timeseries?{query}&max_points={max_points}"
+        response, seconds, peak = measured(lambda: client.get(url, headers=headers))
+        report(f"streaming max_points={max_points}", rows=args.rows, seconds=round(seconds, 2),
+               rows_per_s=round(args.rows / seconds), peak_mb=round(peak / 2 ** 20, 1))
+
+        with app.app_context():
+            expected, seconds, peak = measured(lambda: load_all(window, max_points))
+        report(f"load all  max_points={max_points}", rows=args.rows, seconds=round(seconds, 2),
+               rows_per_s=round(args.rows / seconds), peak_mb=round(peak / 2 ** 20, 1))
+
+        body = response.get_json()
+        for metric, (times, values) in expected.items():
+            points = body[metric]["points"]
+            same = (
+                [point[1] for point in points] == values
+                and [point[0] for point in points]
+                == [(datetime(1970, 1, 1) + timedelta(microseconds=t)).isoformat() for t in times]
+            )
+            failures += not same
+            print(f"{'ok  ' if same else 'FAIL'} {metric}: {len(points)} of {body[metric]['count']} points, "
+                  f"same as downsampling the whole window")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
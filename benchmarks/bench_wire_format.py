@@ -0,0 +1,64 @@
+import gzip
+import json
+import time
+from datetime import datetime, timezone
+
+import msgpack
+import zstandard
+from werkzeug.test import EnvironBuilder
+
+from common import report
+from synthetic import SyntheticCellData
+from utils.wire import LEGACY_TIMESTAMP_FORMAT, decode_body, parse_timestamp, parse_legacy_timestamp
+
+RECORDS = 1000
+ROUNDS = 50
+
+
+#  One batch of phone measurements, with timestamps as the legacy string or as epoch milliseconds
+def batch(epoch_ms):
+    rows = []
+    for row in next(SyntheticCellData(seed=7).batches(RECORDS, RECORDS)):
+        row = {key: value for key, value in row.items() if key not in ("device_ip", "username")}
+        if epoch_ms:
+            row["timestamp"] = int(row["timestamp"].replace(tzinfo=timezone.utc).timestamp() * 1000)
+        else:
+            row["timestamp"] = row["timestamp"].strftime(LEGACY_TIMESTAMP_FORMAT)
+        rows.append(row)
+    return rows
+
+
+def strptime_timestamp(value):
+    return datetime.strptime(value, LEGACY_TIMESTAMP_FORMAT)
+
+
+#  Time body decoding plus timestamp parsing for one batch, averaged over ROUNDS requests
+def bench_decode(body, headers, parse):
+    # decode_body() consumes the request stream, so build every request up front
+    requests = [EnvironBuilder(method='POST', data=body, headers=headers).get_request() for _ in range(ROUNDS)]
+    start = time.perf_counter()
+    for req in requests:
+        for row in decode_body(req):
+            parse(row["timestamp"])
+    return (time.perf_counter() - start) / ROUNDS
+
+
+if __name__ == '__main__':
+    legacy = batch(epoch_ms=False)
+    epoch = batch(epoch_ms=True)
+    legacy_json = json.dumps(legacy).encode()
+    epoch_msgpack = msgpack.packb(epoch)
+
+    cases = [
+        ("json strptime", legacy_json, {"Content-Type": "application/json"}, strptime_timestamp),
+        ("json cached parser", legacy_json, {"Content-Type": "application/json"}, parse_timestamp),
+        ("json gzip", gzip.compress(legacy_json),
+         {"Content-Type": "application/json", "Content-Encoding": "gzip"}, parse_timestamp),
+        ("msgpack epoch", epoch_msgpack, {"Content-Type": "application/msgpack"}, parse_timestamp),
+        ("msgpack zstd epoch", zstandard.ZstdCompressor().compress(epoch_msgpack),
+         {"Content-Type": "application/msgpack", "Content-Encoding": "zstd"}, parse_timestamp),
+    ]
+    for name, body, headers, parse in cases:
+        parse_legacy_timestamp.cache_clear()
+        elapsed = bench_decode(body, headers, parse)
+        report(name, records=RECORDS, body_bytes=len(body), ms_per_1000=f"{elapsed / RECORDS * 1e6:.2f}")
@@ -0,0 +1,89 @@
+"""Check the HyperLogLog error bound and the sketch-backed /admin/connected_devices_count.
+
+Sketch estimates must stay within 4 standard errors per trial and 1.5 standard errors RMS,
+merges must equal the sketch of the union, and the route must agree with exact=true.
+Exits non-zero when a check fails.
+"""
+import math
+import os
+import sys
+
+os.environ["RESPONSE_CACHE"] = "false"
+
+from common import setup_app, app  # noqa: E402
+from models import db  # noqa: E402
+from synthetic import SyntheticCellData, load  # noqa: E402
+from utils.device_sketches import get_device_sketches, rebuild_device_sketches  # noqa: E402
+from utils.hll import HyperLogLog, STANDARD_ERROR, merge_all  # noqa: E402
+
+CARDINALITIES = (100, 1000, 5000, 10000, 15000, 50000, 200000)
+TRIALS = 20
+WINDOWS = (
+    "start_date=2025-01-10T09:20:00&end_date=2025-01-10T20:10:00",
+    "start_date=2025-01-03T07:30:00&end_date=2025-01-19T16:45:00",
+    "start_date=2025-01-01T00:00:00&end_date=2025-04-01T00:00:00",
+    "start_date=2025-02-01T00:00:00&end_date=2025-03-01T00:00:00&network_type=4G",
+)
+
+failures = []
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def check_error_bound():
+    for cardinality in CARDINALITIES:
+        errors = []
+        for trial in range(TRIALS):
+            sketch = HyperLogLog()
+            sketch.update(f"device-{trial}-{i}" for i in range(cardinality))
+            errors.append(sketch.estimate() / cardinality - 1)
+        worst = max(abs(error) for error in errors)
+        rms = math.sqrt(sum(error * error for error in errors) / len(errors))
+        check(f"n={cardinality}: max error {worst:.4f}, rms {rms:.4f} (standard error {STANDARD_ERROR:.4f})",
+              worst <= 4 * STANDARD_ERROR and rms <= 1.5 * STANDARD_ERROR)
+
+
+def check_merge():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    left.update(f"device-{i}" for i in range(0, 30000))
+    right.update(f"device-{i}" for i in range(20000, 60000))
+    union.update(f"device-{i}" for i in range(0, 60000))
+    check("merge equals the sketch of the union", merge_all([left, right]).registers == union.registers)
+    check("serialization round-trips", HyperLogLog.from_bytes(union.to_bytes()).registers == union.registers)
+
+
+def check_route(client, headers):
+    with app.app_context():
+        load(SyntheticCellData(seed=11, devices=3000), 200000)
+        rebuild_device_sketches()
+    for window in WINDOWS:
+        approximate = client.get(f"/admin/connected_devices_count?{window}", headers=headers).get_json()
+        exact = client.get(f"/admin/connected_devices_count?{window}&exact=true", headers=headers).get_json()
+        error = (approximate["connected_devices"] - exact["connected_devices"]) / max(exact["connected_devices"], 1)
+        check(f"{window}: {approximate['connected_devices']} vs exact {exact['connected_devices']} "
+              f"({approximate['sketches_merged']} sketches)", abs(error) <= 4 * STANDARD_ERROR)
+
+    # Live ingest: new devices posted through the API show up once the buffer has flushed
+    measurement = {"operator": "Alfa", "network_type": "4G", "timestamp": "15 Jun 2025 10:15 AM"}
+    client.post('/submit_data/batch', json=[{**measurement, "device_id": f"live-{i}"} for i in range(200)],
+                headers=headers)
+    get_device_sketches(app).flush()
+    window = "start_date=2025-06-15T00:00:00&end_date=2025-06-16T00:00:00"
+    live = client.get(f"/admin/connected_devices_count?{window}", headers=headers).get_json()
+    check(f"ingested devices counted from sketches: {live['connected_devices']}",
+          abs(live["connected_devices"] - 200) <= 4 * STANDARD_ERROR * 200 and live["sketches_merged"] > 0)
+
+
+if __name__ == '__main__':
+    check_error_bound()
+    check_merge()
+    client, headers = setup_app("bench_admin", "admin")
+    with app.app_context():
+        db.create_all()
+    check_route(client, headers)
+    if failures:
+        sys.exit(1)
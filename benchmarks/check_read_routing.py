@@ -0,0 +1,72 @@
+"""Check read/write routing with two local sqlite files standing in for the primary and the replica.
+
+Replication is simulated by copying the primary file over the replica file.
+Exits non-zero when a check fails.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+ROUTING_DIR = tempfile.mkdtemp(prefix="cell-routing-")
+PRIMARY = os.path.join(ROUTING_DIR, "primary.db")
+REPLICA_DIR = os.path.join(ROUTING_DIR, "replica")
+REPLICA = os.path.join(REPLICA_DIR, "replica.db")
+os.makedirs(REPLICA_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{PRIMARY}"
+os.environ["REPLICA_DATABASE_URL"] = f"sqlite:///{REPLICA}"
+os.environ["RESPONSE_CACHE"] = "false"
+os.environ["AUTH_CACHE_TTL"] = "0"
+
+from common import setup_app, app  # noqa: E402
+from models import db  # noqa: E402
+from utils.db_routing import REPLICA_BIND  # noqa: E402
+
+MEASUREMENT = {"device_id": "routing-device", "timestamp": "12 Mar 2025 10:15 AM", "operator": "Alfa"}
+STATS_URL = "/admin/device_statistics?username=bench_user&device_id=routing-device"
+
+failures = []
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def replicate():
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    shutil.copyfile(PRIMARY, REPLICA)
+
+
+def main():
+    client, user_headers = setup_app()
+    _, admin_headers = setup_app("bench_admin", "admin")
+    replicate()
+
+    response = client.post('/submit_data', json=MEASUREMENT, headers=user_headers)
+    check("write goes to the primary", response.status_code == 201)
+    check("read is served by the replica (not replicated yet)",
+          client.get(STATS_URL, headers=admin_headers).status_code == 404)
+
+    replicate()
+    check("read sees the row once replicated", client.get(STATS_URL, headers=admin_headers).status_code == 200)
+
+    # Take the replica away: the failing read marks it down and is retried on the primary, the next one
+    # goes to the primary straight away
+    with app.app_context():
+        db.engines[REPLICA_BIND].dispose()
+    shutil.rmtree(REPLICA_DIR)
+    check("read that finds the replica gone is served by the primary",
+          client.get(STATS_URL, headers=admin_headers).status_code == 200)
+    check("read falls back to the primary while the replica is down",
+          client.get(STATS_URL, headers=admin_headers).status_code == 200)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""Check retention: summaries over archived days must answer exactly as before archiving.
+
+Loads synthetic measurements, records the answers of the admin and per-device routes over windows
+before, across and after the retention cutoff, archives everything older than 60 days and asks again.
+The raw rows (paged records and the export) and the rebuilt device registry must not change either.
+Runs once on a single sqlite database and once on two sqlite shards, then checks late data for an
+archived day and a repeated (crash-interrupted) archive write. Reports the archive's size per record.
+Exits non-zero when a check fails.
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+WORK_DIR = tempfile.mkdtemp(prefix="cell-retention-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'primary.db')}"
+os.environ["SHARD_DATABASE_URLS"] = ",".join(f"sqlite:///{os.path.join(WORK_DIR, f'shard{i}.db')}" for i in range(2))
+os.environ["RESPONSE_CACHE"] = "false"
+
+from sqlalchemy import func  # noqa: E402
+
+from common import setup_app, app, report  # noqa: E402
+from models import db, CellRecord, CellRollup, CellStatRollup, Device  # noqa: E402
+from synthetic import SyntheticCellData, load  # noqa: E402
+from utils.archive import ARCHIVE_COLUMNS, ColdArchive, partition_day  # noqa: E402
+from utils.device_registry import rebuild_device_registry  # noqa: E402
+from utils.retention import apply_retention  # noqa: E402
+from utils.rollups import GRANULARITIES, compact_rollups, window_counts  # noqa: E402
+from utils.sharding import scatter  # noqa: E402
+
+ROWS = 40000
+NOW = datetime(2025, 4, 15)
+RETENTION = timedelta(days=60)
+WINDOWS = (
+    "start_date=2025-01-03T07:30:00&end_date=2025-02-20T16:45:00",  # across the cutoff
+    "start_date=2025-01-10T10:15:00&end_date=2025-01-12T08:40:00",  # archived, edges inside hours
+    "start_date=2025-01-10T10:05:00&end_date=2025-01-10T10:50:00",  # archived, no whole hour
+    "start_date=2025-03-01T00:00:00&end_date=2025-03-20T12:00:00",  # live only
+)
+ROUTES = (
+    "/admin/operator_summary?{}",
+    "/admin/dashboard?{}",
+    "/admin/device_activity_trend?{}",
+    "/admin/device_activity_trend?{}&interval=minute",
+    "/admin/signal_distribution?{}&group_by=operator,network_type",
+    "/admin/cell_summary?{}",
+    "/admin/worst_cells?{}&statistic=p5&min_records=5",
+    "/admin/connected_devices_count?{}",
+    "/admin/connected_devices_count?{}&exact=true",
+)
+DEVICE_WINDOW = "start_date=2025-01-01T00:00:00&end_date=2025-02-01T00:00:00"
+DEVICE_ROUTES = (
+    f"/stats/dashboard?{DEVICE_WINDOW}&device_id=api-device-7",
+    f"/stats/signal_distribution?{DEVICE_WINDOW}&device_id=api-device-7",
+    f"/stats/signal_timeseries?{DEVICE_WINDOW}&device_id=api-device-7&max_points=20",
+    "/admin/device_statistics?username=bench_admin&device_id=api-device-7",
+)
+URLS = [route.format(window) for window in WINDOWS for route in ROUTES] + list(DEVICE_ROUTES)
+RECORDS_PAGE = 700
+
+failures = []
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+def api_batch(day, offset):
+    start = int((day - datetime(1970, 1, 1)).total_seconds() * 1000)
+    return [{"device_id": f"api-device-{i}", "timestamp": start + offset + i * 60000, "operator": "Alfa",
+             "network_type": "4G", "signal_power": -90 - i % 7, "sinr": 8 + i % 5, "cell_id": "1001"}
+            for i in range(50)]
+
+
+def answers(client, headers):
+    result = {}
+    for url in URLS:
+        response = client.get(url, headers=headers)
+        result[url] = (response.status_code, rounded(response.get_json()))
+    return result
+
+
+#  Every raw row of the first window through /admin/records pages, and through /admin/export (sorted:
+#  rows with equal timestamps may leave the export in any order)
+def raw_rows(client, headers):
+    records, after = [], None
+    while True:
+        cursor = f"&after={after}" if after else ""
+        body = client.get(f"/admin/records?{WINDOWS[0]}&limit={RECORDS_PAGE}{cursor}", headers=headers).get_json()
+        records += body["records"]
+        after = body["next_cursor"]
+        if after is None:
+            break
+    exported = client.get(f"/admin/export?{WINDOWS[0]}&format=ndjson", headers=headers).get_data(as_text=True)
+    return records, sorted(exported.splitlines())
+
+
+def registry():
+    rebuild_device_registry()
+    return sorted(
+        (device.username, device.device_id, device.last_ip, device.last_mac, device.first_seen, device.last_seen,
+         device.record_count) for device in Device.query.all()
+    )
+
+
+def run_phase(label, client, headers, sharded):
+    shards = app.extensions['shards']
+    if not sharded:
+        app.extensions.pop('shards')
+    archive_dir = os.path.join(WORK_DIR, f"archive-{label}")
+    app.extensions['archive'] = ColdArchive(archive_dir)
+    try:
+        with app.app_context():
+            load(SyntheticCellData(seed=9, devices=80), ROWS)
+        client.post('/submit_data/batch', headers=headers, json=api_batch(datetime(2025, 1, 10), 37 * 60000))
+        with app.app_context():
+            for granularity in GRANULARITIES:
+                scatter(compact_rollups, granularity, now=NOW)
+            total = window_counts(None, datetime(2024, 1, 1), NOW).get(None, 0)
+            devices_before = registry()
+        before = answers(client, headers)
+        records_before, export_before = raw_rows(client, headers)
+
+        with app.app_context():
+            summary = apply_retention(RETENTION, now=NOW)
+            cutoff = partition_day(NOW - RETENTION)
+            left = sum(scatter(lambda: db.session.query(func.count()).filter(CellRecord.timestamp < cutoff).scalar()))
+            minute = sum(scatter(lambda: db.session.query(func.count()).filter(
+                CellRollup.granularity == "minute", CellRollup.bucket_start < cutoff).scalar()))
+            minute += sum(scatter(lambda: db.session.query(func.count()).filter(CellStatRollup.bucket_start < cutoff).scalar()))
+        check(f"{label}: archived {summary['records']} records of {summary['days']} days, until {summary['archived_until']}",
+              summary["records"] > 0 and summary["archived_until"] == cutoff)
+        check(f"{label}: no raw rows, minute or cell rollups left before the cutoff", left == 0 and minute == 0)
+
+        after = answers(client, headers)
+        for url in URLS:
+            check(f"{label}: {url} answers as before archiving",
+                  after[url] == before[url] and after[url][0] == 200)
+        records_after, export_after = raw_rows(client, headers)
+        check(f"{label}: {len(records_after)} paged records as before archiving",
+              records_after == records_before and len(records_before) > RECORDS_PAGE)
+        check(f"{label}: {len(export_after)} exported rows as before archiving", export_after == export_before)
+        with app.app_context():
+            devices_after = registry()
+        check(f"{label}: rebuilt registry of {len(devices_after)} devices as before archiving",
+              devices_after == devices_before)
+
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(archive_dir) for name in names if name.endswith(".npz"))
+        report(f"{label} archive", records=summary["records"], bytes=size,
+               bytes_per_record=round(size / summary["records"], 1))
+
+        # Late rows for an archived day: invisible until the next run merges them into the partition
+        client.post('/submit_data/batch', headers=headers, json=api_batch(datetime(2025, 1, 10), 41 * 60000))
+        with app.app_context():
+            apply_retention(RETENTION, now=NOW)
+            late = window_counts(None, datetime(2024, 1, 1), NOW).get(None, 0)
+        check(f"{label}: late rows merged into their archived day ({total} + 50 = {late})", late == total + 50)
+
+        # An interrupted run wrote the partition but kept the raw rows: the rewrite must not duplicate them
+        with app.app_context():
+            archive = app.extensions['archive']
+            archived = archive.load(datetime(2025, 1, 10))
+            rewritten = archive.append(datetime(2025, 1, 10), {
+                name: archived.column(name) for name in ARCHIVE_COLUMNS + ("source_shard", "source_id")
+            })
+        check(f"{label}: re-archiving rows already in a partition keeps {archived.size} rows",
+              rewritten.size == archived.size > 0)
+    finally:
+        app.extensions['shards'] = shards
+
+
+def main():
+    client, headers = setup_app("bench_admin", "admin")
+    run_phase("unsharded", client, headers, sharded=False)
+
+    # Clear the primary copy, then repeat on the shards
+    with app.app_context():
+        db.session.query(CellRecord).delete()
+        db.session.query(CellRollup).delete()
+        db.session.query(CellStatRollup).delete()
+        db.session.execute(db.text("DELETE FROM rollup_state"))
+        db.session.commit()
+    run_phase("2 shards", client, headers, sharded=True)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Check device-hash sharding with local sqlite files: one primary and three shards.
+
+The same synthetic measurements are loaded onto two shards and, as the reference, onto the primary
+alone; every global route must answer the same from both, and per-device routes must only touch the
+device's shard. The third shard is then added and rebalanced, after a move to it was interrupted
+between the two shards' commits.
+Exits non-zero when a check fails.
+"""
+import json
+import os
+import sys
+import tempfile
+
+SHARD_DIR = tempfile.mkdtemp(prefix="cell-shards-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SHARD_DIR, 'primary.db')}"
+os.environ["SHARD_DATABASE_URLS"] = ",".join(f"sqlite:///{os.path.join(SHARD_DIR, f'shard{i}.db')}" for i in range(3))
+os.environ["RESPONSE_CACHE"] = "false"
+
+from sqlalchemy import event, func, insert, select  # noqa: E402
+
+from common import setup_app, close, app  # noqa: E402
+from models import db, CellRecord  # noqa: E402
+from synthetic import SyntheticCellData, load  # noqa: E402
+from utils.db_routing import shard_bind, shard_scope  # noqa: E402
+from utils.pagination import encode_cursor  # noqa: E402
+from utils.rollups import GRANULARITIES, compact_rollups  # noqa: E402
+from utils.sharding import ShardSet, get_shards, rebalance_shards, scatter, shard_of  # noqa: E402
+
+ROWS = 60000
+DEVICES = 100
+WINDOW = "start_date=2025-01-03T07:30:00&end_date=2025-01-20T16:45:00"
+GLOBAL_ROUTES = (
+    f"/admin/operator_summary?{WINDOW}",
+    f"/admin/network_type_summary?{WINDOW}",
+    f"/admin/signal_power_summary?{WINDOW}",
+    f"/admin/sinr_summary?{WINDOW}",
+    f"/admin/dashboard?{WINDOW}",
+    f"/admin/device_activity_trend?{WINDOW}",
+    f"/admin/device_activity_trend?{WINDOW}&interval=minute",
+    f"/admin/signal_distribution?{WINDOW}&group_by=operator,network_type",
+    f"/admin/cell_summary?{WINDOW}",
+    f"/admin/worst_cells?{WINDOW}&statistic=p5",
+    f"/admin/connected_devices_count?{WINDOW}&exact=true",
+    "/admin/device_statistics?username=bench_admin&device_id=api-device-7",
+)
+DEVICE_ROUTE = "/stats/dashboard?start_date=2025-01-01T00:00:00&end_date=2025-04-01T00:00:00&device_id={}"
+EXPORT_WINDOW = "start_date=2025-01-05T10:00:00&end_date=2025-01-05T14:00:00"
+
+failures = []
+
+
+def check(name, condition):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}")
+    if not condition:
+        failures.append(name)
+
+
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+#  Run fn with the shards unset, so every query goes to the primary's copy of the data
+def on_primary(fn):
+    shards = app.extensions.pop('shards')
+    try:
+        return fn()
+    finally:
+        app.extensions['shards'] = shards
+
+
+def use_shards(count):
+    app.extensions['shards'] = ShardSet(app, count, count)
+
+
+def compact():
+    for granularity in GRANULARITIES:
+        scatter(compact_rollups, granularity)
+
+
+#  Statements per shard bind while fn runs
+def shard_queries(fn):
+    counts = {}
+    listeners = []
+    with app.app_context():
+        for index in range(3):
+            def count(*args, bind=shard_bind(index)):
+                counts[bind] = counts.get(bind, 0) + 1
+            event.listen(db.engines[shard_bind(index)], "before_cursor_execute", count)
+            listeners.append((db.engines[shard_bind(index)], count))
+    try:
+        fn()
+    finally:
+        for engine, listener in listeners:
+            event.remove(engine, "before_cursor_execute", listener)
+    return counts
+
+
+def placement(count):
+    misplaced, total = 0, 0
+    for index in range(count):
+        with shard_scope(index):
+            rows = db.session.query(CellRecord.device_id, func.count()).group_by(CellRecord.device_id).all()
+        db.session.commit()
+        misplaced += sum(rows_of for device_id, rows_of in rows if shard_of(device_id, count) != index)
+        total += sum(rows_of for _, rows_of in rows)
+    return misplaced, total
+
+
+def export_rows(client, headers):
+    lines = client.get(f"/admin/export?{EXPORT_WINDOW}", headers=headers).get_data(as_text=True).splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def without_ids(rows):
+    return sorted(json.dumps({key: value for key, value in row.items() if key != "id"}, sort_keys=True) for row in rows)
+
+
+def check_routes(client, headers, label):
+    for url in GLOBAL_ROUTES:
+        sharded = client.get(url, headers=headers)
+        reference = on_primary(lambda: client.get(url, headers=headers))
+        check(f"{label}: {url.split('?')[0]} matches the unsharded answer",
+              sharded.status_code == reference.status_code == 200
+              and close(sharded.get_json(), reference.get_json()))
+
+    exported = export_rows(client, headers)
+    reference = on_primary(lambda: export_rows(client, headers))
+    check(f"{label}: export streams {len(exported)} rows merged in time order",
+          without_ids(exported) == without_ids(reference)
+          and [row["timestamp"] for row in exported] == sorted(row["timestamp"] for row in exported))
+
+    paged, after = [], None
+    while True:
+        page = client.get(f"/admin/records?{EXPORT_WINDOW}&limit=37" + (f"&after={after}" if after else ""),
+                          headers=headers).get_json()
+        paged += page["records"]
+        after = page["next_cursor"]
+        if after is None:
+            break
+    check(f"{label}: keyset pages over the shards equal the export", paged == exported)
+
+    crafted = encode_cursor(["2025-01-05T11:00:00", "1", {"id": 1}])
+    response = client.get(f"/admin/records?{EXPORT_WINDOW}&after={crafted}", headers=headers)
+    check(f"{label}: a cursor with non-integer shard and id is rejected ({response.status_code})",
+          response.status_code == 400 and response.get_json() == {"error": "Invalid cursor"})
+
+
+#  Copy a device's rows to another shard without deleting them, as a move that stopped after the
+#  target's commit leaves them
+def copy_rows(device_id, source, target):
+    columns = [column for column in CellRecord.__table__.columns if column.name != "id"]
+    with shard_scope(source):
+        rows = db.session.execute(select(*columns).where(CellRecord.device_id == device_id)).all()
+    with shard_scope(target):
+        db.session.execute(insert(CellRecord), [{column.key: row._mapping[column] for column in columns} for row in rows])
+    db.session.commit()
+    return len(rows)
+
+
+def main():
+    client, headers = setup_app("bench_admin", "admin")
+    use_shards(2)
+    with app.app_context():
+        load(SyntheticCellData(seed=5, devices=DEVICES), ROWS)
+        on_primary(lambda: load(SyntheticCellData(seed=5, devices=DEVICES), ROWS))
+        misplaced, total = placement(2)
+    check(f"{total} rows on 2 shards, all on their device's shard", total == ROWS and misplaced == 0)
+
+    batch = [{"device_id": f"api-device-{i}", "timestamp": 1736500000000 + i * 1000, "operator": "Alfa",
+              "network_type": "4G"} for i in range(50)]
+    client.post('/submit_data/batch', headers=headers, json=batch)
+    on_primary(lambda: client.post('/submit_data/batch', headers=headers, json=batch))
+    with app.app_context():
+        misplaced, total = placement(2)
+        compact()
+        on_primary(compact)
+    check("API batch rows routed by device", total == ROWS + 50 and misplaced == 0)
+
+    check_routes(client, headers, "2 shards")
+
+    for device in ("api-device-1", "api-device-7", "api-device-30"):
+        url = DEVICE_ROUTE.format(device)
+        counts = shard_queries(lambda: client.get(url, headers=headers))
+        own = shard_bind(get_shards(app).shard_of(device))
+        check(f"{device}: /stats/dashboard only queries {own} ({counts})", set(counts) == {own})
+        check(f"{device}: /stats/dashboard matches the unsharded answer",
+              rounded(client.get(url, headers=headers).get_json())
+              == on_primary(lambda: rounded(client.get(url, headers=headers).get_json())))
+
+    # Add the third shard: only the devices that now hash to it move
+    with app.app_context():
+        before = {f"device-{i}": shard_of(f"device-{i}", 2) for i in range(DEVICES)}
+        use_shards(3)
+        interrupted = next(device for device in before if shard_of(device, 3) == 2)
+        copied = copy_rows(interrupted, before[interrupted], 2)
+        moved = rebalance_shards()
+        misplaced, total = placement(3)
+        stayed = all(shard_of(device, 3) in (shard, 2) for device, shard in before.items())
+    check(f"rebalance moved {moved}, {total} rows all on their device's shard", total == ROWS + 50 and misplaced == 0)
+    check("only devices of the new shard moved", stayed)
+    check(f"rows already copied by an interrupted move ({copied} of {interrupted}) were not copied twice",
+          copied > 0 and total == ROWS + 50)
+    check_routes(client, headers, "3 shards, rebalanced")
+
+    with app.app_context():
+        compact()
+    check_routes(client, headers, "3 shards, recompacted")
+    print(f"scatter stats: {get_shards(app).stats()}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
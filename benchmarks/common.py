@@ -0,0 +1,48 @@
+import math
+import os
+import sys
+import tempfile
+
+# Benchmarks run against a throwaway sqlite database unless DATABASE_URL is set
+BENCH_DIR = tempfile.mkdtemp(prefix="cell-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from utils.sharding import create_shard_tables  # noqa: E402
+from utils.auth_utils import create_token  # noqa: E402
+
+
+#  Create the schema and a benchmark user, return (test client, auth headers)
+def setup_app(username="bench_user", role="user"):
+    app.config['RATELIMIT_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        create_shard_tables()
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            user = User(username=username, password="bench-password", role=role)
+            db.session.add(user)
+            db.session.commit()
+        token = create_token(user.id)
+    return app.test_client(), {"Authorization": f"Bearer {token}"}
+
+
+#  Print one result line in a stable, greppable format
+def report(name, **values):
+    fields = " ".join(f"{key}={value}" for key, value in values.items())
+    print(f"{name}: {fields}")
+
+
+#  Equal payloads, floats up to rounding: rollups and shards sum the same values in another order
+def close(first, second):
+    if isinstance(first, float) and isinstance(second, float):
+        return math.isclose(first, second, rel_tol=1e-9, abs_tol=1e-9)
+    if isinstance(first, dict) and isinstance(second, dict):
+        return first.keys() == second.keys() and all(close(first[key], second[key]) for key in first)
+    if isinstance(first, list) and isinstance(second, list):
+        return len(first) == len(second) and all(close(a, b) for a, b in zip(first, second))
+    return first == second
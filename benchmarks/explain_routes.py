@@ -0,0 +1,125 @@
+import sys
+
+from sqlalchemy import event, text
+
+from common import setup_app, app
+from models import db
+from utils.device_registry import rebuild_device_registry
+from utils.sharding import insert_records
+from datetime import datetime, timedelta
+
+WINDOW = "start_date=2025-03-01T00:00:00&end_date=2025-03-31T00:00:00"
+
+USER_ROUTES = [
+    f"/stats/operator?{WINDOW}&device_id=bench-device",
+    f"/stats/network_type?{WINDOW}&device_id=bench-device",
+    f"/stats/signal_power_per_network?{WINDOW}&device_id=bench-device",
+    f"/stats/signal_power_per_device?{WINDOW}&device_id=bench-device",
+    f"/stats/sinr_per_network?{WINDOW}&device_id=bench-device",
+    f"/stats/signal_timeseries?{WINDOW}&device_id=bench-device&max_points=50",
+    f"/records?{WINDOW}&limit=100",
+]
+
+ADMIN_ROUTES = [
+    f"/admin/operator_summary?{WINDOW}",
+    f"/admin/network_type_summary?{WINDOW}",
+    f"/admin/signal_power_summary?{WINDOW}",
+    f"/admin/sinr_summary?{WINDOW}",
+    f"/admin/device_activity_trend?{WINDOW}",
+    "/admin/connected_devices_count",
+    "/admin/previously_connected_devices",
+    "/admin/previously_connected_devices?limit=100",
+    "/admin/currently_connected_devices",
+    f"/admin/records?{WINDOW}&limit=100",
+    f"/admin/cell_summary?{WINDOW}",
+    f"/admin/cell_summary?{WINDOW}&cell_id=1001",
+    f"/admin/worst_cells?{WINDOW}",
+    "/admin/device_statistics?username=bench_user&device_id=bench-device",
+]
+
+# Routes whose full scan is known and accepted for now, with the reason
+KNOWN_FULL_SCANS = {}
+
+
+#  A spread of rows plus ANALYZE so the planner sees realistic selectivity
+def seed_records(count=5000):
+    start = datetime(2025, 1, 1)
+    insert_records([
+        {
+            "device_id": f"bench-device-{i % 200}" if i % 50 else "bench-device",
+            "username": "bench_user",
+            "network_type": ["2G", "3G", "4G"][i % 3],
+            "operator": ["Alfa", "Touch"][i % 2],
+            "signal_power": -70.0 - (i % 40),
+            "sinr": float(i % 25),
+            "timestamp": start + timedelta(minutes=30 * i),
+        } for i in range(count)
+    ])
+    db.session.commit()
+    rebuild_device_registry()
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(text("ANALYZE"))
+    else:
+        db.session.execute(text("ANALYZE TABLE cell_record"))
+    db.session.commit()
+
+
+#  Record every SELECT on cell_record issued while fn runs
+def capture_queries(fn):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "cell_record" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+#  Run EXPLAIN for the current dialect, return (plan lines, uses a full table scan)
+def explain(statement, parameters):
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            details = [row[3] for row in rows]
+            full_scan = any(d.startswith("SCAN cell_record") and "COVERING INDEX" not in d for d in details)
+            return details, full_scan
+        rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+        details = [f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']}" for row in rows]
+        full_scan = any(row['table'] == "cell_record" and row['type'] == "ALL" for row in rows)
+        return details, full_scan
+
+
+def main():
+    client, user_headers = setup_app()
+    _, admin_headers = setup_app("bench_admin", "admin")
+    with app.app_context():
+        seed_records()
+
+    regressions = []
+    with app.app_context():
+        routes = [(url, user_headers) for url in USER_ROUTES] + [(url, admin_headers) for url in ADMIN_ROUTES]
+        for url, headers in routes:
+            path = url.split("?")[0]
+            for statement, parameters in capture_queries(lambda: client.get(url, headers=headers)):
+                details, full_scan = explain(statement, parameters)
+                status = "FULL SCAN" if full_scan else "ok"
+                if full_scan and path in KNOWN_FULL_SCANS:
+                    status = f"FULL SCAN (accepted: {KNOWN_FULL_SCANS[path]})"
+                elif full_scan:
+                    regressions.append(path)
+                print(f"{path}: {status}")
+                for line in details:
+                    print(f"    {line}")
+
+    if regressions:
+        print(f"Index regression in: {', '.join(sorted(set(regressions)))}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Drive every route against growing synthetic datasets and record latency, throughput and memory.
+
+    python benchmarks/run_suite.py --sizes 10000 1000000 10000000 --output results.json
+
+Set DATABASE_URL to run against MySQL instead of a throwaway sqlite file.
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+from sqlalchemy.engine import make_url
+
+os.environ.setdefault("RESPONSE_CACHE", "false")  # measure the queries, not cache hits
+
+from common import setup_app, app  # noqa: E402
+from models import db, CellRecord  # noqa: E402
+from synthetic import SyntheticCellData, load  # noqa: E402
+from utils.device_registry import rebuild_device_registry  # noqa: E402
+from utils.rollups import GRANULARITIES, compact_rollups  # noqa: E402
+
+MONTH = "start_date=2025-01-01T00:00:00&end_date=2025-02-01T00:00:00"
+QUARTER = "start_date=2025-01-01T00:00:00&end_date=2025-04-01T00:00:00"
+DAY = "start_date=2025-01-15T00:00:00&end_date=2025-01-16T00:00:00"
+DEVICE = "device_id=device-0"
+
+MEASUREMENT = {
+    "operator": "Alfa", "signal_power": -91.5, "sinr": 11.0, "network_type": "4G", "frequency_band": "1800",
+    "cell_id": "1200", "timestamp": "15 Jan 2025 10:15 AM", "device_mac": "02:00:00:00:00:00", "device_id": "device-0"
+}
+
+
+#  (method, url, auth: None | "user" | "admin", json body or a callable returning one)
+def route_table():
+    counter = iter(range(10 ** 9))
+    return [
+        ("GET", "/", None, None),
+        ("POST", "/register", None, lambda: {"username": f"bench-new-{next(counter)}", "password": "pw"}),
+        ("POST", "/login", None, {"username": "bench_user", "password": "bench-password"}),
+        ("POST", "/admin/login", None, {"username": "bench_admin", "password": "bench-password"}),
+        ("POST", "/submit_data", "user", MEASUREMENT),
+        ("POST", "/submit_data/batch", "user", [MEASUREMENT] * 100),
+        ("GET", f"/stats/operator?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/network_type?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/signal_power_per_network?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/signal_power_per_device?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/sinr_per_network?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/dashboard?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/signal_distribution?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/stats/signal_timeseries?{MONTH}&{DEVICE}", "user", None),
+        ("GET", f"/export?{DAY}&{DEVICE}", "user", None),
+        ("GET", f"/records?{MONTH}&limit=100", "user", None),
+        ("GET", f"/admin/operator_summary?{QUARTER}", "admin", None),
+        ("GET", f"/admin/network_type_summary?{QUARTER}", "admin", None),
+        ("GET", f"/admin/signal_power_summary?{QUARTER}", "admin", None),
+        ("GET", f"/admin/sinr_summary?{QUARTER}", "admin", None),
+        ("GET", f"/admin/dashboard?{QUARTER}", "admin", None),
+        ("GET", f"/admin/signal_distribution?{MONTH}", "admin", None),
+        ("GET", f"/admin/cell_summary?{MONTH}", "admin", None),
+        ("GET", f"/admin/worst_cells?{MONTH}&statistic=p5", "admin", None),
+        ("GET", f"/admin/device_activity_trend?{QUARTER}", "admin", None),
+        ("GET", f"/admin/device_activity_trend?{DAY}&interval=minute", "admin", None),
+        ("GET", "/admin/connected_devices_count", "admin", None),
+        ("GET", "/admin/previously_connected_devices", "admin", None),
+        ("GET", "/admin/previously_connected_devices?limit=100", "admin", None),
+        ("GET", "/admin/currently_connected_devices", "admin", None),
+        ("GET", "/admin/device_statistics?username=bench_user&device_id=device-0", "admin", None),
+        ("GET", f"/admin/export?{DAY}&format=csv", "admin", None),
+        ("GET", f"/admin/records?{MONTH}&limit=100", "admin", None),
+        ("GET", "/admin/ingest_buffer", "admin", None),
+        ("GET", "/admin/auth_cache", "admin", None),
+        ("GET", "/admin/response_cache", "admin", None),
+        ("GET", "/admin/metrics", "admin", None),
+    ]
+
+
+#  Routes registered on the app that the table does not exercise
+def uncovered_routes(table):
+    covered = {url.split("?")[0] for _, url, _, _ in table}
+    return sorted(rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != "static" and rule.rule not in covered)
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def call(client, method, url, headers, body):
+    payload = body() if callable(body) else body
+    response = client.open(url, method=method, headers=headers, json=payload)
+    response.get_data()  # drain streamed responses
+    return response.status_code
+
+
+def bench_route(client, headers, method, url, body, requests):
+    latencies = []
+    statuses = set()
+    start = time.perf_counter()
+    for _ in range(requests):
+        begin = time.perf_counter()
+        statuses.add(call(client, method, url, headers, body))
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+
+    # One extra request under tracemalloc for the peak Python allocation of a single request
+    tracemalloc.start()
+    call(client, method, url, headers, body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "status": sorted(statuses),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** 4, 10 ** 6, 10 ** 7])
+    parser.add_argument("--requests", type=int, default=20, help="requests per route and size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write machine-readable results (JSON) to this file")
+    args = parser.parse_args()
+
+    client, user_headers = setup_app()
+    _, admin_headers = setup_app("bench_admin", "admin")
+    headers = {None: {}, "user": user_headers, "admin": admin_headers}
+    table = route_table()
+    generator = SyntheticCellData(seed=args.seed, devices=max(50, max(args.sizes) // 20000))
+
+    results = []
+    for size in sorted(args.sizes):
+        with app.app_context():
+            existing = db.session.query(CellRecord).count()
+            load_start = time.perf_counter()
+            load(generator, size - existing)
+            rebuild_device_registry()
+            for granularity in GRANULARITIES:
+                compact_rollups(granularity)
+            load_seconds = time.perf_counter() - load_start
+        print(f"== {size} rows (loaded and compacted in {load_seconds:.1f}s)")
+
+        for method, url, auth, body in table:
+            result = bench_route(client, headers[auth], method, url, body, args.requests)
+            results.append({"rows": size, "method": method, "route": url, **result})
+            print(f"{method:4} {url[:70]:70} {result['throughput_rps']:>9} rps  "
+                  f"p50 {result['p50_ms']:>9} ms  p99 {result['p99_ms']:>9} ms  peak {result['peak_alloc_kb']:>9} KiB")
+
+    missing = uncovered_routes(table)
+    if missing:
+        print(f"Routes not covered by the suite: {', '.join(missing)}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "database": make_url(os.environ["DATABASE_URL"]).render_as_string(hide_password=True),
+                    "python": platform.python_version(),
+                    "seed": args.seed,
+                    "requests_per_route": args.requests,
+                    "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+                "results": results,
+                "uncovered_routes": missing,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
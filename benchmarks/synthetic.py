@@ -0,0 +1,94 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from models import db, User
+from utils.sharding import insert_records
+
+START = datetime(2025, 1, 1)
+DAYS = 90
+USERS = 20
+OPERATORS = (("Alfa", 0.55), ("Touch", 0.45))
+NETWORK_TYPES = (("4G", 0.6), ("3G", 0.3), ("2G", 0.1))
+# Typical RSRP/RSCP/RSSI and SINR levels per technology
+SIGNAL_LEVELS = {"4G": (-95.0, 10.0), "3G": (-85.0, 12.0), "2G": (-75.0, 14.0)}
+SINR_LEVELS = {"4G": (12.0, 7.0), "3G": (6.0, 5.0), "2G": (3.0, 4.0)}
+BANDS = {"4G": ("800", "1800", "2600"), "3G": ("900", "2100"), "2G": ("900", "1800")}
+
+
+def username_for(device):
+    return "bench_user" if device % USERS == 0 else f"user-{device % USERS}"
+
+
+#  Seeded generator of realistic measurements. Phones report every 10 seconds while a session lasts
+#  (5 minutes to 2 hours), so timestamps come in bursts per device rather than uniformly spread.
+class SyntheticCellData:
+    def __init__(self, seed=42, devices=500):
+        self.rng = random.Random(seed)
+        self.devices = devices
+
+    def _choice(self, weighted):
+        return self.rng.choices([value for value, _ in weighted], weights=[weight for _, weight in weighted])[0]
+
+    def sessions(self):
+        rng = self.rng
+        while True:
+            device = rng.randrange(self.devices)
+            operator = self._choice(OPERATORS)
+            network_type = self._choice(NETWORK_TYPES)
+            start = START + timedelta(seconds=rng.randrange(DAYS * 86400))
+            length = rng.randint(30, 720)
+            cell_id = str(rng.randrange(1000, 1400))
+            band = rng.choice(BANDS[network_type])
+            signal_mean, signal_sd = SIGNAL_LEVELS[network_type]
+            sinr_mean, sinr_sd = SINR_LEVELS[network_type]
+            for step in range(length):
+                # Occasional handover to another technology within the session
+                if rng.random() < 0.01:
+                    network_type = self._choice(NETWORK_TYPES)
+                    band = rng.choice(BANDS[network_type])
+                    signal_mean, signal_sd = SIGNAL_LEVELS[network_type]
+                    sinr_mean, sinr_sd = SINR_LEVELS[network_type]
+                yield {
+                    "operator": operator,
+                    "signal_power": round(rng.gauss(signal_mean, signal_sd), 1),
+                    "sinr": round(rng.gauss(sinr_mean, sinr_sd), 1),
+                    "network_type": network_type,
+                    "frequency_band": band,
+                    "cell_id": cell_id,
+                    "timestamp": start + timedelta(seconds=10 * step),
+                    "device_ip": f"10.0.{device // 250}.{device % 250}",
+                    "device_mac": f"02:00:00:00:{device // 256:02x}:{device % 256:02x}",
+                    "device_id": f"device-{device}",
+                    "username": username_for(device)
+                }
+
+    #  Yield lists of at most batch_size rows, count rows in total
+    def batches(self, count, batch_size=10000):
+        rows = self.sessions()
+        while count > 0:
+            size = min(batch_size, count)
+            yield [next(rows) for _ in range(size)]
+            count -= size
+
+
+#  Create the synthetic users (with a shared dummy hash, bcrypt would dominate setup time). bench_user
+#  keeps the password the benchmarks log in with; measurements can only reference existing users.
+def ensure_users():
+    existing = {username for (username,) in db.session.query(User.username).all()}
+    if "bench_user" not in existing:
+        db.session.add(User(username="bench_user", password="bench-password"))
+    missing = [f"user-{i}" for i in range(1, USERS) if f"user-{i}" not in existing]
+    if missing:
+        db.session.execute(insert(User), [
+            {"username": username, "hashed_password": "!synthetic", "role": "user"} for username in missing
+        ])
+    db.session.commit()
+
+
+def load(generator, count, batch_size=10000):
+    ensure_users()
+    for rows in generator.batches(count, batch_size):
+        insert_records(rows)
+        db.session.commit()
@@ -10,4 +10,50 @@ DB_PORT = os.getenv("MYSQLPORT")
 DB_NAME = os.getenv("MYSQLDATABASE")
 
 
-DB_CONFIG = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# DATABASE_URL overrides the MySQL settings (e.g. sqlite for local benchmarks)
+DB_CONFIG = os.getenv("DATABASE_URL") or f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Optional read replica for analytics reads (admin and /stats/*); unset means everything uses the primary
+DB_REPLICA_HOST = os.getenv("MYSQLREPLICAHOST")
+DB_REPLICA_PORT = os.getenv("MYSQLREPLICAPORT", DB_PORT)
+DB_REPLICA_CONFIG = os.getenv("REPLICA_DATABASE_URL") or (
+    f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}" if DB_REPLICA_HOST else None
+)
+
+# Optional CellRecord shards (comma-separated URLs, see utils/sharding.py). Shards are only ever appended:
+# the position of a URL is the shard number rows were placed on.
+DB_SHARD_CONFIGS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+
+# Request threads per gunicorn worker, the default of gunicorn.conf.py (which is loaded before the app
+# directory is importable, so it computes the same value itself)
+WORKER_THREADS = int(os.getenv("GUNICORN_THREADS", (
+    int(os.getenv("LIVE_FEED_MAX_STREAMS", 20)) + int(os.getenv("PASSWORD_POOL_MAX_PENDING", 8)) + 4
+)))
+# Threads of a worker that use the primary outside requests: the write-behind and device sketch
+# flushers and the live feed publisher, plus one spare
+BACKGROUND_THREADS = 4
+
+# Connection pools per gunicorn worker: (pool_size, max_overflow, pool_recycle seconds, pool_timeout seconds).
+# Any request thread may hold a primary connection, so pool_size + max_overflow covers all of them.
+DB_POOL = (
+    int(os.getenv("DB_POOL_SIZE", 8)),
+    int(os.getenv("DB_MAX_OVERFLOW", max(WORKER_THREADS + BACKGROUND_THREADS - 8, 0))),
+    int(os.getenv("DB_POOL_RECYCLE", 280)),
+    int(os.getenv("DB_POOL_TIMEOUT", 10)),
+)
+# Replica reads come from request threads only
+DB_REPLICA_POOL = (
+    int(os.getenv("REPLICA_POOL_SIZE", 4)),
+    int(os.getenv("REPLICA_MAX_OVERFLOW", max(WORKER_THREADS - 4, 0))),
+    int(os.getenv("REPLICA_POOL_RECYCLE", 280)),
+    int(os.getenv("REPLICA_POOL_TIMEOUT", 5)),
+)
+# A shard is used by request threads (device reads, ingest), the background flushers and the scatter
+# threads that query every shard at once
+SHARD_SCATTER_WORKERS = int(os.getenv("SHARD_SCATTER_WORKERS", len(DB_SHARD_CONFIGS) or 1))
+DB_SHARD_POOL = (
+    int(os.getenv("SHARD_POOL_SIZE", 4)),
+    int(os.getenv("SHARD_MAX_OVERFLOW", max(WORKER_THREADS + BACKGROUND_THREADS + SHARD_SCATTER_WORKERS - 4, 0))),
+    int(os.getenv("SHARD_POOL_RECYCLE", 280)),
+    int(os.getenv("SHARD_POOL_TIMEOUT", 5)),
+)
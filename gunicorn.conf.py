@@ -0,0 +1,15 @@
+import os
+
+#  gunicorn settings, loaded automatically from the working directory (see Procfile).
+#  Threaded workers: /admin/live_feed streams hold their request thread for as long as the browser
+#  stays connected, and logins hold theirs while bcrypt runs in the password pool, so under the default
+#  sync workers either would pin a whole process (and the pool's pending bound would never be reached).
+#  Each worker gets a thread per capped stream and per pending hash, plus some for everything else
+#  (db_config.py WORKER_THREADS repeats this default to size the connection pools).
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', (
+    int(os.getenv('LIVE_FEED_MAX_STREAMS', 20)) + int(os.getenv('PASSWORD_POOL_MAX_PENDING', 8)) + 4
+)))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
@@ -1,25 +1,152 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 from flask_bcrypt import Bcrypt
+from utils.db_routing import RoutingSession
+from utils.column_types import LookupCode, PackedIP, PackedMAC
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 ma = Marshmallow()
 bcrypt = Bcrypt()
 
+# Categorical columns are stored as codes of lookup tables, and IP / MAC addresses as bytes; the attributes
+# still read and compare as strings (utils/column_types.py). username is stored as the user's id.
 class CellRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    operator = db.Column(db.String(50))
+    operator = db.Column(LookupCode("operator", small=True))
     signal_power = db.Column(db.Float)
     sinr = db.Column(db.Float)
-    network_type = db.Column(db.String(10))
-    frequency_band = db.Column(db.String(50))
+    network_type = db.Column(LookupCode("network_type", small=True))
+    frequency_band = db.Column(LookupCode("frequency_band", small=True))
     cell_id = db.Column(db.String(100))
     timestamp = db.Column(db.DateTime)
-    device_ip = db.Column(db.String(50))
-    device_mac = db.Column(db.String(50))
+    device_ip = db.Column(PackedIP(51))
+    device_mac = db.Column(PackedMAC(51))
+    device_id = db.Column(LookupCode("device_id"))
+    username = db.Column("user_id", LookupCode("username"), db.ForeignKey('user.id'), nullable=False, key="username")
+
+    # Access paths used by the routes: per-user device history, global time windows, device and cell lookups
+    __table_args__ = (
+        db.Index('ix_cell_record_user_device_ts', 'username', 'device_id', 'timestamp'),
+        db.Index('ix_cell_record_ts_network_type', 'timestamp', 'network_type'),
+        db.Index('ix_cell_record_ts_operator', 'timestamp', 'operator'),
+        db.Index('ix_cell_record_device_id', 'device_id'),
+        db.Index('ix_cell_record_cell_ts', 'cell_id', 'timestamp'),
+    )
+
+
+# Lookup tables of the dictionary-encoded CellRecord columns (utils/lookups.py): the id is the stored code.
+# Small enumerations get SMALLINT codes (INTEGER on sqlite, where only that autoincrements).
+SMALL_CODE = db.SmallInteger().with_variant(db.Integer, "sqlite")
+
+
+class OperatorCode(db.Model):
+    id = db.Column(SMALL_CODE, primary_key=True)
+    value = db.Column(db.String(50), unique=True, nullable=False)
+
+
+class NetworkTypeCode(db.Model):
+    id = db.Column(SMALL_CODE, primary_key=True)
+    value = db.Column(db.String(10), unique=True, nullable=False)
+
+
+class FrequencyBandCode(db.Model):
+    id = db.Column(SMALL_CODE, primary_key=True)
+    value = db.Column(db.String(50), unique=True, nullable=False)
+
+
+class DeviceCode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.String(100), unique=True, nullable=False)
+
+
+# Pre-aggregated CellRecord totals per time bucket, written by the rollup compactor (utils/rollups.py)
+class CellRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # "minute" or "hour"
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    operator = db.Column(db.String(50))
+    network_type = db.Column(db.String(10))
+    username = db.Column(db.String(50))
     device_id = db.Column(db.String(100))
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    signal_power_count = db.Column(db.Integer, nullable=False, default=0)
+    signal_power_sum = db.Column(db.Float, nullable=False, default=0.0)
+    signal_power_sq_sum = db.Column(db.Float, nullable=False, default=0.0)
+    sinr_count = db.Column(db.Integer, nullable=False, default=0)
+    sinr_sum = db.Column(db.Float, nullable=False, default=0.0)
+    sinr_sq_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_cell_rollup_bucket', 'granularity', 'bucket_start'),
+        db.Index('ix_cell_rollup_user_device_bucket', 'granularity', 'username', 'device_id', 'bucket_start'),
+    )
+
+
+# Per-cell hour rollups for /admin/cell_summary and /admin/worst_cells, compacted as granularity "cell"
+# (utils/rollups.py), one row per hour, cell and frequency band. Each metric is kept as the distinct values
+# of the bucket with their counts (pack_histogram), so counts, sums and percentiles over any set of buckets
+# match the raw rows; the bucket's devices as a sparse HyperLogLog sketch (utils/hll.py pack_sparse).
+class CellStatRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    operator = db.Column(db.String(50))
+    network_type = db.Column(db.String(10))
+    cell_id = db.Column(db.String(100), nullable=False)
+    frequency_band = db.Column(db.String(50))
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+    devices = db.Column(db.LargeBinary)
+    signal_power_values = db.Column(db.LargeBinary(2 ** 24))  # NULL when the bucket has no values
+    sinr_values = db.Column(db.LargeBinary(2 ** 24))
+
+    __table_args__ = (
+        db.Index('ix_cell_stat_rollup_bucket', 'bucket_start'),
+    )
+
+
+# HyperLogLog sketch of the distinct device_ids per time bucket, operator and network type, merged on ingest
+# (utils/device_sketches.py). NULL operator / network_type are stored as "" so the unique key applies.
+class DeviceSketch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # "hour" or "day"
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    operator = db.Column(db.String(50), nullable=False, default="")
+    network_type = db.Column(db.String(10), nullable=False, default="")
+    registers = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed HyperLogLog registers
+
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'bucket_start', 'operator', 'network_type', name='uq_device_sketch_bucket'),
+    )
+
+
+# How far each rollup granularity has been compacted (buckets before compacted_until are complete).
+# dirty_from marks the earliest compacted bucket that rows were inserted into since, which the
+# next compaction starts from (utils/sharding.py insert_records).
+# The "device_sketch" row instead records from when DeviceSketch covers all data.
+# With shards, CellRecord, CellRollup and the rollup rows of RollupState live on every shard (utils/sharding.py);
+# the "device_sketch" row stays on the primary.
+class RollupState(db.Model):
+    granularity = db.Column(db.String(10), primary_key=True)
+    compacted_until = db.Column(db.DateTime, nullable=False)
+    dirty_from = db.Column(db.DateTime)
+
+
+# One row per (username, device_id), upserted on ingest (utils/device_registry.py)
+class Device(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), db.ForeignKey('user.username'), nullable=False)
+    device_id = db.Column(db.String(100), nullable=False)
+    last_ip = db.Column(db.String(50))
+    last_mac = db.Column(db.String(50))
+    first_seen = db.Column(db.DateTime, nullable=False)
+    last_seen = db.Column(db.DateTime, nullable=False)
+    record_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('username', 'device_id', name='uq_device_username_device_id'),
+        db.Index('ix_device_last_seen', 'last_seen'),
+        db.Index('ix_device_device_id', 'device_id'),
+    )
 
 
 class User(db.Model):
@@ -28,9 +155,10 @@ class User(db.Model):
     hashed_password = db.Column(db.String(200), nullable=False)
     role = db.Column(db.String(10), default="user")
 
-    def __init__(self, username, password, role="user"):
+    #  Routes pass a hashed_password computed on the password pool; scripts may pass the plain password
+    def __init__(self, username, password=None, role="user", hashed_password=None):
         self.username = username
-        self.hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.hashed_password = hashed_password or bcrypt.generate_password_hash(password).decode('utf-8')
         self.role = role
 
 class UserSchema(ma.Schema):
@@ -1,11 +1,41 @@
-from flask import Blueprint, request, jsonify
-from models import db, CellRecord
+from flask import Blueprint, Response, request, jsonify, current_app
+from models import db, CellRecord, Device
+from sqlalchemy import func, distinct
+from utils.db_routing import use_replica
 from utils.auth_utils import verify_admin_token
-from datetime import datetime, timedelta
+from utils.write_behind import get_write_behind
+from utils.identity_cache import get_identity_cache
+from utils.response_cache import get_response_cache, cached_payload
+from utils.export import EXPORT_FORMATS, export_filters, export_response, record_page
+from utils.analytics import load_window, grouped_distribution, distribution_params, parse_percentiles
+from utils.cells import CELL_KEYS, load_cells, cell_selection, worst_cell_params
+from utils.metrics import get_metrics
+from utils.device_registry import device_summary, connected_devices
+from utils.live_feed import ACTIVITY_WINDOW, get_live_feed
+from utils.device_sketches import get_device_sketches, distinct_devices, exact_distinct_devices
+from utils.hll import STANDARD_ERROR
+from utils.password_pool import get_password_pool
+from utils.sharding import get_shards
+from utils.archive import get_archive
+from utils.lookups import get_lookups
+from utils.pagination import page_params, keyset_page, iter_keyset, stream_json_array
+from utils.aggregations import (
+    OPERATORS, NETWORK_TYPES, ADMIN_DASHBOARD_METRICS, percentage_breakdown, average_breakdown,
+    parse_metrics, dashboard_sections, collapse_totals, averages_of
+)
+from utils.rollups import window_totals, window_counts, window_averages, activity_trend
+from datetime import datetime
 
 # Define the blueprint for Admin Routes
 admin_routes = Blueprint("admin_routes", __name__)
 
+
+#  GET routes only read, so their queries may go to the read replica
+@admin_routes.before_request
+def route_reads_to_replica():
+    if request.method == 'GET':
+        use_replica()
+
 # Get operator usage summary (Admin - global)
 @admin_routes.route('/admin/operator_summary', methods=['GET'])
 def operator_summary():
@@ -20,46 +50,64 @@ def operator_summary():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(CellRecord.timestamp.between(start_dt, end_dt)).all()
-    total = len(records)
-    stats = {}
+    def compute():
+        counts = window_counts("operator", start_dt, end_dt)
+        return percentage_breakdown(counts, OPERATORS)
 
-    for rec in records:
-        stats[rec.operator] = stats.get(rec.operator, 0) + 1
+    return jsonify(cached_payload(current_app, "operator_summary", start_dt, end_dt, compute))
 
-    operators = ["Alfa", "Touch"]
-    for op in operators:
-        count = stats.get(op, 0)
-        stats[op] = f"{(count / total) * 100:.2f}%" if total > 0 else "0.00%"
+#  Device listings are keyset-paginated on the primary key when limit or after is given
+#  ({"devices": [...], "next_cursor": ...}); without them the full array is streamed as before
+def device_listing(query):
+    if 'limit' not in request.args and 'after' not in request.args:
+        return stream_json_array(device_summary(d) for d in iter_keyset(query, [Device.id]))
 
-    return jsonify(stats)
+    try:
+        limit, after = page_params(request.args)
+        devices, next_cursor = keyset_page(query, [Device.id], limit, after)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"devices": [device_summary(d) for d in devices], "next_cursor": next_cursor})
 
 # Count of distinct connected devices (by unique device_id)
+#  With start_date/end_date (optional operator, network_type) the count for that window is estimated
+#  from HyperLogLog sketches; exact=true counts the raw rows instead
 @admin_routes.route('/admin/connected_devices_count', methods=['GET'])
 def connected_devices_count():
     verify_admin_token()
-    count = db.session.query(CellRecord.device_id).distinct().count()
-    return jsonify({"connected_devices": count})
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    if not start_date and not end_date:
+        count = db.session.query(func.count(distinct(Device.device_id))).scalar()
+        return jsonify({"connected_devices": count})
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+    operator = request.args.get('operator')
+    network_type = request.args.get('network_type')
+    exact = request.args.get('exact', 'false').lower() == 'true' or not get_device_sketches(current_app)
+
+    def compute():
+        if exact:
+            return {"connected_devices": exact_distinct_devices(start_dt, end_dt, operator, network_type),
+                    "approximate": False}
+        estimate, sketches = distinct_devices(start_dt, end_dt, operator, network_type)
+        return {"connected_devices": estimate, "approximate": True,
+                "standard_error": round(STANDARD_ERROR, 4), "sketches_merged": sketches}
+
+    return jsonify(cached_payload(
+        current_app, "connected_devices_count", start_dt, end_dt, compute,
+        operator=operator, network_type=network_type, exact=exact
+    ))
 
 # Previously connected devices — show username, device_id, IP, MAC
 @admin_routes.route('/admin/previously_connected_devices', methods=['GET'])
 def previously_connected_devices():
     verify_admin_token()
-    devices = db.session.query(
-        CellRecord.username,
-        CellRecord.device_id,
-        CellRecord.device_ip,
-        CellRecord.device_mac
-    ).distinct().all()
-
-    return jsonify([
-        {
-            "username": d.username,
-            "device_id": d.device_id,
-            "ip": d.device_ip,
-            "mac": d.device_mac
-        } for d in devices
-    ])
+    return device_listing(Device.query)
 
 #  Network type usage summary (global)
 @admin_routes.route('/admin/network_type_summary', methods=['GET'])
@@ -74,19 +122,11 @@ def admin_network_type_summary():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(CellRecord.timestamp.between(start_dt, end_dt)).all()
-    total = len(records)
-    stats = {}
-
-    for rec in records:
-        stats[rec.network_type] = stats.get(rec.network_type, 0) + 1
-
-    network_types = ["2G", "3G", "4G"]
-    for nt in network_types:
-        count = stats.get(nt, 0)
-        stats[nt] = f"{(count / total) * 100:.2f}%" if total > 0 else "0.00%"
+    def compute():
+        counts = window_counts("network_type", start_dt, end_dt)
+        return percentage_breakdown(counts, NETWORK_TYPES)
 
-    return jsonify(stats)
+    return jsonify(cached_payload(current_app, "network_type_summary", start_dt, end_dt, compute))
 
 # Average signal power summary (global)
 @admin_routes.route('/admin/signal_power_summary', methods=['GET'])
@@ -101,15 +141,11 @@ def admin_signal_power_summary():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(CellRecord.timestamp.between(start_dt, end_dt)).all()
-    stats = {}
+    def compute():
+        averages = window_averages("signal_power", "network_type", start_dt, end_dt)
+        return average_breakdown(averages, NETWORK_TYPES)
 
-    for rec in records:
-        stats.setdefault(rec.network_type, []).append(rec.signal_power)
-
-    network_types = ["2G", "3G", "4G"]
-    avg_stats = {nt: (sum(stats[nt]) / len(stats[nt]) if nt in stats else 0.0) for nt in network_types}
-    return jsonify(avg_stats)
+    return jsonify(cached_payload(current_app, "signal_power_summary", start_dt, end_dt, compute))
 
 #  SINR summary (global)
 @admin_routes.route('/admin/sinr_summary', methods=['GET'])
@@ -124,15 +160,130 @@ def admin_sinr_summary():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(CellRecord.timestamp.between(start_dt, end_dt)).all()
-    stats = {}
+    def compute():
+        averages = window_averages("sinr", "network_type", start_dt, end_dt)
+        return average_breakdown(averages, NETWORK_TYPES)
+
+    return jsonify(cached_payload(current_app, "sinr_summary", start_dt, end_dt, compute))
+
+#  All global summaries from a single aggregation (metrics=operator_summary,sinr_summary,...)
+@admin_routes.route('/admin/dashboard', methods=['GET'])
+def admin_dashboard():
+    verify_admin_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    try:
+        metrics = parse_metrics(request.args.get('metrics'), ADMIN_DASHBOARD_METRICS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+
+    def compute():
+        totals = window_totals(("operator", "network_type"), start_dt, end_dt)
+        return dashboard_sections(totals, metrics)
+
+    return jsonify(cached_payload(current_app, "dashboard", start_dt, end_dt, compute, metrics=",".join(metrics)))
+
+#  Percentiles, spread and histograms of signal power / SINR per group (global)
+#  (group_by=network_type|operator|operator,network_type, metrics=signal_power,sinr, percentiles=5,50,95)
+@admin_routes.route('/admin/signal_distribution', methods=['GET'])
+def admin_signal_distribution():
+    verify_admin_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    try:
+        group_keys, metrics, percentiles = distribution_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+
+    def compute():
+        arrays = load_window([CellRecord.timestamp.between(start_dt, end_dt)])
+        return grouped_distribution(arrays, group_keys, metrics, percentiles)
+
+    return jsonify(cached_payload(
+        current_app, "signal_distribution", start_dt, end_dt, compute,
+        group_by=",".join(group_keys), metrics=",".join(metrics), percentiles=",".join(f"{p:g}" for p in percentiles)
+    ))
+
+
+#  Per-cell record and distinct device counts with signal power / SINR mean and percentiles
+#  (filters: operator, network_type, cell_id; percentiles=5,50,95)
+@admin_routes.route('/admin/cell_summary', methods=['GET'])
+def cell_summary():
+    verify_admin_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
 
-    for rec in records:
-        stats.setdefault(rec.network_type, []).append(rec.sinr)
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    try:
+        percentiles = parse_percentiles(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+    selection = cell_selection(request.args)
+
+    def compute():
+        cells = load_cells(start_dt, end_dt, selection, percentiles)
+        return {"cells": [cells.summary(cell) for cell in range(cells.size)]}
+
+    return jsonify(cached_payload(
+        current_app, "cell_summary", start_dt, end_dt, compute,
+        percentiles=",".join(f"{p:g}" for p in percentiles), **{key: request.args.get(key) for key in CELL_KEYS}
+    ))
+
+
+#  Top-N degrading cells: lowest metric statistic among cells with enough samples
+#  (metric=sinr|signal_power, statistic=mean|p5|p50|..., limit=10, min_records=30, filters as cell_summary)
+@admin_routes.route('/admin/worst_cells', methods=['GET'])
+def worst_cells():
+    verify_admin_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+
+    if not start_date or not end_date:
+        return jsonify({"error": "Start and end dates required"}), 400
+
+    try:
+        metric, statistic, limit, min_records, percentiles = worst_cell_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+    selection = cell_selection(request.args)
+
+    def compute():
+        cells = load_cells(start_dt, end_dt, selection, percentiles)
+        return {
+            "metric": metric,
+            "statistic": statistic,
+            "cells_ranked": int((cells.stats[metric]["count"] >= min_records).sum()),
+            "cells": cells.worst(metric, statistic, limit, min_records)
+        }
+
+    return jsonify(cached_payload(
+        current_app, "worst_cells", start_dt, end_dt, compute,
+        metric=metric, statistic=statistic, limit=limit, min_records=min_records,
+        percentiles=",".join(f"{p:g}" for p in percentiles), **{key: request.args.get(key) for key in CELL_KEYS}
+    ))
 
-    network_types = ["2G", "3G", "4G"]
-    avg_stats = {nt: (sum(stats[nt]) / len(stats[nt]) if nt in stats else 0.0) for nt in network_types}
-    return jsonify(avg_stats)
 
 #  Device activity trend (global) with interval support
 @admin_routes.route('/admin/device_activity_trend', methods=['GET'])
@@ -148,24 +299,16 @@ def device_activity_trend():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(CellRecord.timestamp.between(start_dt, end_dt)).all()
-    trend = {}
-
-    for rec in records:
-        if interval == 'minute':
-            time_slot = rec.timestamp.strftime('%Y-%m-%d %H:%M')
-        else:  # default hour
-            time_slot = rec.timestamp.strftime('%Y-%m-%d %H:00')
-
-        trend[time_slot] = trend.get(time_slot, 0) + 1
+    interval = 'minute' if interval == 'minute' else 'hour'
 
-    timestamps = sorted(trend.keys())
-    counts = [trend[ts] for ts in timestamps]
+    def compute():
+        timestamps, counts = activity_trend(start_dt, end_dt, interval)
+        return {
+            "timestamps": timestamps,
+            "counts": counts
+        }
 
-    return jsonify({
-        "timestamps": timestamps,
-        "counts": counts
-    })
+    return jsonify(cached_payload(current_app, "device_activity_trend", start_dt, end_dt, compute, interval=interval))
 
 
 #  Device statistics by username & device_id
@@ -178,44 +321,144 @@ def device_statistics():
     if not username or not device_id:
         return jsonify({"error": "Username and Device ID are required"}), 400
 
-    records = CellRecord.query.filter_by(username=username, device_id=device_id).all()
-    if not records:
+    device = Device.query.filter_by(username=username, device_id=device_id).first()
+    if not device:
         return jsonify({"error": "No data found for this user/device"}), 404
 
-    count = len(records)
-    avg_signal_power = sum(r.signal_power for r in records) / count
-    avg_sinr = sum(r.sinr for r in records) / count
-    network_types = list(set(r.network_type for r in records))
-    last_seen = max(r.timestamp for r in records)
+    # The registry bounds the device's history, so rollups can answer for everything but the edges
+    totals = window_totals("network_type", device.first_seen, device.last_seen, username, device_id)
+    overall = collapse_totals(totals, None).get(None)
+    if not overall:
+        return jsonify({"error": "No data found for this user/device"}), 404
 
     return jsonify({
         "username": username,
         "device_id": device_id,
-        "records_count": count,
-        "average_signal_power": avg_signal_power,
-        "average_sinr": avg_sinr,
-        "connected_network_types": network_types,
-        "last_seen": last_seen.isoformat()
+        "records_count": overall["count"],
+        "average_signal_power": averages_of({None: overall}, "signal_power")[None] or 0.0,
+        "average_sinr": averages_of({None: overall}, "sinr")[None] or 0.0,
+        "connected_network_types": list(totals.keys()),
+        "last_seen": device.last_seen.isoformat()
     })
 
 #  Currently connected devices (show username, device_id, IP, MAC)
 @admin_routes.route('/admin/currently_connected_devices', methods=['GET'])
 def currently_connected_devices():
     verify_admin_token()
-    time_threshold = datetime.utcnow() - timedelta(minutes=5)
-
-    devices = db.session.query(
-        CellRecord.username,
-        CellRecord.device_id,
-        CellRecord.device_ip,
-        CellRecord.device_mac
-    ).filter(CellRecord.timestamp >= time_threshold).distinct().all()
-
-    return jsonify([
-        {
-            "username": d.username,
-            "device_id": d.device_id,
-            "ip": d.device_ip,
-            "mac": d.device_mac
-        } for d in devices
-    ])
+    return device_listing(connected_devices())
+
+
+#  Live dashboard feed (Server-Sent Events): a snapshot of the connected devices and the last minutes'
+#  record counts (read on the replica), then device_join / device_leave events and per-minute count
+#  increments pushed from ingest
+@admin_routes.route('/admin/live_feed', methods=['GET'])
+def live_feed():
+    verify_admin_token()
+    feed = get_live_feed(current_app)
+    if not feed:
+        return jsonify({"error": "Live feed is disabled"}), 404
+
+    subscription = feed.subscribe()
+    if subscription is None:
+        return jsonify({"error": "Too many live feed streams, retry later"}), 503, {"Retry-After": "10"}
+    try:
+        now = datetime.utcnow()
+        labels, counts = activity_trend(now - ACTIVITY_WINDOW, now, "minute")
+        snapshot = feed.seed(connected_devices(now).all(), dict(zip(labels, counts)))
+    except Exception:
+        feed.unsubscribe(subscription)
+        raise
+
+    return Response(feed.stream(subscription, snapshot), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+#  Stream raw measurements of every user as NDJSON or CSV (filters: username, device_id, operator, network_type)
+@admin_routes.route('/admin/export', methods=['GET'])
+def admin_export():
+    verify_admin_token()
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        filters = export_filters(request.args, username=request.args.get('username'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return export_response(filters, fmt)
+
+
+#  Page through raw measurements of every user (limit, after=<next_cursor>; same filters as /admin/export)
+@admin_routes.route('/admin/records', methods=['GET'])
+def admin_records():
+    verify_admin_token()
+
+    try:
+        filters = export_filters(request.args, username=request.args.get('username'))
+        limit, after = page_params(request.args)
+        records, next_cursor = record_page(filters, limit, after)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"records": records, "next_cursor": next_cursor})
+
+
+#  Write-behind ingest buffer counters (queue depth, flush latency)
+@admin_routes.route('/admin/ingest_buffer', methods=['GET'])
+def ingest_buffer_stats():
+    verify_admin_token()
+    buffer = get_write_behind(current_app)
+    if not buffer:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **buffer.stats()})
+
+
+#  Verified-identity cache counters (hits, misses, size)
+@admin_routes.route('/admin/auth_cache', methods=['GET'])
+def auth_cache_stats():
+    verify_admin_token()
+    cache = get_identity_cache(current_app)
+    if not cache:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+
+#  Analytics response cache counters (hit rate, size, invalidations)
+@admin_routes.route('/admin/response_cache', methods=['GET'])
+def response_cache_stats():
+    verify_admin_token()
+    cache = get_response_cache(current_app)
+    if not cache:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **cache.stats()})
+
+
+#  Prometheus scrape endpoint: request/SQL/section metrics plus ingest buffer, cache, live feed, sketch, password pool
+#  and shard scatter counters
+@admin_routes.route('/admin/metrics', methods=['GET'])
+def metrics():
+    verify_admin_token()
+    registry = get_metrics(current_app)
+    if not registry:
+        return jsonify({"error": "Metrics are disabled"}), 404
+
+    gauges = []
+    components = (
+        ("ingest_buffer", get_write_behind(current_app)),
+        ("auth_cache", get_identity_cache(current_app)),
+        ("response_cache", get_response_cache(current_app)),
+        ("live_feed", get_live_feed(current_app)),
+        ("device_sketches", get_device_sketches(current_app)),
+        ("password_pool", get_password_pool(current_app)),
+        ("shards", get_shards(current_app)),
+        ("archive", get_archive(current_app)),
+        ("lookups", get_lookups(current_app)),
+    )
+    for prefix, component in components:
+        if component:
+            for key, value in component.stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges.append((f"{prefix}_{key}", {}, value))
+
+    return Response(registry.render(gauges), mimetype="text/plain; version=0.0.4")
@@ -1,39 +1,171 @@
-from flask import Blueprint, request, jsonify
+import math
+from flask import Blueprint, request, jsonify, current_app
 from models import db, CellRecord
 from datetime import datetime
+from utils.db_routing import use_replica
 from utils.auth_utils import verify_token
+from utils.aggregations import (
+    OPERATORS, NETWORK_TYPES, USER_DASHBOARD_METRICS, percentage_breakdown, average_breakdown,
+    parse_metrics, dashboard_sections
+)
+from utils.rollups import window_totals, window_counts, window_averages
+from utils.write_behind import get_write_behind
+from utils.device_registry import record_devices
+from utils.ingest_hooks import notify_ingest
+from utils.sharding import insert_records, shard_groups
+from utils.export import EXPORT_FORMATS, export_filters, export_response, record_page
+from utils.pagination import page_params
+from utils.analytics import load_window, grouped_distribution, distribution_params
+from utils.timeseries import timeseries_points, timeseries_params
+from utils.wire import UnsupportedEncoding, decode_body, parse_timestamp
 
 #  Define the blueprint for Android App Routes
 app_routes = Blueprint("app_routes", __name__)
 
+
+#  GET routes only read, so their queries may go to the read replica
+@app_routes.before_request
+def route_reads_to_replica():
+    if request.method == 'GET':
+        use_replica()
+
+MAX_BATCH_SIZE = 500
+# Optional text fields of a measurement and their column lengths; signal levels are numbers or null
+TEXT_FIELDS = {"operator": 50, "network_type": 10, "frequency_band": 50, "cell_id": 100, "device_mac": 50}
+NUMERIC_FIELDS = ("signal_power", "sinr")
+MAX_DEVICE_ID_LENGTH = 100
+
+
+#  Build the column values of a CellRecord from one submitted measurement; raises ValueError naming the
+#  first invalid field, so a bad item is rejected before it can fail the insert of the others
+def build_record_values(data, username, device_ip):
+    if not isinstance(data, dict) or 'device_id' not in data:
+        raise ValueError("Invalid data or missing device_id")
+    device_id = data.get('device_id')
+    if isinstance(device_id, bool) or not isinstance(device_id, (str, int)) or device_id == "":
+        raise ValueError("device_id must be a non-empty string or integer")
+    device_id = str(device_id)
+    if len(device_id) > MAX_DEVICE_ID_LENGTH:
+        raise ValueError(f"device_id must be at most {MAX_DEVICE_ID_LENGTH} characters")
+    for name in NUMERIC_FIELDS:
+        value = data.get(name)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+        ):
+            raise ValueError(f"{name} must be a number or null")
+    for name, length in TEXT_FIELDS.items():
+        value = data.get(name)
+        if value is not None and (not isinstance(value, str) or len(value) > length):
+            raise ValueError(f"{name} must be a string of at most {length} characters or null")
+    timestamp = parse_timestamp(data.get('timestamp'))
+
+    return {
+        "operator": data.get('operator'),
+        "signal_power": data.get('signal_power'),
+        "sinr": data.get('sinr'),
+        "network_type": data.get('network_type'),
+        "frequency_band": data.get('frequency_band'),
+        "cell_id": data.get('cell_id'),
+        "timestamp": timestamp,
+        "device_ip": device_ip,
+        "device_mac": data.get('device_mac'),
+        "device_id": device_id,
+        "username": username  # ✅ Store username in record
+    }
+
+
 #  Submit network data (Android sends data every 10 seconds)
+#  Body: JSON or msgpack, optionally gzip/zstd compressed; timestamp as epoch ms or the legacy string
 @app_routes.route('/submit_data', methods=['POST'])
 def submit_data():
     user = verify_token()  # Ensure authenticated request
-    
-    data = request.json
-    if not data or 'device_id' not in data:
-        return jsonify({"error": "Invalid data or missing device_id"}), 400
 
     try:
-        record = CellRecord(
-            operator=data.get('operator'),
-            signal_power=data.get('signal_power'),
-            sinr=data.get('sinr'),
-            network_type=data.get('network_type'),
-            frequency_band=data.get('frequency_band'),
-            cell_id=data.get('cell_id'),
-            timestamp=datetime.strptime(data.get('timestamp'), "%d %b %Y %I:%M %p"),
-            device_ip=request.remote_addr,
-            device_mac=data.get('device_mac'),
-            device_id=data.get('device_id'),
-            username=user.username  # ✅ Store username in record
-        )
-        db.session.add(record)
+        data = decode_body(request)
+    except UnsupportedEncoding as e:
+        return jsonify({"error": str(e)}), 415
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        values = build_record_values(data, user.username, request.remote_addr)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Write-behind mode: queue the validated row and let the background flusher commit
+    buffer = get_write_behind(current_app)
+    if buffer:
+        if not buffer.submit(values):
+            return jsonify({"error": "Ingest queue is full, retry later"}), 503
+        return jsonify({"message": "✅ Data accepted for processing"}), 202
+
+    try:
+        insert_records([values])
+        record_devices([values])
         db.session.commit()
-        return jsonify({"message": "✅ Data submitted successfully!"}), 201
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("Storing a measurement failed")
+        return jsonify({"error": "Failed to store the measurement, retry later"}), 500
+    notify_ingest(current_app, [values])
+    return jsonify({"message": "✅ Data submitted successfully!"}), 201
+
+
+#  Submit many measurements at once (validated one by one, inserted in one transaction per shard).
+#  Invalid items, and the items of a shard that failed, are reported with their error and the others
+#  are inserted (207).
+@app_routes.route('/submit_data/batch', methods=['POST'])
+def submit_data_batch():
+    user = verify_token()
+
+    try:
+        items = decode_body(request)
+    except UnsupportedEncoding as e:
+        return jsonify({"error": str(e)}), 415
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty JSON array of measurements"}), 400
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch too large (max {MAX_BATCH_SIZE} measurements)"}), 413
+
+    results = []
+    rows = []
+    row_indexes = {}  # id(row) -> index of its item
+    for index, item in enumerate(items):
+        try:
+            rows.append(build_record_values(item, user.username, request.remote_addr))
+            row_indexes[id(rows[-1])] = index
+            results.append({"index": index, "status": "ok"})
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+
+    # Committed per shard: a failing shard only fails the items stored on it
+    stored = []
+    for group in shard_groups(rows):
+        try:
+            insert_records(group)
+            record_devices(group)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Storing a batch of %d measurements failed", len(group))
+            for row in group:
+                results[row_indexes[id(row)]].update({
+                    "status": "error", "error": "Failed to store the measurement, retry later"
+                })
+            continue
+        stored += group
+    if stored:
+        notify_ingest(current_app, stored)
+
+    failed = len(items) - len(stored)
+    if failed == 0:
+        status = 201
+    elif stored:
+        status = 207
+    else:
+        status = 500 if rows else 400
+    return jsonify({"inserted": len(stored), "failed": failed, "results": results}), status
 
 
 #  Get average connectivity time per operator (by username & device_id)
@@ -49,24 +181,9 @@ def operator_stats():
 
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
-    
-    records = CellRecord.query.filter(
-        CellRecord.timestamp.between(start_dt, end_dt),
-        CellRecord.device_id == device_id,
-        CellRecord.username == user.username
-    ).all()
-
-    total = len(records)
-    stats = {}
-    for rec in records:
-        stats[rec.operator] = stats.get(rec.operator, 0) + 1
 
-    operators = ["Alfa", "Touch"]
-    for op in operators:
-        count = stats.get(op, 0)
-        stats[op] = f"{(count / total) * 100:.2f}%" if total > 0 else "0.00%"
-
-    return jsonify(stats)
+    counts = window_counts("operator", start_dt, end_dt, user.username, device_id)
+    return jsonify(percentage_breakdown(counts, OPERATORS))
 
 
 #  Get average connectivity time per network type (by username & device_id)
@@ -83,23 +200,8 @@ def network_type_stats():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(
-        CellRecord.timestamp.between(start_dt, end_dt),
-        CellRecord.device_id == device_id,
-        CellRecord.username == user.username
-    ).all()
-
-    total = len(records)
-    stats = {}
-    for rec in records:
-        stats[rec.network_type] = stats.get(rec.network_type, 0) + 1
-
-    network_types = ["2G", "3G", "4G"]
-    for nt in network_types:
-        count = stats.get(nt, 0)
-        stats[nt] = f"{(count / total) * 100:.2f}%" if total > 0 else "0.00%"
-
-    return jsonify(stats)
+    counts = window_counts("network_type", start_dt, end_dt, user.username, device_id)
+    return jsonify(percentage_breakdown(counts, NETWORK_TYPES))
 
 
 #  Get average signal power per network type (by username & device_id)
@@ -116,19 +218,8 @@ def signal_power_per_network():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(
-        CellRecord.timestamp.between(start_dt, end_dt),
-        CellRecord.device_id == device_id,
-        CellRecord.username == user.username
-    ).all()
-
-    stats = {}
-    for rec in records:
-        stats.setdefault(rec.network_type, []).append(rec.signal_power)
-
-    network_types = ["2G", "3G", "4G"]
-    avg_stats = {nt: (sum(stats[nt]) / len(stats[nt]) if nt in stats else 0.0) for nt in network_types}
-    return jsonify(avg_stats)
+    averages = window_averages("signal_power", "network_type", start_dt, end_dt, user.username, device_id)
+    return jsonify(average_breakdown(averages, NETWORK_TYPES))
 
 
 #  Get average signal power per device (by username & device_id)
@@ -145,18 +236,11 @@ def signal_power_per_device():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(
-        CellRecord.timestamp.between(start_dt, end_dt),
-        CellRecord.device_id == device_id,
-        CellRecord.username == user.username
-    ).all()
-
-    signal_powers = [rec.signal_power for rec in records]
-    avg_power = sum(signal_powers) / len(signal_powers) if signal_powers else 0.0
+    averages = window_averages("signal_power", None, start_dt, end_dt, user.username, device_id)
 
     return jsonify({
         "device_id": device_id,
-        "average_signal_power": avg_power
+        "average_signal_power": averages.get(None) or 0.0
     })
 
 
@@ -174,16 +258,115 @@ def sinr_per_network():
     start_dt = datetime.fromisoformat(start_date)
     end_dt = datetime.fromisoformat(end_date)
 
-    records = CellRecord.query.filter(
+    averages = window_averages("sinr", "network_type", start_dt, end_dt, user.username, device_id)
+    return jsonify(average_breakdown(averages, NETWORK_TYPES))
+
+
+#  All /stats/* metrics for one device from a single aggregation (metrics=operator,sinr_per_network,...)
+@app_routes.route('/stats/dashboard', methods=['GET'])
+def stats_dashboard():
+    user = verify_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    device_id = request.args.get('device_id')
+
+    if not start_date or not end_date or not device_id:
+        return jsonify({"error": "Start date, end date, and device_id required"}), 400
+
+    try:
+        metrics = parse_metrics(request.args.get('metrics'), USER_DASHBOARD_METRICS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+
+    totals = window_totals(("operator", "network_type"), start_dt, end_dt, user.username, device_id)
+    return jsonify(dashboard_sections(totals, metrics, device_id))
+
+
+#  Stream the caller's own raw measurements as NDJSON or CSV (format=ndjson|csv)
+@app_routes.route('/export', methods=['GET'])
+def export_records():
+    user = verify_token()
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        filters = export_filters(request.args, username=user.username)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return export_response(filters, fmt)
+
+
+#  Page through the caller's own raw measurements (limit, after=<next_cursor>; same filters as /export)
+@app_routes.route('/records', methods=['GET'])
+def list_records():
+    user = verify_token()
+
+    try:
+        filters = export_filters(request.args, username=user.username)
+        limit, after = page_params(request.args)
+        records, next_cursor = record_page(filters, limit, after)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"records": records, "next_cursor": next_cursor})
+
+
+#  Percentiles, spread and histograms of signal power / SINR per group for one device
+#  (group_by=network_type|operator|operator,network_type, metrics=signal_power,sinr, percentiles=5,50,95)
+@app_routes.route('/stats/signal_distribution', methods=['GET'])
+def signal_distribution():
+    user = verify_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    device_id = request.args.get('device_id')
+
+    if not start_date or not end_date or not device_id:
+        return jsonify({"error": "Start date, end date, and device_id required"}), 400
+
+    try:
+        group_keys, metrics, percentiles = distribution_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+
+    arrays = load_window([
         CellRecord.timestamp.between(start_dt, end_dt),
-        CellRecord.device_id == device_id,
-        CellRecord.username == user.username
-    ).all()
+        CellRecord.username == user.username,
+        CellRecord.device_id == device_id
+    ], device_id=device_id)
+    return jsonify(grouped_distribution(arrays, group_keys, metrics, percentiles))
 
-    stats = {}
-    for rec in records:
-        stats.setdefault(rec.network_type, []).append(rec.sinr)
 
-    network_types = ["2G", "3G", "4G"]
-    avg_stats = {nt: (sum(stats[nt]) / len(stats[nt]) if nt in stats else 0.0) for nt in network_types}
-    return jsonify(avg_stats)
+#  signal_power / sinr of one device over time, at most max_points points per metric (LTTB downsampling
+#  of the raw rows, streamed in time order; metrics=signal_power,sinr, max_points=500)
+@app_routes.route('/stats/signal_timeseries', methods=['GET'])
+def signal_timeseries():
+    user = verify_token()
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    device_id = request.args.get('device_id')
+
+    if not start_date or not end_date or not device_id:
+        return jsonify({"error": "Start date, end date, and device_id required"}), 400
+
+    try:
+        metrics, max_points = timeseries_params(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    start_dt = datetime.fromisoformat(start_date)
+    end_dt = datetime.fromisoformat(end_date)
+
+    series = timeseries_points([
+        CellRecord.timestamp.between(start_dt, end_dt),
+        CellRecord.username == user.username,
+        CellRecord.device_id == device_id
+    ], device_id, metrics, max_points)
+    return jsonify({"device_id": device_id, "max_points": max_points, **series})
@@ -0,0 +1,161 @@
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+# One throwaway sqlite primary, a replica file and three shards for the whole session, set before the
+# app is imported. The app starts with the three shards; tests that need fewer set them per module.
+TEST_DIR = tempfile.mkdtemp(prefix="cell-tests-")
+PRIMARY = os.path.join(TEST_DIR, "primary.db")
+REPLICA_DIR = os.path.join(TEST_DIR, "replica")
+REPLICA = os.path.join(REPLICA_DIR, "replica.db")
+os.makedirs(REPLICA_DIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{PRIMARY}"
+os.environ["REPLICA_DATABASE_URL"] = f"sqlite:///{REPLICA}"
+os.environ["SHARD_DATABASE_URLS"] = ",".join(f"sqlite:///{os.path.join(TEST_DIR, f'shard{i}.db')}" for i in range(3))
+os.environ["SECRET_KEY"] = "test-secret"
+os.environ["RESPONSE_CACHE"] = "false"
+os.environ["AUTH_CACHE_TTL"] = "0"
+
+from app import app as flask_app  # noqa: E402
+from models import db, User  # noqa: E402
+from utils import db_routing  # noqa: E402
+from utils.auth_utils import create_token  # noqa: E402
+from utils.db_routing import SHARDED_TABLES, shard_bind  # noqa: E402
+from utils.device_sketches import get_device_sketches  # noqa: E402
+from utils.sharding import ShardSet, create_shard_tables, insert_records  # noqa: E402
+
+# Tables kept between modules: users and the lookup tables the process caches codes of
+KEPT_TABLES = {"user", "operator_code", "network_type_code", "frequency_band_code", "device_code"}
+SHARD_COUNT = 3
+
+# Fixture measurements: short sessions of one device reporting every 10 seconds, spread over DAYS from START
+START = datetime(2025, 1, 1)
+DAYS = 90
+FIXTURE_USERS = tuple(f"fixture-user-{i}" for i in range(5))
+BANDS = {"4G": ("800", "1800", "2600"), "3G": ("900", "2100"), "2G": ("900", "1800")}
+
+
+@pytest.fixture(scope="session")
+def app():
+    flask_app.config['RATELIMIT_ENABLED'] = False
+    with flask_app.app_context():
+        db.create_all()
+        create_shard_tables()
+    # Reads stay on the primary unless a test turns the replica on (test_read_routing.py)
+    db_routing._replica_down_until = float("inf")
+    return flask_app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    return app.test_client()
+
+
+#  Auth headers of a user, created on first use
+@pytest.fixture(scope="session")
+def login(app):
+    def headers(username, role="user"):
+        with app.app_context():
+            user = User.query.filter_by(username=username).first()
+            if not user:
+                user = User(username=username, password="test-password", role=role)
+                db.session.add(user)
+                db.session.commit()
+            return {"Authorization": f"Bearer {create_token(user.id)}"}
+    return headers
+
+
+@pytest.fixture(scope="session")
+def admin_headers(login):
+    return login("test_admin", "admin")
+
+
+#  Every module starts from empty measurement tables on the primary and the shards, with all three shards
+@pytest.fixture(scope="module", autouse=True)
+def empty_tables(app):
+    sketches = get_device_sketches(app)
+    if sketches:
+        sketches.flush()
+    app.extensions['shards'] = ShardSet(app, SHARD_COUNT, SHARD_COUNT)
+    with app.app_context():
+        for table in reversed(db.metadata.sorted_tables):
+            if table.name not in KEPT_TABLES:
+                db.session.execute(table.delete())
+        db.session.commit()
+        for index in range(SHARD_COUNT):
+            with db.engines[shard_bind(index)].begin() as connection:
+                for table in reversed(db.metadata.sorted_tables):
+                    if table.name in SHARDED_TABLES:
+                        connection.execute(table.delete())
+    yield
+
+
+#  Run fn with the shards unset, so every query goes to the primary
+def on_primary(app, fn):
+    shards = app.extensions.pop('shards')
+    try:
+        return fn()
+    finally:
+        app.extensions['shards'] = shards
+
+
+def use_shards(app, count):
+    app.extensions['shards'] = ShardSet(app, count, count)
+
+
+#  Floats rounded to 6 places, for answers summed in a different order
+def rounded(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {key: rounded(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [rounded(item) for item in value]
+    return value
+
+
+#  count seeded measurements of `devices` devices; the same seed gives the same rows
+def measurements(seed, devices, count):
+    rng = random.Random(seed)
+    rows = []
+    while len(rows) < count:
+        device = rng.randrange(devices)
+        network_type = rng.choice(("4G", "4G", "3G", "2G"))
+        operator = rng.choice(("Alfa", "Touch"))
+        cell_id = str(rng.randrange(1000, 1100))
+        band = rng.choice(BANDS[network_type])
+        start = START + timedelta(seconds=rng.randrange(DAYS * 86400))
+        for step in range(min(rng.randint(3, 30), count - len(rows))):
+            rows.append({
+                "operator": operator,
+                "signal_power": round(rng.gauss(-90.0, 10.0), 1),
+                "sinr": round(rng.gauss(8.0, 6.0), 1),
+                "network_type": network_type,
+                "frequency_band": band,
+                "cell_id": cell_id,
+                "timestamp": start + timedelta(seconds=10 * step),
+                "device_ip": f"10.0.{device // 250}.{device % 250}",
+                "device_mac": f"02:00:00:00:{device // 256:02x}:{device % 256:02x}",
+                "device_id": f"device-{device}",
+                "username": FIXTURE_USERS[device % len(FIXTURE_USERS)],
+            })
+    return rows
+
+
+#  Store measurements() through insert_records, in batches like the ingest paths
+def load_measurements(seed, devices, count, batch_size=10000):
+    existing = {username for (username,) in db.session.query(User.username)}
+    missing = [username for username in FIXTURE_USERS if username not in existing]
+    if missing:
+        db.session.execute(insert(User), [
+            {"username": username, "hashed_password": "!fixture", "role": "user"} for username in missing
+        ])
+        db.session.commit()
+    rows = measurements(seed, devices, count)
+    for start in range(0, len(rows), batch_size):
+        insert_records(rows[start:start + batch_size])
+        db.session.commit()
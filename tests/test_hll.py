@@ -0,0 +1,74 @@
+import math
+
+import pytest
+
+from tests.conftest import load_measurements
+from utils.device_sketches import get_device_sketches, rebuild_device_sketches
+from utils.hll import HyperLogLog, STANDARD_ERROR, merge_all
+
+TRIALS = 20
+WINDOWS = (
+    "start_date=2025-01-10T09:20:00&end_date=2025-01-10T20:10:00",
+    "start_date=2025-01-03T07:30:00&end_date=2025-01-19T16:45:00",
+    "start_date=2025-01-01T00:00:00&end_date=2025-04-01T00:00:00",
+    "start_date=2025-02-01T00:00:00&end_date=2025-03-01T00:00:00&network_type=4G",
+)
+
+
+#  Estimates stay within 4 standard errors per trial and 1.5 standard errors RMS
+@pytest.mark.parametrize("cardinality", (100, 1000, 10000, 50000))
+def test_error_within_bound(cardinality):
+    errors = []
+    for trial in range(TRIALS):
+        sketch = HyperLogLog()
+        sketch.update(f"device-{trial}-{i}" for i in range(cardinality))
+        errors.append(sketch.estimate() / cardinality - 1)
+    assert max(abs(error) for error in errors) <= 4 * STANDARD_ERROR
+    assert math.sqrt(sum(error * error for error in errors) / len(errors)) <= 1.5 * STANDARD_ERROR
+
+
+def test_merge_equals_sketch_of_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    left.update(f"device-{i}" for i in range(0, 30000))
+    right.update(f"device-{i}" for i in range(20000, 60000))
+    union.update(f"device-{i}" for i in range(0, 60000))
+    assert merge_all([left, right]).registers == union.registers
+
+
+def test_serialization_round_trips():
+    sketch = HyperLogLog()
+    sketch.update(f"device-{i}" for i in range(5000))
+    assert HyperLogLog.from_bytes(sketch.to_bytes()).registers == sketch.registers
+
+
+#  Fixture measurements on the primary alone, with their sketches rebuilt
+@pytest.fixture(scope="module")
+def sketched(app):
+    shards = app.extensions.pop('shards')
+    with app.app_context():
+        load_measurements(seed=11, devices=3000, count=50000)
+        rebuild_device_sketches()
+    yield
+    app.extensions['shards'] = shards
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_route_agrees_with_exact(client, admin_headers, sketched, window):
+    approximate = client.get(f"/admin/connected_devices_count?{window}", headers=admin_headers).get_json()
+    exact = client.get(f"/admin/connected_devices_count?{window}&exact=true", headers=admin_headers).get_json()
+    assert approximate["sketches_merged"] > 0
+    error = (approximate["connected_devices"] - exact["connected_devices"]) / max(exact["connected_devices"], 1)
+    assert abs(error) <= 4 * STANDARD_ERROR
+
+
+#  New devices posted through the API are counted from the sketches once the buffer has flushed
+def test_ingested_devices_counted(app, client, admin_headers, sketched):
+    measurement = {"operator": "Alfa", "network_type": "4G", "timestamp": "15 Jun 2025 10:15 AM"}
+    response = client.post('/submit_data/batch', json=[{**measurement, "device_id": f"live-{i}"} for i in range(200)],
+                           headers=admin_headers)
+    assert response.status_code == 201
+    get_device_sketches(app).flush()
+    window = "start_date=2025-06-15T00:00:00&end_date=2025-06-16T00:00:00"
+    live = client.get(f"/admin/connected_devices_count?{window}", headers=admin_headers).get_json()
+    assert live["sketches_merged"] > 0
+    assert abs(live["connected_devices"] - 200) <= 4 * STANDARD_ERROR * 200
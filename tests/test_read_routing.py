@@ -0,0 +1,69 @@
+import os
+import shutil
+
+import pytest
+
+from models import db, User
+from tests.conftest import PRIMARY, REPLICA, REPLICA_DIR
+from utils import db_routing
+from utils.db_routing import REPLICA_BIND
+
+MEASUREMENT = {"device_id": "routing-device", "timestamp": "12 Mar 2025 10:15 AM", "operator": "Alfa"}
+STATS_URL = "/admin/device_statistics?username=routing_user&device_id=routing-device"
+
+
+#  Replication is simulated by copying the primary file over the replica file
+def replicate(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    os.makedirs(REPLICA_DIR, exist_ok=True)
+    shutil.copyfile(PRIMARY, REPLICA)
+
+
+#  Unsharded, with the replica up; reads go back to the primary afterwards
+@pytest.fixture
+def replica(app):
+    shards = app.extensions.pop('shards')
+    db_routing._replica_down_until = 0.0
+    yield
+    db_routing._replica_down_until = float("inf")
+    app.extensions['shards'] = shards
+    replicate(app)
+
+
+def test_writes_go_to_primary_and_reads_to_replica(app, client, login, admin_headers, replica):
+    user_headers = login("routing_user")
+    replicate(app)
+
+    assert client.post('/submit_data', json=MEASUREMENT, headers=user_headers).status_code == 201
+    # Not replicated yet
+    assert client.get(STATS_URL, headers=admin_headers).status_code == 404
+    replicate(app)
+    assert client.get(STATS_URL, headers=admin_headers).status_code == 200
+
+
+#  The failing read marks the replica down and is retried on the primary; later reads go to the primary
+def test_reads_fall_back_to_primary_while_replica_is_down(app, client, login, admin_headers, replica):
+    user_headers = login("routing_user")
+    replicate(app)
+    assert client.post('/submit_data', json=MEASUREMENT, headers=user_headers).status_code == 201
+
+    with app.app_context():
+        db.engines[REPLICA_BIND].dispose()
+    shutil.rmtree(REPLICA_DIR)
+    assert client.get(STATS_URL, headers=admin_headers).status_code == 200
+    assert not db_routing.replica_available()
+    assert client.get(STATS_URL, headers=admin_headers).status_code == 200
+
+
+#  Admin access is checked on the primary: a demotion the replica has not seen yet applies at once
+def test_demoted_admin_rejected_before_replication(app, client, login, replica):
+    headers = login("demoted_admin", "admin")
+    replicate(app)
+    assert client.get(STATS_URL, headers=headers).status_code != 403
+
+    with app.app_context():
+        User.query.filter_by(username="demoted_admin").update({"role": "user"})
+        db.session.commit()
+    assert client.get(STATS_URL, headers=headers).status_code == 403
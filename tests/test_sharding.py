@@ -0,0 +1,206 @@
+import json
+
+import pytest
+from sqlalchemy import event, func, insert, select
+
+from models import db, CellRecord
+from tests.conftest import load_measurements, on_primary, rounded, use_shards
+from utils.db_routing import shard_bind, shard_scope
+from utils.pagination import encode_cursor
+from utils.rollups import GRANULARITIES, compact_rollups
+from utils.sharding import get_shards, rebalance_shards, scatter, shard_of
+
+# The same fixture measurements on two shards and, as the reference, on the primary alone. The tests
+# run in file order: the ones on two shards first, then the ones after adding the third shard.
+ROWS = 20000
+DEVICES = 60
+WINDOW = "start_date=2025-01-03T07:30:00&end_date=2025-01-20T16:45:00"
+GLOBAL_ROUTES = (
+    f"/admin/operator_summary?{WINDOW}",
+    f"/admin/network_type_summary?{WINDOW}",
+    f"/admin/signal_power_summary?{WINDOW}",
+    f"/admin/sinr_summary?{WINDOW}",
+    f"/admin/dashboard?{WINDOW}",
+    f"/admin/device_activity_trend?{WINDOW}",
+    f"/admin/device_activity_trend?{WINDOW}&interval=minute",
+    f"/admin/signal_distribution?{WINDOW}&group_by=operator,network_type",
+    f"/admin/cell_summary?{WINDOW}",
+    f"/admin/worst_cells?{WINDOW}&statistic=p5",
+    f"/admin/connected_devices_count?{WINDOW}&exact=true",
+    "/admin/device_statistics?username=test_admin&device_id=api-device-7",
+)
+DEVICE_ROUTE = "/stats/dashboard?start_date=2025-01-01T00:00:00&end_date=2025-04-01T00:00:00&device_id={}"
+EXPORT_WINDOW = "start_date=2025-01-05T00:00:00&end_date=2025-01-06T12:00:00"
+PAGE_SIZE = 37
+API_BATCH = [{"device_id": f"api-device-{i}", "timestamp": 1736500000000 + i * 1000, "operator": "Alfa",
+              "network_type": "4G"} for i in range(50)]
+
+
+def compact():
+    for granularity in GRANULARITIES:
+        scatter(compact_rollups, granularity)
+
+
+#  (rows on a shard their device does not hash to, all rows) over `count` shards
+def placement(count):
+    misplaced, total = 0, 0
+    for index in range(count):
+        with shard_scope(index):
+            rows = db.session.query(CellRecord.device_id, func.count()).group_by(CellRecord.device_id).all()
+        db.session.commit()
+        misplaced += sum(rows_of for device_id, rows_of in rows if shard_of(device_id, count) != index)
+        total += sum(rows_of for _, rows_of in rows)
+    return misplaced, total
+
+
+#  Statements per shard bind while fn runs
+def shard_queries(app, fn):
+    counts = {}
+    listeners = []
+    with app.app_context():
+        for index in range(3):
+            def count(*args, bind=shard_bind(index)):
+                counts[bind] = counts.get(bind, 0) + 1
+            event.listen(db.engines[shard_bind(index)], "before_cursor_execute", count)
+            listeners.append((db.engines[shard_bind(index)], count))
+    try:
+        fn()
+    finally:
+        for engine, listener in listeners:
+            event.remove(engine, "before_cursor_execute", listener)
+    return counts
+
+
+def export_rows(client, headers):
+    lines = client.get(f"/admin/export?{EXPORT_WINDOW}", headers=headers).get_data(as_text=True).splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def without_ids(rows):
+    return sorted(json.dumps({key: value for key, value in row.items() if key != "id"}, sort_keys=True) for row in rows)
+
+
+def paged_rows(client, headers):
+    paged, after = [], None
+    while True:
+        page = client.get(f"/admin/records?{EXPORT_WINDOW}&limit={PAGE_SIZE}" + (f"&after={after}" if after else ""),
+                          headers=headers).get_json()
+        paged += page["records"]
+        after = page["next_cursor"]
+        if after is None:
+            return paged
+
+
+def assert_matches_unsharded(app, client, headers, url):
+    sharded = client.get(url, headers=headers)
+    reference = on_primary(app, lambda: client.get(url, headers=headers))
+    assert sharded.status_code == reference.status_code == 200
+    assert rounded(sharded.get_json()) == rounded(reference.get_json())
+
+
+def assert_export_matches_unsharded(app, client, headers):
+    exported = export_rows(client, headers)
+    assert len(exported) > 2 * PAGE_SIZE
+    assert without_ids(exported) == without_ids(on_primary(app, lambda: export_rows(client, headers)))
+    assert [row["timestamp"] for row in exported] == sorted(row["timestamp"] for row in exported)
+    assert paged_rows(client, headers) == exported
+
+
+@pytest.fixture(scope="module")
+def two_shards(app, client, admin_headers):
+    use_shards(app, 2)
+    with app.app_context():
+        load_measurements(seed=5, devices=DEVICES, count=ROWS)
+        on_primary(app, lambda: load_measurements(seed=5, devices=DEVICES, count=ROWS))
+    assert client.post('/submit_data/batch', headers=admin_headers, json=API_BATCH).status_code == 201
+    assert on_primary(app, lambda: client.post('/submit_data/batch', headers=admin_headers, json=API_BATCH)).status_code == 201
+    with app.app_context():
+        compact()
+        on_primary(app, compact)
+
+
+def test_rows_on_their_device_shard(app, two_shards):
+    with app.app_context():
+        assert placement(2) == (0, ROWS + len(API_BATCH))
+
+
+@pytest.mark.parametrize("url", GLOBAL_ROUTES)
+def test_global_route_matches_unsharded(app, client, admin_headers, two_shards, url):
+    assert_matches_unsharded(app, client, admin_headers, url)
+
+
+#  The export merges the shards in time order, and keyset pages over the shards equal it
+def test_export_and_pages_match_unsharded(app, client, admin_headers, two_shards):
+    assert_export_matches_unsharded(app, client, admin_headers)
+
+
+def test_crafted_cursor_rejected(client, admin_headers, two_shards):
+    crafted = encode_cursor(["2025-01-05T11:00:00", "1", {"id": 1}])
+    response = client.get(f"/admin/records?{EXPORT_WINDOW}&after={crafted}", headers=admin_headers)
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor"}
+
+
+@pytest.mark.parametrize("device", ("api-device-1", "api-device-7", "api-device-30"))
+def test_device_route_only_queries_its_shard(app, client, admin_headers, two_shards, device):
+    url = DEVICE_ROUTE.format(device)
+    counts = shard_queries(app, lambda: client.get(url, headers=admin_headers))
+    assert set(counts) == {shard_bind(get_shards(app).shard_of(device))}
+    assert_matches_unsharded(app, client, admin_headers, url)
+
+
+#  Copy a device's rows to another shard without deleting them, as a move that stopped after the
+#  target's commit leaves them
+def copy_rows(device_id, source, target):
+    columns = [column for column in CellRecord.__table__.columns if column.name != "id"]
+    with shard_scope(source):
+        rows = db.session.execute(select(*columns).where(CellRecord.device_id == device_id)).all()
+    with shard_scope(target):
+        db.session.execute(insert(CellRecord), [{column.key: row._mapping[column] for column in columns} for row in rows])
+    db.session.commit()
+    return len(rows)
+
+
+#  Add the third shard after a move to it was interrupted between the two shards' commits
+@pytest.fixture(scope="module")
+def rebalanced(app, two_shards):
+    before = {}
+    with app.app_context():
+        for index in range(2):
+            with shard_scope(index):
+                before.update((device_id, index) for (device_id,) in db.session.execute(select(CellRecord.device_id).distinct()))
+            db.session.commit()
+        use_shards(app, 3)
+        interrupted = next(device for device in sorted(before) if shard_of(device, 3) == 2)
+        copied = copy_rows(interrupted, before[interrupted], 2)
+        rebalance_shards()
+    return before, copied
+
+
+def test_rebalance_moves_only_devices_of_new_shard(app, rebalanced):
+    before, copied = rebalanced
+    assert copied > 0
+    with app.app_context():
+        # Rows already copied by the interrupted move are not copied twice
+        assert placement(3) == (0, ROWS + len(API_BATCH))
+    assert all(shard_of(device, 3) in (shard, 2) for device, shard in before.items())
+
+
+@pytest.mark.parametrize("url", GLOBAL_ROUTES)
+def test_global_route_matches_unsharded_after_rebalance(app, client, admin_headers, rebalanced, url):
+    assert_matches_unsharded(app, client, admin_headers, url)
+
+
+def test_export_and_pages_match_unsharded_after_rebalance(app, client, admin_headers, rebalanced):
+    assert_export_matches_unsharded(app, client, admin_headers)
+
+
+@pytest.fixture(scope="module")
+def recompacted(app, rebalanced):
+    with app.app_context():
+        compact()
+
+
+@pytest.mark.parametrize("url", GLOBAL_ROUTES)
+def test_global_route_matches_unsharded_after_recompaction(app, client, admin_headers, recompacted, url):
+    assert_matches_unsharded(app, client, admin_headers, url)
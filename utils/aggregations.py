@@ -0,0 +1,137 @@
+from sqlalchemy import func
+
+from models import db, CellRecord
+
+OPERATORS = ["Alfa", "Touch"]
+NETWORK_TYPES = ["2G", "3G", "4G"]
+
+USER_DASHBOARD_METRICS = (
+    "operator", "network_type", "signal_power_per_network", "signal_power_per_device", "sinr_per_network"
+)
+ADMIN_DASHBOARD_METRICS = ("operator_summary", "network_type_summary", "signal_power_summary", "sinr_summary")
+
+TOTAL_FIELDS = (
+    "count",
+    "signal_power_count", "signal_power_sum", "signal_power_sq_sum",
+    "sinr_count", "sinr_sum", "sinr_sq_sum",
+)
+
+
+#  Share of each expected category as "xx.xx%"; unexpected categories keep their raw count
+def percentage_breakdown(counts, categories):
+    total = sum(counts.values())
+    stats = dict(counts)
+    for category in categories:
+        count = stats.get(category, 0)
+        stats[category] = f"{(count / total) * 100:.2f}%" if total > 0 else "0.00%"
+    return stats
+
+
+#  Average per expected category, 0.0 for categories without records
+def average_breakdown(averages, categories):
+    return {category: (averages[category] if averages.get(category) is not None else 0.0) for category in categories}
+
+
+#  Per-group COUNT(*) plus non-null COUNT / SUM / SUM of squares of signal_power and sinr
+def grouped_totals(group_columns, filters):
+    return query_totals(group_columns, [
+        func.count(),
+        func.count(CellRecord.signal_power),
+        func.sum(CellRecord.signal_power),
+        func.sum(CellRecord.signal_power * CellRecord.signal_power),
+        func.count(CellRecord.sinr),
+        func.sum(CellRecord.sinr),
+        func.sum(CellRecord.sinr * CellRecord.sinr)
+    ], filters)
+
+
+#  Run aggregates (in TOTAL_FIELDS order) grouped by group_columns.
+#  Results are keyed by None (no columns), the value (one column) or a tuple of values (several).
+def query_totals(group_columns, aggregates, filters):
+    if not group_columns:
+        row = db.session.query(*aggregates).filter(*filters).one()
+        return {None: totals_from_row(row)}
+    width = len(group_columns)
+    rows = db.session.query(*group_columns, *aggregates).filter(*filters).group_by(*group_columns).all()
+    return {
+        (row[0] if width == 1 else tuple(row[:width])): totals_from_row(row[width:])
+        for row in rows
+    }
+
+
+#  Normalize driver types (MySQL returns SUM of integers as Decimal): counts to int, sums to float
+def totals_from_row(row):
+    return {
+        field: int(value or 0) if field.endswith("count") else float(value or 0)
+        for field, value in zip(TOTAL_FIELDS, row)
+    }
+
+
+#  Add the totals of `other` into `totals` in place ({group: {field: value}})
+def merge_totals(totals, other):
+    for group, values in other.items():
+        target = totals.setdefault(group, dict.fromkeys(TOTAL_FIELDS, 0))
+        for field in TOTAL_FIELDS:
+            target[field] += values[field]
+    return totals
+
+
+#  Re-key totals grouped by several columns down to the column at `position` (None: one overall group)
+def collapse_totals(totals, position):
+    collapsed = {}
+    for key, values in totals.items():
+        merge_totals(collapsed, {key[position] if position is not None else None: values})
+    return collapsed
+
+
+def counts_of(totals):
+    return {group: values["count"] for group, values in totals.items()}
+
+
+#  Average of value ("signal_power" or "sinr") per group, None for groups where it is always null
+def averages_of(totals, value):
+    return {
+        group: (values[f"{value}_sum"] / values[f"{value}_count"] if values[f"{value}_count"] else None)
+        for group, values in totals.items()
+    }
+
+
+#  Parse the comma-separated metrics= parameter; all sections when it is missing
+def parse_metrics(raw, allowed):
+    if not raw:
+        return list(allowed)
+    metrics = [metric.strip() for metric in raw.split(",") if metric.strip()]
+    unknown = [metric for metric in metrics if metric not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)} (allowed: {', '.join(allowed)})")
+    return metrics
+
+
+#  Build dashboard sections from one set of totals grouped by (operator, network_type).
+#  Each section has exactly the shape of the matching /stats/* or /admin/*_summary response.
+def dashboard_sections(totals, metrics, device_id=None):
+    by_operator = collapse_totals(totals, 0)
+    by_network_type = collapse_totals(totals, 1)
+    sections = {}
+    for metric in metrics:
+        if metric in ("operator", "operator_summary"):
+            sections[metric] = percentage_breakdown(counts_of(by_operator), OPERATORS)
+        elif metric in ("network_type", "network_type_summary"):
+            sections[metric] = percentage_breakdown(counts_of(by_network_type), NETWORK_TYPES)
+        elif metric in ("signal_power_per_network", "signal_power_summary"):
+            sections[metric] = average_breakdown(averages_of(by_network_type, "signal_power"), NETWORK_TYPES)
+        elif metric in ("sinr_per_network", "sinr_summary"):
+            sections[metric] = average_breakdown(averages_of(by_network_type, "sinr"), NETWORK_TYPES)
+        elif metric == "signal_power_per_device":
+            overall = averages_of(collapse_totals(totals, None), "signal_power")
+            sections[metric] = {"device_id": device_id, "average_signal_power": overall.get(None) or 0.0}
+    return sections
+
+
+#  Label a timestamp with its minute or hour bucket in SQL ("%Y-%m-%d %H:%M" / "%Y-%m-%d %H:00")
+def time_bucket(column, interval):
+    if db.engine.dialect.name == "sqlite":
+        fmt = '%Y-%m-%d %H:%M' if interval == 'minute' else '%Y-%m-%d %H:00'
+        return func.strftime(fmt, column)
+    fmt = '%Y-%m-%d %H:%i' if interval == 'minute' else '%Y-%m-%d %H:00'
+    return func.date_format(column, fmt)
@@ -0,0 +1,161 @@
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, CellRecord
+from utils.archive import archive_days
+from utils.sharding import device_shard, read_rows, shard_results
+
+METRICS = ("signal_power", "sinr")
+GROUP_KEYS = ("operator", "network_type")
+DEFAULT_PERCENTILES = (5, 50, 95)
+STREAM_BATCH_SIZE = 5000
+# Fixed histogram bins so histograms of different windows and groups line up
+HISTOGRAM_EDGES = {
+    "signal_power": np.arange(-140, -39, 5, dtype=float),  # dBm
+    "sinr": np.arange(-20, 41, 2, dtype=float),  # dB
+}
+
+
+#  Column arrays of a window: numeric metrics as float64 (NULL -> NaN), categorical columns as
+#  integer codes into a sorted list of labels. Rows are added in chunks of plain tuples, never ORM
+#  objects, into arrays allocated for `capacity` rows (grown when more arrive); finish() trims them.
+class WindowArrays:
+    def __init__(self, capacity=0):
+        self.size = 0
+        self.labels = {key: [] for key in GROUP_KEYS}
+        self.codes = {key: np.empty(capacity, dtype=np.int64) for key in GROUP_KEYS}
+        self.values = {metric: np.empty(capacity, dtype=float) for metric in METRICS}
+        self._label_codes = {key: {} for key in GROUP_KEYS}  # label -> code, in order of appearance
+
+    #  Append (operator, network_type, signal_power, sinr) rows
+    def add(self, rows):
+        if not rows:
+            return
+        end = self.size + len(rows)
+        if end > len(self.values[METRICS[0]]):
+            self._grow(end)
+        columns = list(zip(*rows))
+        for key, column in zip(GROUP_KEYS, columns):
+            label_codes = self._label_codes[key]
+            self.codes[key][self.size:end] = [label_codes.setdefault(label, len(label_codes)) for label in column]
+        for metric, column in zip(METRICS, columns[len(GROUP_KEYS):]):
+            self.values[metric][self.size:end] = np.array(column, dtype=float)
+        self.size = end
+
+    #  Trim the arrays to the rows added and renumber the labels in sorted order
+    def finish(self):
+        for key, label_codes in self._label_codes.items():
+            labels = list(label_codes)
+            order = sorted(range(len(labels)), key=lambda code: str(labels[code]))
+            renumbered = np.empty(len(labels), dtype=np.int64)
+            renumbered[order] = np.arange(len(labels))
+            self.labels[key] = [labels[code] for code in order]
+            self.codes[key] = renumbered[self.codes[key][:self.size]]
+        self.values = {metric: values[:self.size] for metric, values in self.values.items()}
+        return self
+
+    def _grow(self, size):
+        capacity = max(size, 2 * len(self.values[METRICS[0]]))
+        for arrays in (self.codes, self.values):
+            for name, array in arrays.items():
+                grown = np.empty(capacity, dtype=array.dtype)
+                grown[:self.size] = array[:self.size]
+                arrays[name] = grown
+
+    #  Split row indices by the combination of group keys: {label or (labels...): index array}
+    def groups(self, group_keys):
+        if not group_keys:
+            return {None: np.arange(self.size)}
+        combined = np.zeros(self.size, dtype=np.int64)
+        for key in group_keys:
+            combined = combined * len(self.labels[key]) + self.codes[key]
+        order = np.argsort(combined, kind="stable")
+        unique, starts = np.unique(combined[order], return_index=True)
+        groups = {}
+        for code, indices in zip(unique, np.split(order, starts[1:])):
+            labels = []
+            for key in reversed(group_keys):
+                code, key_code = divmod(int(code), len(self.labels[key]))
+                labels.append(self.labels[key][key_code])
+            labels.reverse()
+            groups[labels[0] if len(labels) == 1 else tuple(labels)] = indices
+        return groups
+
+
+#  The window streamed into WindowArrays STREAM_BATCH_SIZE rows at a time, sized by a count of the
+#  matching rows: the database rows (only the shard of device_id when filters select one device), then
+#  the archived ones a day at a time
+def load_window(filters, device_id=None):
+    columns = [getattr(CellRecord, key) for key in GROUP_KEYS] + [getattr(CellRecord, metric) for metric in METRICS]
+    count = sum(count for (count,) in read_rows(select(func.count()).where(*filters), device_id))
+    arrays = WindowArrays(count)
+
+    stmt = select(*columns).where(*filters).execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    if device_id is not None:
+        with device_shard(device_id):
+            results = [db.session.execute(stmt)]
+    else:
+        results = shard_results(stmt)
+    for result in results:
+        for rows in result.partitions():
+            arrays.add(rows)
+
+    names = [column.key for column in columns]
+    for selected in archive_days([*names, "timestamp"], filters):
+        arrays.add(list(zip(*(selected[name].tolist() for name in names))))
+    return arrays.finish()
+
+
+#  count / mean / std / min / max / percentiles / histogram of one metric over the given values
+def describe(values, metric, percentiles=DEFAULT_PERCENTILES):
+    values = values[~np.isnan(values)]
+    edges = HISTOGRAM_EDGES[metric]
+    counts, _ = np.histogram(np.clip(values, edges[0], edges[-1]), bins=edges)
+    if not values.size:
+        return {
+            "count": 0, "mean": None, "std": None, "min": None, "max": None,
+            "percentiles": {f"p{p:g}": None for p in percentiles},
+            "histogram": {"edges": edges.tolist(), "counts": counts.tolist()}
+        }
+    quantiles = np.percentile(values, percentiles)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+        "min": float(values.min()),
+        "max": float(values.max()),
+        "percentiles": {f"p{p:g}": float(q) for p, q in zip(percentiles, quantiles)},
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()}
+    }
+
+
+#  Distribution of each metric per group; group labels are joined with "/" for JSON keys
+def grouped_distribution(arrays, group_keys, metrics=METRICS, percentiles=DEFAULT_PERCENTILES):
+    result = {}
+    for group, indices in arrays.groups(group_keys).items():
+        label = "/".join(str(part) for part in group) if isinstance(group, tuple) else str(group)
+        result[label] = {
+            metric: describe(arrays.values[metric][indices], metric, percentiles) for metric in metrics
+        }
+    return result
+
+
+#  Parse group_by / metrics / percentiles query parameters; raises ValueError on bad input
+def distribution_params(args):
+    group_keys = tuple(key for key in args.get('group_by', 'network_type').split(",") if key)
+    metrics = tuple(metric for metric in args.get('metrics', ",".join(METRICS)).split(",") if metric)
+    if any(key not in GROUP_KEYS for key in group_keys):
+        raise ValueError(f"group_by must be a comma-separated subset of: {', '.join(GROUP_KEYS)}")
+    if not metrics or any(metric not in METRICS for metric in metrics):
+        raise ValueError(f"metrics must be a comma-separated subset of: {', '.join(METRICS)}")
+    return group_keys, metrics, parse_percentiles(args)
+
+
+def parse_percentiles(args):
+    try:
+        percentiles = tuple(float(p) for p in args.get('percentiles', '5,50,95').split(",") if p)
+    except ValueError:
+        raise ValueError("percentiles must be comma-separated numbers between 0 and 100")
+    if not percentiles or any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be comma-separated numbers between 0 and 100")
+    return percentiles
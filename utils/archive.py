@@ -0,0 +1,444 @@
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import reduce
+
+import numpy as np
+from flask import current_app, jsonify
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList, Grouping, Null
+
+from utils.aggregations import TOTAL_FIELDS
+
+# CellRecord columns kept in the archive (the database id is kept as source_id)
+ARCHIVE_COLUMNS = (
+    "timestamp", "operator", "signal_power", "sinr", "network_type", "frequency_band", "cell_id",
+    "device_ip", "device_mac", "device_id", "username"
+)
+NUMERIC_COLUMNS = ("signal_power", "sinr")
+TEXT_COLUMNS = tuple(name for name in ARCHIVE_COLUMNS if name not in NUMERIC_COLUMNS and name != "timestamp")
+ARCHIVE_PARTITION = timedelta(days=1)
+MANIFEST = "manifest.json"
+# source_shard and source_id packed into one int64 (ids stay far below 2**47)
+_SOURCE_BITS = 47
+
+
+#  A read path filtered archived data in a way the archive cannot evaluate (answered with a 400)
+class UnsupportedArchiveFilter(Exception):
+    pass
+
+
+def partition_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+#  Labels and int32 codes of a text column, -1 for NULL
+def _encode_text(values):
+    values = np.asarray(values, dtype=object)
+    present = values != None  # noqa: E711 (element-wise)
+    labels, codes = np.unique(values[present].astype(str), return_inverse=True)
+    encoded = np.full(len(values), -1, dtype=np.int32)
+    encoded[present] = codes.reshape(-1)
+    return labels, encoded
+
+
+def _value(clause):
+    if isinstance(clause, Null):
+        return None
+    if isinstance(clause, BindParameter):
+        return clause.effective_value
+    raise UnsupportedArchiveFilter(f"Unsupported archive filter operand: {clause}")
+
+
+#  One archived day, column-wise: timestamps as datetime64[us], metrics as float64 (NULL -> NaN), text
+#  columns dictionary-encoded as sorted labels plus int32 codes. source_shard (-1: unsharded) and
+#  source_id with timestamp and device_id identify the original rows (databases may reuse the ids of
+#  deleted rows), so re-archiving a day after a crash does not duplicate them.
+class ArchivePartition:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.size = len(arrays["timestamp"])
+
+    #  From {column: values} in ARCHIVE_COLUMNS plus source_shard / source_id
+    @classmethod
+    def from_columns(cls, columns):
+        arrays = {
+            "timestamp": np.asarray(columns["timestamp"], dtype="datetime64[us]"),
+            "source_shard": np.asarray(columns["source_shard"], dtype=np.int16),
+            "source_id": np.asarray(columns["source_id"], dtype=np.int64),
+        }
+        for name in NUMERIC_COLUMNS:
+            arrays[name] = np.asarray(columns[name], dtype=float)
+        for name in TEXT_COLUMNS:
+            arrays[f"{name}.labels"], arrays[f"{name}.codes"] = _encode_text(columns[name])
+        return cls(arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({name: data[name] for name in data.files})
+
+    #  Write next to the target and rename over it, so readers never see a partial file
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                np.savez_compressed(file, **self.arrays)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    #  Decoded values of one column (text as an object array with None for NULL)
+    def column(self, name):
+        if name not in TEXT_COLUMNS:
+            return self.arrays[name]
+        labels, codes = self.arrays[f"{name}.labels"], self.arrays[f"{name}.codes"]
+        values = np.full(self.size, None, dtype=object)
+        present = codes >= 0
+        values[present] = labels.astype(object)[codes[present]]
+        return values
+
+    def source_keys(self):
+        sources = (self.arrays["source_shard"].astype(np.int64) + 1) << _SOURCE_BITS | self.arrays["source_id"]
+        timestamps = self.arrays["timestamp"].astype(np.int64)
+        return list(zip(sources.tolist(), timestamps.tolist(), self.column("device_id").tolist()))
+
+    #  This partition plus the rows of `other` that are not archived here yet
+    def merge(self, other):
+        archived = set(self.source_keys())
+        fresh = np.array([key not in archived for key in other.source_keys()], dtype=bool)
+        names = ARCHIVE_COLUMNS + ("source_shard", "source_id")
+        return ArchivePartition.from_columns({
+            name: np.concatenate([self.column(name), other.column(name)[fresh]]) for name in names
+        })
+
+    #  Rows matching every filter: the CellRecord comparisons the read paths build (==, !=, <, <=, >, >=,
+    #  BETWEEN, IN, IS [NOT] NULL, and/or), evaluated on the arrays
+    def mask(self, filters):
+        return reduce(np.logical_and, (self._match(expr) for expr in filters), np.ones(self.size, dtype=bool))
+
+    def _match(self, expr):
+        if isinstance(expr, Grouping):
+            return self._match(expr.element)
+        if isinstance(expr, BooleanClauseList):
+            combine = np.logical_and if expr.operator is operators.and_ else np.logical_or
+            return reduce(combine, (self._match(clause) for clause in expr.clauses))
+        if not isinstance(expr, BinaryExpression) or getattr(expr.left, "key", None) not in ARCHIVE_COLUMNS:
+            raise UnsupportedArchiveFilter(f"Unsupported archive filter: {expr}")
+
+        name, op = expr.left.key, expr.operator
+        if op is operators.between_op:
+            lo, hi = (_value(clause) for clause in expr.right.clauses)
+            return self._compare(name, operators.ge, lo) & self._compare(name, operators.le, hi)
+        if op is operators.in_op:
+            return self._compare(name, op, list(_value(expr.right)))
+        return self._compare(name, op, _value(expr.right))
+
+    def _compare(self, name, op, value):
+        if op in (operators.is_, operators.is_not) or value is None:
+            if name in TEXT_COLUMNS:
+                null = self.arrays[f"{name}.codes"] < 0
+            elif name in NUMERIC_COLUMNS:
+                null = np.isnan(self.arrays[name])
+            else:
+                null = np.isnat(self.arrays[name])
+            if op in (operators.is_, operators.eq):
+                return null
+            if op in (operators.is_not, operators.ne):
+                return ~null
+            return np.zeros(self.size, dtype=bool)
+
+        if name in TEXT_COLUMNS:
+            labels, codes = self.arrays[f"{name}.labels"], self.arrays[f"{name}.codes"]
+            if op is operators.in_op:
+                return np.isin(codes, [self._label_code(labels, item) for item in value if item is not None])
+            if op in (operators.eq, operators.ne):
+                matches = codes == self._label_code(labels, value)
+                return matches if op is operators.eq else ~matches & (codes >= 0)
+            raise UnsupportedArchiveFilter(f"Unsupported comparison on archived text column {name}")
+
+        column = self.arrays[name]
+        if name == "timestamp":
+            convert = lambda item: np.datetime64(item, "us")  # noqa: E731
+        else:
+            convert = float
+        if op is operators.in_op:
+            return np.isin(column, [convert(item) for item in value if item is not None])
+        if op in (operators.eq, operators.ne, operators.lt, operators.le, operators.gt, operators.ge):
+            return op(column, convert(value))
+        raise UnsupportedArchiveFilter(f"Unsupported comparison on archived column {name}")
+
+    @staticmethod
+    def _label_code(labels, value):
+        position = int(np.searchsorted(labels, str(value)))
+        return position if position < len(labels) and labels[position] == str(value) else -2
+
+
+#  Lower and upper timestamp bounds implied by the AND of the filters (None: unbounded)
+def _time_bounds(filters):
+    lo, hi = None, None
+    for expr in filters:
+        while isinstance(expr, Grouping):
+            expr = expr.element
+        bounds = (None, None)
+        if isinstance(expr, BooleanClauseList) and expr.operator is operators.and_:
+            bounds = _time_bounds(expr.clauses)
+        elif isinstance(expr, BinaryExpression) and getattr(expr.left, "key", None) == "timestamp":
+            if expr.operator is operators.between_op:
+                bounds = tuple(_value(clause) for clause in expr.right.clauses)
+            elif expr.operator in (operators.ge, operators.gt):
+                bounds = (_value(expr.right), None)
+            elif expr.operator in (operators.le, operators.lt):
+                bounds = (None, _value(expr.right))
+        if bounds[0] is not None:
+            lo = bounds[0] if lo is None else max(lo, bounds[0])
+        if bounds[1] is not None:
+            hi = bounds[1] if hi is None else min(hi, bounds[1])
+    return lo, hi
+
+
+#  Raw measurements moved out of the database by retention (utils/retention.py): one compressed .npz
+#  file per day under root/YYYY/MM/, plus a manifest with the horizon. Everything before the horizon
+#  that is no longer in CellRecord is in the archive and nothing at or after it is read from here, so
+#  the database and the archive never both answer for the same row.
+#  Loaded partitions are kept in a small LRU cache keyed by path and modification time.
+class ColdArchive:
+    def __init__(self, root, cache_size=16):
+        self.root = root
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._horizon = (None, None)
+        self._lock = threading.Lock()
+        self._counters = {"partitions_read": 0, "partition_cache_hits": 0, "rows_scanned": 0, "rows_returned": 0}
+
+    def partition_path(self, day):
+        return os.path.join(self.root, f"{day:%Y}", f"{day:%m}", f"{day:%Y-%m-%d}.npz")
+
+    def horizon(self):
+        path = os.path.join(self.root, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        cached_mtime, horizon = self._horizon
+        if cached_mtime != mtime:
+            with open(path) as file:
+                horizon = datetime.fromisoformat(json.load(file)["archived_until"])
+            self._horizon = (mtime, horizon)
+        return horizon
+
+    def set_horizon(self, until):
+        os.makedirs(self.root, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as file:
+            json.dump({"archived_until": until.isoformat()}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, os.path.join(self.root, MANIFEST))
+
+    #  Days with a partition file, oldest first
+    def days(self):
+        days = []
+        for year in sorted(os.listdir(self.root)) if os.path.isdir(self.root) else []:
+            year_dir = os.path.join(self.root, year)
+            if not year.isdigit() or not os.path.isdir(year_dir):
+                continue
+            for month in sorted(os.listdir(year_dir)):
+                for name in sorted(os.listdir(os.path.join(year_dir, month))):
+                    if name.endswith(".npz"):
+                        days.append(datetime.strptime(name[:-4], "%Y-%m-%d"))
+        return days
+
+    def load(self, day):
+        path = self.partition_path(day)
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            partition = self._cache.get(key)
+            if partition is not None:
+                self._cache.move_to_end(key)
+                self._counters["partition_cache_hits"] += 1
+                return partition
+        partition = ArchivePartition.load(path)
+        with self._lock:
+            self._cache[key] = partition
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._counters["partitions_read"] += 1
+        return partition
+
+    #  Add rows ({column: values}, see ArchivePartition.from_columns) to the day's partition; returns
+    #  the partition as written
+    def append(self, day, columns):
+        partition = ArchivePartition.from_columns(columns)
+        existing = self.load(day)
+        if existing is not None:
+            partition = existing.merge(partition)
+        partition.save(self.partition_path(day))
+        return partition
+
+    #  {name: values} of the archived rows before the horizon matching the filters; None when no
+    #  partition can match (the usual case for recent windows, answered without touching the disk)
+    def select(self, names, filters):
+        parts = list(self.select_days(names, filters))
+        if not parts:
+            return None
+        return {name: np.concatenate([part[name] for part in parts]) for name in names}
+
+    #  Like select, one {name: values} per day with matching rows, oldest day first
+    def select_days(self, names, filters):
+        horizon = self.horizon()
+        if horizon is None:
+            return
+        lo, hi = _time_bounds(filters)
+        if lo is not None and lo >= horizon:
+            return
+        hi = horizon if hi is None else min(hi, horizon)
+        if lo is not None:
+            day, days = partition_day(lo), []
+            while day <= hi:
+                days.append(day)
+                day += ARCHIVE_PARTITION
+        else:
+            days = [day for day in self.days() if day <= hi]
+
+        for day in days:
+            partition = self.load(day)
+            if partition is None:
+                continue
+            mask = partition.mask(filters) & (partition.arrays["timestamp"] < np.datetime64(horizon, "us"))
+            returned = int(mask.sum())
+            with self._lock:
+                self._counters["rows_scanned"] += partition.size
+                self._counters["rows_returned"] += returned
+            if returned:
+                yield {name: partition.column(name)[mask] for name in names}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["cached_partitions"] = len(self._cache)
+        return stats
+
+
+#  Per-group totals (TOTAL_FIELDS) of column arrays grouped by `keys`, keyed like query_totals
+def group_totals(columns, keys):
+    size = len(columns[NUMERIC_COLUMNS[0]])
+    combined = np.zeros(size, dtype=np.int64)
+    key_labels = []
+    for key in keys:
+        labels, codes = np.unique(np.array(columns[key], dtype=str), return_inverse=True)
+        key_labels.append([None if label == "None" else str(label) for label in labels])
+        combined = combined * len(labels) + codes.reshape(-1)
+    unique, groups = np.unique(combined, return_inverse=True)
+    groups = groups.reshape(-1)
+
+    fields = {"count": np.bincount(groups, minlength=len(unique))}
+    for metric in NUMERIC_COLUMNS:
+        values = columns[metric]
+        valid = ~np.isnan(values)
+        fields[f"{metric}_count"] = np.bincount(groups[valid], minlength=len(unique))
+        fields[f"{metric}_sum"] = np.bincount(groups[valid], weights=values[valid], minlength=len(unique))
+        fields[f"{metric}_sq_sum"] = np.bincount(groups[valid], weights=values[valid] ** 2, minlength=len(unique))
+
+    totals = {}
+    for position, code in enumerate(unique):
+        labels = []
+        for key_label in reversed(key_labels):
+            code, label_code = divmod(int(code), len(key_label))
+            labels.append(key_label[label_code])
+        labels.reverse()
+        group = None if not keys else (labels[0] if len(keys) == 1 else tuple(labels))
+        totals[group] = {
+            field: int(fields[field][position]) if field.endswith("count") else float(fields[field][position])
+            for field in TOTAL_FIELDS
+        }
+    return totals
+
+
+def _select(names, filters):
+    archive = get_archive(current_app)
+    return archive.select(names, filters) if archive else None
+
+
+#  Archived rows of the given CellRecord columns as tuples, like the rows of the matching SELECT
+def archive_rows(columns, filters):
+    selected = _select([column.key for column in columns], filters)
+    if selected is None:
+        return []
+    return list(zip(*(selected[column.key].tolist() for column in columns)))
+
+
+#  Archived rows of the given columns as {name: values} per day in time order, one day in memory at a time
+def archive_days(names, filters):
+    archive = get_archive(current_app)
+    if not archive:
+        return
+    for selected in archive.select_days(names, filters):
+        order = np.argsort(selected["timestamp"], kind="stable")
+        yield {name: selected[name][order] for name in names}
+
+
+#  Archived per-group totals; group_key as in window_totals
+def archive_totals(group_key, filters):
+    keys = () if group_key is None else (group_key if isinstance(group_key, tuple) else (group_key,))
+    selected = _select([*keys, *NUMERIC_COLUMNS], filters)
+    return group_totals(selected, keys) if selected is not None else {}
+
+
+#  Archived record count per minute/hour bucket label (labels as in time_bucket)
+def archive_trend(filters, granularity):
+    selected = _select(["timestamp"], filters)
+    if selected is None:
+        return {}
+    unit = "m" if granularity == "minute" else "h"
+    buckets, counts = np.unique(selected["timestamp"].astype(f"datetime64[{unit}]"), return_counts=True)
+    labels = np.datetime_as_string(buckets, unit=unit)
+    suffix = "" if granularity == "minute" else ":00"
+    return {f"{label.replace('T', ' ')}{suffix}": int(count) for label, count in zip(labels, counts)}
+
+
+#  Distinct non-null archived device_ids
+def archive_device_ids(filters):
+    selected = _select(["device_id"], filters)
+    if selected is None:
+        return set()
+    return {device_id for device_id in selected["device_id"].tolist() if device_id is not None}
+
+
+#  First day not archived yet (None without an archive or before the first retention run)
+def archive_horizon():
+    archive = get_archive(current_app)
+    return archive.horizon() if archive else None
+
+
+#  Read (and, from the retention command, write) the cold archive under ARCHIVE_DIR
+def init_archive(app):
+    root = app.config.get('ARCHIVE_DIR')
+    if not root:
+        return None
+    archive = ColdArchive(root, app.config.get('ARCHIVE_CACHE_PARTITIONS', 16))
+    app.extensions['archive'] = archive
+    app.register_error_handler(UnsupportedArchiveFilter, _unsupported_filter)
+    return archive
+
+
+def _unsupported_filter(error):
+    current_app.logger.warning("%s", error)
+    horizon = archive_horizon()
+    return jsonify({
+        "error": f"This query is not supported on archived data, start the window at or after {horizon.isoformat()}"
+    }), 400
+
+
+def get_archive(app):
+    return app.extensions.get('archive')
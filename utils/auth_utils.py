@@ -1,6 +1,9 @@
 from flask import request, abort, current_app
 import jwt
 from models import User
+from utils.db_routing import primary_reads
+from utils.identity_cache import Identity, get_identity_cache
+from utils.metrics import timed_section
 from datetime import datetime, timedelta
 
 
@@ -28,18 +31,36 @@ def create_token(user_id):
     }
     return jwt.encode(payload, current_app.config['SECRET_KEY'], algorithm='HS256')
 
-def verify_token():
+#  fresh=True skips the identity cache and reads the user from the database (refreshing the cached entry)
+def verify_token(fresh=False):
+    with timed_section("verify_token"):
+        return _verify_token(fresh)
+
+def _verify_token(fresh):
     auth_token = extract_auth_token(request)
     if not auth_token:
         abort(403, "Missing token")
     user_id = decode_token(auth_token)
-    user = User.query.get(user_id)
+
+    cache = get_identity_cache(current_app)
+    identity = cache.get(user_id) if cache and not fresh else None
+    if identity:
+        return identity
+
+    # On the primary: a replica that lags would still know deleted or demoted users
+    with primary_reads():
+        user = User.query.populate_existing().get(user_id)
     if not user:
         abort(403, "Invalid user")
-    return user
+    identity = Identity(user.id, user.username, user.role)
+    if cache:
+        cache.put(identity)
+    return identity
 
+#  Admin access is checked against the database on every request, never the identity cache: a user deleted
+#  or demoted through another worker loses it at once
 def verify_admin_token():
-    user = verify_token()
+    user = verify_token(fresh=True)
     if user.role != 'admin':
         abort(403, "Admin access required")
     return user
@@ -0,0 +1,227 @@
+import heapq
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, CellRecord, CellStatRollup
+from utils.analytics import METRICS, parse_percentiles
+from utils.archive import archive_horizon, archive_rows
+from utils.hll import SPARSE, grouped_estimates, sparse_entries
+from utils.rollups import CELL_ROLLUP_KEYS, HISTOGRAM, split_window
+from utils.sharding import scatter
+
+# A cell is identified by its operator, technology and cell id
+CELL_KEYS = ("operator", "network_type", "cell_id")
+MAX_WORST_CELLS = 100
+
+
+#  Labels and integer codes of one categorical column (NULL becomes the label None)
+def _encode(column):
+    labels, codes = np.unique(np.array(column, dtype=str), return_inverse=True)
+    return [None if label == "None" else str(label) for label in labels], codes.reshape(-1)
+
+
+#  Percentiles of values per group code, all groups at once: one lexsort, then index arithmetic
+#  (linear interpolation, same as np.percentile). Each value stands for `weights` equal values, so a
+#  histogram gives the same percentiles as its raw values. Returns a (len(percentiles), groups) array.
+def _group_percentiles(codes, values, weights, groups, percentiles):
+    result = np.full((len(percentiles), groups), np.nan)
+    order = np.lexsort((values, codes))
+    values = values[order]
+    ends = np.cumsum(weights[order])  # values before the end of each entry, in the sorted order
+    counts = np.bincount(codes, weights=weights, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    for i, p in enumerate(percentiles):
+        position = starts[present] + (counts[present] - 1) * (p / 100)
+        lo = np.floor(position)
+        hi = np.ceil(position)
+        lo_values = values[np.searchsorted(ends, lo, side="right")]
+        hi_values = values[np.searchsorted(ends, hi, side="right")]
+        result[i, present] = lo_values + (hi_values - lo_values) * (position - lo)
+    return result
+
+
+#  (cells, values, weights) of one metric: raw values weigh 1, rollup histogram entries their count;
+#  NULL values are dropped
+def _metric_samples(raw_cells, raw_values, rolled_cells, histograms):
+    packed = [histogram or b"" for histogram in histograms]
+    entries = np.frombuffer(b"".join(packed), dtype=HISTOGRAM)
+    cells = np.concatenate([raw_cells, np.repeat(rolled_cells, [len(histogram) // HISTOGRAM.itemsize for histogram in packed])])
+    values = np.concatenate([np.array(raw_values, dtype=float), entries["value"]])
+    weights = np.concatenate([np.ones(len(raw_values)), entries["count"].astype(float)])
+    valid = ~np.isnan(values)
+    return cells[valid], values[valid], weights[valid]
+
+
+#  Per-cell statistics of a window, computed column-wise with NumPy: record and distinct device counts,
+#  frequency bands, and count / mean / percentiles of each metric. `raw` are (operator, network_type,
+#  cell_id, frequency_band, device_id, signal_power, sinr) rows, `rolled` per-cell rollup rows with
+#  record_count, the device sketch and the two metric histograms in place of the device and values.
+#  Devices are HyperLogLog estimates, raw device ids hashed into the same registers as the sketches.
+class CellWindow:
+    def __init__(self, raw, rolled, percentiles):
+        raw_columns = list(zip(*raw)) if raw else [()] * 7
+        rolled_columns = list(zip(*rolled)) if rolled else [()] * 8
+        columns = [raw_column + rolled_column for raw_column, rolled_column in zip(raw_columns[:4], rolled_columns[:4])]
+        entries = len(raw) + len(rolled)
+        self.percentiles = percentiles
+
+        key_labels, key_codes = zip(*(_encode(column) for column in columns[:3]))
+        combined = np.zeros(entries, dtype=np.int64)
+        for labels, codes in zip(key_labels, key_codes):
+            combined = combined * len(labels) + codes
+        unique, cells = np.unique(combined, return_inverse=True)
+        cells = cells.reshape(-1)
+        self.size = len(unique)
+        self.keys = []
+        for code in unique:
+            key = []
+            for labels in reversed(key_labels):
+                code, label_code = divmod(int(code), len(labels))
+                key.append(labels[label_code])
+            self.keys.append(tuple(reversed(key)))
+
+        raw_cells, rolled_cells = cells[:len(raw)], cells[len(raw):]
+        records = np.concatenate([np.ones(len(raw)), np.array(rolled_columns[4], dtype=float)])
+        self.records = np.bincount(cells, weights=records, minlength=self.size).astype(np.int64)
+
+        device_labels, devices = _encode(raw_columns[4])
+        sketches = [sketch or b"" for sketch in rolled_columns[5]]
+        device_entries = np.concatenate([sparse_entries(device_labels)[devices], np.frombuffer(b"".join(sketches), dtype=SPARSE)])
+        sketch_cells = np.repeat(rolled_cells, [len(sketch) // SPARSE.itemsize for sketch in sketches])
+        self.devices = grouped_estimates(np.concatenate([raw_cells, sketch_cells]), device_entries, self.size)
+
+        band_labels, bands = _encode(columns[3])
+        self.bands = [[] for _ in range(self.size)]
+        for pair in np.unique(cells * len(band_labels) + bands):
+            cell, band = divmod(int(pair), len(band_labels))
+            if band_labels[band] is not None:
+                self.bands[cell].append(band_labels[band])
+
+        self.stats = {}
+        for metric, raw_values, histograms in zip(METRICS, raw_columns[5:], rolled_columns[6:]):
+            metric_cells, values, weights = _metric_samples(raw_cells, raw_values, rolled_cells, histograms)
+            counts = np.bincount(metric_cells, weights=weights, minlength=self.size).astype(np.int64)
+            sums = np.bincount(metric_cells, weights=values * weights, minlength=self.size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means = sums / counts
+            self.stats[metric] = {
+                "count": counts,
+                "mean": means,
+                "percentiles": _group_percentiles(metric_cells, values, weights, self.size, percentiles)
+            }
+
+    #  Ranking value per cell: "mean" or a computed percentile such as "p5"
+    def statistic(self, metric, statistic):
+        if statistic == "mean":
+            return self.stats[metric]["mean"]
+        return self.stats[metric]["percentiles"][[f"p{p:g}" for p in self.percentiles].index(statistic)]
+
+    def summary(self, cell):
+        operator, network_type, cell_id = self.keys[cell]
+        summary = {
+            "operator": operator,
+            "network_type": network_type,
+            "cell_id": cell_id,
+            "frequency_bands": self.bands[cell],
+            "records": int(self.records[cell]),
+            "devices": int(self.devices[cell])
+        }
+        for metric, stats in self.stats.items():
+            count = int(stats["count"][cell])
+            summary[metric] = {
+                "count": count,
+                "mean": float(stats["mean"][cell]) if count else None,
+                "percentiles": {
+                    f"p{p:g}": float(stats["percentiles"][i, cell]) if count else None
+                    for i, p in enumerate(self.percentiles)
+                }
+            }
+        return summary
+
+    #  The k cells with the lowest statistic among cells with at least min_records values of metric.
+    #  heapq.nsmallest keeps only k candidates, so ranking thousands of cells stays O(cells log k).
+    def worst(self, metric, statistic, k, min_records):
+        values = self.statistic(metric, statistic)
+        counts = self.stats[metric]["count"]
+        candidates = ((float(values[cell]), cell) for cell in np.flatnonzero(counts >= min_records))
+        return [self.summary(cell) for _, cell in heapq.nsmallest(k, candidates)]
+
+
+def _cell_filters(model, selection):
+    return [getattr(model, key) == value for key, value in selection.items()]
+
+
+#  Per-cell statistics of [start_dt, end_dt] for the cells matching `selection` (see cell_selection).
+#  Whole compacted hours come from the per-cell rollups and the edges from raw rows, shard by shard,
+#  as in window_totals; archived days are read from the archive. Only the columns the statistics need
+#  are read, as tuples; rows without a cell id are skipped.
+def load_cells(start_dt, end_dt, selection, percentiles):
+    horizon = archive_horizon()
+    raw, rolled = [], []
+    for shard_raw, shard_rolled in scatter(_load_cells, start_dt, end_dt, selection, horizon):
+        raw += shard_raw
+        rolled += shard_rolled
+    filters = [CellRecord.cell_id.isnot(None), CellRecord.timestamp.between(start_dt, end_dt),
+               *_cell_filters(CellRecord, selection)]
+    raw += archive_rows(_record_columns(), filters)
+    return CellWindow(raw, rolled, percentiles)
+
+
+def _record_columns():
+    return [*(getattr(CellRecord, key) for key in CELL_ROLLUP_KEYS), CellRecord.device_id,
+            CellRecord.signal_power, CellRecord.sinr]
+
+
+def _load_cells(start_dt, end_dt, selection, horizon):
+    raw_ranges, rolled = [], []
+    live_start = start_dt
+    if horizon is not None and horizon > start_dt:
+        # Late rows of archived days stay raw in the database until the next retention run
+        raw_ranges.append((CellRecord.timestamp >= start_dt, CellRecord.timestamp < horizon,
+                           CellRecord.timestamp <= end_dt))
+        live_start = horizon
+    if live_start <= end_dt:
+        rollup_lo, rollup_hi, live_ranges = split_window(live_start, end_dt, "cell")
+        raw_ranges += live_ranges
+        if rollup_lo is not None:
+            rolled = db.session.execute(select(
+                *(getattr(CellStatRollup, key) for key in CELL_ROLLUP_KEYS), CellStatRollup.record_count,
+                CellStatRollup.devices, CellStatRollup.signal_power_values, CellStatRollup.sinr_values
+            ).where(
+                CellStatRollup.bucket_start >= rollup_lo, CellStatRollup.bucket_start < rollup_hi,
+                *_cell_filters(CellStatRollup, selection)
+            )).all()
+
+    raw = []
+    for time_filters in raw_ranges:
+        raw += db.session.execute(select(*_record_columns()).where(
+            CellRecord.cell_id.isnot(None), *time_filters, *_cell_filters(CellRecord, selection)
+        )).all()
+    return raw, rolled
+
+
+#  Optional operator / network_type / cell_id filters of a cell request, as {key: value}
+def cell_selection(args):
+    return {key: args[key] for key in CELL_KEYS if args.get(key)}
+
+
+#  metric / statistic / limit / min_records / percentiles of /admin/worst_cells; raises ValueError
+def worst_cell_params(args):
+    percentiles = parse_percentiles(args)
+    metric = args.get('metric', 'sinr')
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of: {', '.join(METRICS)}")
+    statistic = args.get('statistic', 'mean')
+    allowed = ["mean"] + [f"p{p:g}" for p in percentiles]
+    if statistic not in allowed:
+        raise ValueError(f"statistic must be one of: {', '.join(allowed)}")
+    try:
+        limit = int(args.get('limit', 10))
+        min_records = int(args.get('min_records', 30))
+    except ValueError:
+        raise ValueError("limit and min_records must be integers")
+    if not 1 <= limit <= MAX_WORST_CELLS:
+        raise ValueError(f"limit must be between 1 and {MAX_WORST_CELLS}")
+    return metric, statistic, limit, max(min_records, 1), percentiles
@@ -0,0 +1,162 @@
+import ipaddress
+import socket
+
+from flask import current_app
+from sqlalchemy.types import Integer, SmallInteger, TypeDecorator, VARBINARY
+
+# Code bound for a value that is not in its lookup table: it matches no row
+UNKNOWN_CODE = -1
+# Distinct values a packed column's processor remembers
+MEMO_LIMIT = 10000
+
+
+#  Categorical column stored as the integer code of its value in a lookup table (utils/lookups.py).
+#  Comparisons, inserts and results all use the value, so queries treat the column like the string
+#  it replaces. Values must be registered before they are inserted (insert_records does it).
+class LookupCode(TypeDecorator):
+    impl = Integer
+    cache_ok = True
+
+    def __init__(self, kind, small=False):
+        super().__init__()
+        self.kind = kind
+        self.small = small
+
+    def load_dialect_impl(self, dialect):
+        return dialect.type_descriptor(SmallInteger() if self.small else Integer())
+
+    #  Per value, for literal rendering; statements use the processors below
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        code = current_app.extensions['lookups'].code(self.kind, value)
+        return UNKNOWN_CODE if code is None else code
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return current_app.extensions['lookups'].value(self.kind, value)
+
+    #  The processors bind the app's lookup cache once per statement; cached codes and values are plain
+    #  dict reads, only misses go through the cache's refresh
+    def bind_processor(self, dialect):
+        lookups = current_app.extensions['lookups']
+        codes = lookups.codes(self.kind)
+
+        def process(value):
+            if value is None:
+                return None
+            code = codes.get(str(value))
+            if code is None:
+                code = lookups.code(self.kind, value)
+            return UNKNOWN_CODE if code is None else code
+        return process
+
+    def result_processor(self, dialect, coltype):
+        lookups = current_app.extensions['lookups']
+        values = lookups.values(self.kind)
+
+        def process(code):
+            if code is None:
+                return None
+            value = values.get(code)
+            return value if value is not None else lookups.value(self.kind, code)
+        return process
+
+
+#  Processor that converts each distinct value once: a batch repeats the IP and MAC of each device on
+#  every row. Processors live as long as their compiled statement, so the memo is cleared at MEMO_LIMIT.
+def _memoized(convert, key=None):
+    seen = {}
+
+    def process(value):
+        if value is None:
+            return None
+        if key is not None:
+            value = key(value)
+        converted = seen.get(value)
+        if converted is None:
+            if len(seen) >= MEMO_LIMIT:
+                seen.clear()
+            converted = seen[value] = convert(value)
+        return converted
+    return process
+
+
+#  IP address as a version tag byte (4 or 6) plus its packed bytes. Values that would not read back
+#  exactly the same (not an address, or not in canonical form) are kept as text behind tag 0.
+#  IPv4 goes through the socket module, which parses and prints it as ipaddress does.
+class PackedIP(TypeDecorator):
+    impl = VARBINARY
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = str(value)
+        try:
+            packed = socket.inet_pton(socket.AF_INET, value)
+        except OSError:
+            packed = None
+        if packed is not None and socket.inet_ntop(socket.AF_INET, packed) == value:
+            return b"\x04" + packed
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            address = None
+        if address is not None and str(address) == value:
+            return bytes([address.version]) + address.packed
+        return b"\x00" + value.encode()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        if value[0] == 4:
+            return socket.inet_ntop(socket.AF_INET, value[1:])
+        if value[0] == 6:
+            return str(ipaddress.ip_address(value[1:]))
+        return value[1:].decode()
+
+    def bind_processor(self, dialect):
+        return _memoized(lambda value: self.process_bind_param(value, dialect))
+
+    def result_processor(self, dialect, coltype):
+        return _memoized(lambda value: self.process_result_value(value, dialect), key=bytes)
+
+
+#  MAC address as 6 bytes behind a tag byte for its spelling (1: aa:bb:.., 2: AA:BB:..); any other
+#  value is kept as text behind tag 0
+class PackedMAC(TypeDecorator):
+    impl = VARBINARY
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = str(value)
+        try:
+            packed = bytes.fromhex(value.replace(":", "")) if len(value) == 17 else b""
+        except ValueError:
+            packed = b""
+        if len(packed) == 6:
+            for tag, spelled in ((1, packed.hex(":")), (2, packed.hex(":").upper())):
+                if spelled == value:
+                    return bytes([tag]) + packed
+        return b"\x00" + value.encode()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        if value[0] == 1:
+            return value[1:].hex(":")
+        if value[0] == 2:
+            return value[1:].hex(":").upper()
+        return value[1:].decode()
+
+    def bind_processor(self, dialect):
+        return _memoized(lambda value: self.process_bind_param(value, dialect))
+
+    def result_processor(self, dialect, coltype):
+        return _memoized(lambda value: self.process_result_value(value, dialect), key=bytes)
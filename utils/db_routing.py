@@ -0,0 +1,136 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Table, event, inspect
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.util import find_tables
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = "replica"
+REPLICA_RETRY_SECONDS = 30
+
+_replica_down_until = 0.0
+
+# Tables partitioned by device_id when shards are configured (utils/sharding.py)
+SHARDED_TABLES = frozenset(("cell_record", "cell_rollup", "cell_stat_rollup", "rollup_state"))
+
+_active_shard = ContextVar("active_shard", default=None)
+
+
+def shard_bind(index):
+    return f"shard{index}"
+
+
+#  Send statements on SHARDED_TABLES to shard `index` inside the block (None: the primary)
+@contextmanager
+def shard_scope(index):
+    token = _active_shard.set(index)
+    try:
+        yield
+    finally:
+        _active_shard.reset(token)
+
+
+#  Shard of the enclosing shard_scope (None: the primary)
+def current_shard():
+    return _active_shard.get()
+
+
+def _touches_sharded_table(mapper, clause):
+    if mapper is not None and inspect(mapper).local_table.name in SHARDED_TABLES:
+        return True
+    if isinstance(clause, Table):
+        return clause.name in SHARDED_TABLES
+    if clause is not None:
+        return any(table.name in SHARDED_TABLES for table in find_tables(clause, check_columns=True, include_crud=True))
+    return False
+
+
+#  Mark the current request as read-only: its SELECTs may be served by the replica bind
+def use_replica():
+    g.read_replica = True
+
+
+def replica_available():
+    return time.monotonic() >= _replica_down_until
+
+
+#  Reads inside the block go to the primary even in a read-only request, for rows that must not lag
+#  (the user behind an auth token)
+@contextmanager
+def primary_reads():
+    replica = g.pop('read_replica', None) if has_request_context() else None
+    try:
+        yield
+    finally:
+        if replica:
+            g.read_replica = replica
+
+
+#  Session that sends statements on sharded tables inside a shard_scope to that shard, SELECTs of
+#  read-only requests to the replica, everything else to the primary.
+#  Without a configured replica, or while it is marked down, reads stay on the primary. A SELECT that
+#  fails because the replica went down (mark_replica_down) is retried once, on the primary.
+class RoutingSession(Session):
+    def execute(self, statement, *args, **kwargs):
+        replica_up = replica_available()
+        try:
+            return super().execute(statement, *args, **kwargs)
+        except DBAPIError:
+            if not (replica_up and getattr(statement, "is_select", False) and not replica_available()):
+                raise
+            logger.warning("Read replica failed mid-request, retrying the read on the primary")
+        return super().execute(statement, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = _active_shard.get()
+        if bind is None and shard is not None and _touches_sharded_table(mapper, clause):
+            return self._db.engines[shard_bind(shard)]
+        if (
+            bind is None
+            and not self._flushing
+            and getattr(clause, "is_select", False)
+            and has_request_context()
+            and g.get('read_replica')
+            and replica_available()
+        ):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+#  When the replica drops connections, route reads to the primary for REPLICA_RETRY_SECONDS
+def init_db_routing(app, db):
+    with app.app_context():
+        replica = db.engines.get(REPLICA_BIND)
+    if replica is None:
+        return
+
+    @event.listens_for(replica, "handle_error")
+    def mark_replica_down(context):
+        global _replica_down_until
+        if context.is_disconnect or context.connection is None:
+            _replica_down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+            logger.warning("Read replica unavailable, reading from the primary for %ss", REPLICA_RETRY_SECONDS)
+
+
+#  Pool settings for one bind. Threaded gunicorn workers serve up to GUNICORN_THREADS requests at once
+#  (gunicorn.conf.py), so the defaults in db_config.py let every request thread, the background threads
+#  and the shard scatter threads hold a connection without waiting; recycle below MySQL's wait_timeout
+#  and pre-ping so connections dropped by the server or a proxy are replaced transparently.
+def engine_options(url, pool_size, max_overflow, pool_recycle, pool_timeout):
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_recycle": pool_recycle,
+        "pool_timeout": pool_timeout,
+        "pool_pre_ping": True,
+    }
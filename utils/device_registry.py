@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, CellRecord, Device
+from utils.archive import archive_days
+from utils.sharding import scatter
+
+# A device is "currently connected" when it reported a measurement within this window
+CONNECTED_WINDOW = timedelta(minutes=5)
+
+
+def device_summary(device):
+    return {
+        "username": device.username,
+        "device_id": device.device_id,
+        "ip": device.last_ip,
+        "mac": device.last_mac
+    }
+
+
+#  Query of the registry entries whose last measurement falls inside CONNECTED_WINDOW
+def connected_devices(now=None):
+    threshold = (now or datetime.utcnow()) - CONNECTED_WINDOW
+    return Device.query.filter(Device.last_seen >= threshold)
+
+
+#  Fold CellRecord rows into one registry entry per (username, device_id); rows without a device_id
+#  are stored but not registered
+def summarize_devices(rows):
+    summary = {}
+    for row in rows:
+        if row.get("device_id") is None:
+            continue
+        key = (row["username"], row["device_id"])
+        timestamp = row["timestamp"]
+        entry = summary.get(key)
+        if entry is None:
+            summary[key] = {
+                "username": row["username"],
+                "device_id": row["device_id"],
+                "last_ip": row.get("device_ip"),
+                "last_mac": row.get("device_mac"),
+                "first_seen": timestamp,
+                "last_seen": timestamp,
+                "record_count": 1
+            }
+            continue
+        entry["record_count"] += 1
+        entry["first_seen"] = min(entry["first_seen"], timestamp)
+        if timestamp >= entry["last_seen"]:
+            entry.update(last_seen=timestamp, last_ip=row.get("device_ip"), last_mac=row.get("device_mac"))
+    return list(summary.values())
+
+
+#  Upsert the registry for freshly inserted CellRecord rows; runs in the caller's transaction
+def record_devices(rows):
+    values = summarize_devices(rows)
+    if not values:
+        return
+    dialect = db.engine.dialect.name
+
+    if dialect == "sqlite":
+        stmt = sqlite_insert(Device).values(values)
+        new = stmt.excluded
+        stmt = stmt.on_conflict_do_update(index_elements=["username", "device_id"], set_={
+            "last_ip": case((new.last_seen >= Device.last_seen, new.last_ip), else_=Device.last_ip),
+            "last_mac": case((new.last_seen >= Device.last_seen, new.last_mac), else_=Device.last_mac),
+            "first_seen": func.min(Device.first_seen, new.first_seen),
+            "last_seen": func.max(Device.last_seen, new.last_seen),
+            "record_count": Device.record_count + new.record_count
+        })
+    elif dialect == "mysql":
+        stmt = mysql_insert(Device).values(values)
+        new = stmt.inserted
+        # MySQL applies the assignments left to right, so last_seen must be updated after last_ip/last_mac
+        stmt = stmt.on_duplicate_key_update([
+            ("last_ip", func.if_(new.last_seen >= Device.last_seen, new.last_ip, Device.last_ip)),
+            ("last_mac", func.if_(new.last_seen >= Device.last_seen, new.last_mac, Device.last_mac)),
+            ("first_seen", func.least(Device.first_seen, new.first_seen)),
+            ("last_seen", func.greatest(Device.last_seen, new.last_seen)),
+            ("record_count", Device.record_count + new.record_count)
+        ])
+    else:
+        _upsert_devices(values)
+        return
+
+    db.session.execute(stmt)
+
+
+#  Read-then-write upsert for databases without an upsert statement: same result, one locked read per device
+def _upsert_devices(values):
+    for value in values:
+        device = Device.query.filter_by(
+            username=value["username"], device_id=value["device_id"]
+        ).with_for_update().first()
+        if device is None:
+            db.session.add(Device(**value))
+            continue
+        if value["last_seen"] >= device.last_seen:
+            device.last_ip, device.last_mac = value["last_ip"], value["last_mac"]
+        device.first_seen = min(device.first_seen, value["first_seen"])
+        device.last_seen = max(device.last_seen, value["last_seen"])
+        device.record_count += value["record_count"]
+
+
+#  Rebuild the registry from CellRecord and the archive (existing deployments, or after data was deleted)
+def rebuild_device_registry():
+    devices = {}
+    for partial in [*scatter(_shard_devices), _archived_devices()]:
+        for entry in partial:
+            _merge_entry(devices, entry)
+    db.session.query(Device).delete()
+    for device in devices.values():
+        db.session.add(Device(**device))
+    db.session.commit()
+    return len(devices)
+
+
+def _merge_entry(devices, entry):
+    key = (entry["username"], entry["device_id"])
+    device = devices.get(key)
+    if device is None:
+        devices[key] = entry
+        return
+    if entry["last_seen"] >= device["last_seen"]:
+        device["last_ip"], device["last_mac"] = entry["last_ip"], entry["last_mac"]
+    device["first_seen"] = min(device["first_seen"], entry["first_seen"])
+    device["last_seen"] = max(device["last_seen"], entry["last_seen"])
+    device["record_count"] += entry["record_count"]
+
+
+#  Registry entries of the archived devices, one archived day in memory at a time
+def _archived_devices():
+    devices = {}
+    names = ["timestamp", "username", "device_id", "device_ip", "device_mac"]
+    for selected in archive_days(names, [CellRecord.device_id.isnot(None)]):
+        # Rows are in time order: a device's first row is its earliest, its last one the latest
+        pairs = np.array([f"{username}\x1f{device_id}" for username, device_id in zip(
+            selected["username"].tolist(), selected["device_id"].tolist()
+        )])
+        _, first, counts = np.unique(pairs, return_index=True, return_counts=True)
+        _, from_end = np.unique(pairs[::-1], return_index=True)
+        last = len(pairs) - 1 - from_end
+        for first_index, last_index, count in zip(first.tolist(), last.tolist(), counts.tolist()):
+            _merge_entry(devices, {
+                "username": selected["username"][first_index],
+                "device_id": selected["device_id"][first_index],
+                "last_ip": selected["device_ip"][last_index],
+                "last_mac": selected["device_mac"][last_index],
+                "first_seen": selected["timestamp"][first_index].astype(datetime),
+                "last_seen": selected["timestamp"][last_index].astype(datetime),
+                "record_count": count
+            })
+    return devices.values()
+
+
+#  Registry entries of the devices stored on the current shard
+def _shard_devices():
+    devices = db.session.query(
+        CellRecord.username,
+        CellRecord.device_id,
+        func.min(CellRecord.timestamp),
+        func.max(CellRecord.timestamp),
+        func.count()
+    ).filter(
+        CellRecord.device_id.isnot(None), CellRecord.timestamp.isnot(None)
+    ).group_by(CellRecord.username, CellRecord.device_id).all()
+
+    entries = []
+    for username, device_id, first_seen, last_seen, record_count in devices:
+        # Latest ip/mac via the (username, device_id, timestamp) index
+        latest = db.session.query(CellRecord.device_ip, CellRecord.device_mac).filter(
+            CellRecord.username == username,
+            CellRecord.device_id == device_id
+        ).order_by(CellRecord.timestamp.desc()).first()
+        entries.append({
+            "username": username,
+            "device_id": device_id,
+            "last_ip": latest.device_ip,
+            "last_mac": latest.device_mac,
+            "first_seen": first_seen,
+            "last_seen": last_seen,
+            "record_count": record_count
+        })
+    return entries
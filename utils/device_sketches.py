@@ -0,0 +1,280 @@
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import db, CellRecord, DeviceSketch, RollupState
+from utils.aggregations import time_bucket
+from utils.archive import archive_device_ids
+from utils.hll import HyperLogLog, hash64, merge_all
+from utils.ingest_hooks import register_ingest_listener
+from utils.sharding import scatter
+
+logger = logging.getLogger(__name__)
+
+SKETCH_GRANULARITIES = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# RollupState row recording the time from which sketches cover all data (set by rebuild_device_sketches)
+SKETCH_STATE = "device_sketch"
+
+
+def sketch_bucket(dt, granularity):
+    if granularity == "day":
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_bucket(dt, granularity):
+    floored = sketch_bucket(dt, granularity)
+    return floored if floored == dt else floored + SKETCH_GRANULARITIES[granularity]
+
+
+def _sketch_key(granularity, timestamp, operator, network_type):
+    return granularity, sketch_bucket(timestamp, granularity), operator or "", network_type or ""
+
+
+#  Merge sketches ({(granularity, bucket_start, operator, network_type): HyperLogLog}) into the table.
+#  Rows are locked while merging; a concurrent insert of the same key fails the transaction, and the
+#  caller retries with the row in place. Runs in the caller's transaction.
+def store_sketches(sketches):
+    for (granularity, bucket_start, operator, network_type), sketch in sketches.items():
+        row = db.session.execute(select(DeviceSketch).filter_by(
+            granularity=granularity, bucket_start=bucket_start, operator=operator, network_type=network_type
+        ).with_for_update()).scalar_one_or_none()
+        if row is None:
+            db.session.add(DeviceSketch(
+                granularity=granularity, bucket_start=bucket_start, operator=operator,
+                network_type=network_type, registers=sketch.to_bytes()
+            ))
+            db.session.flush()
+        else:
+            row.registers = HyperLogLog.from_bytes(row.registers).merge(sketch).to_bytes()
+
+
+#  Ingest listener that folds device_ids into in-memory hour and day sketches, merged into
+#  DeviceSketch by a background thread every flush_interval seconds (and at shutdown). A worker killed
+#  without shutting down loses up to flush_interval of pending sketches; the rows are stored, so
+#  rebuild_device_sketches(since) restores them.
+class DeviceSketchBuffer:
+    def __init__(self, app, flush_interval=5.0):
+        self.app = app
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._stop = threading.Event()
+        self._counters = {"rows": 0, "flushes": 0, "sketches_written": 0, "failed_flushes": 0}
+        self._thread = threading.Thread(target=self._run, name="device-sketch-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def on_ingest(self, rows):
+        with self._lock:
+            for row in rows:
+                device_id = row.get("device_id")
+                if device_id is None or row.get("timestamp") is None:
+                    continue
+                hashed = hash64(device_id)
+                for granularity in SKETCH_GRANULARITIES:
+                    key = _sketch_key(granularity, row["timestamp"], row.get("operator"), row.get("network_type"))
+                    sketch = self._pending.get(key)
+                    if sketch is None:
+                        sketch = self._pending[key] = HyperLogLog()
+                    sketch.add_hash(hashed)
+                self._counters["rows"] += 1
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self.app.app_context():
+            try:
+                store_sketches(pending)
+                db.session.commit()
+                self._count("sketches_written", len(pending))
+            except Exception:
+                db.session.rollback()
+                self._count("failed_flushes")
+                logger.exception("Device sketch flush of %d sketches failed, retrying next time", len(pending))
+                # Merging is idempotent, so the failed batch is folded back in for the next attempt
+                with self._lock:
+                    for key, sketch in pending.items():
+                        current = self._pending.get(key)
+                        self._pending[key] = sketch.merge(current) if current else sketch
+            finally:
+                db.session.remove()
+        self._count("flushes")
+
+    def stop(self, timeout=30):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["pending_sketches"] = len(self._pending)
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+
+def sketches_cover_from():
+    state = db.session.get(RollupState, SKETCH_STATE)
+    return state.compacted_until if state else None
+
+
+#  Split [start_dt, end_dt] into day and hour sketch ranges plus raw edges shorter than an hour, and
+#  the part of the window before the sketches' coverage: returns ([(granularity, lo, hi)], raw_ranges)
+def window_plan(start_dt, end_dt, cover_from):
+    if cover_from is None or cover_from > end_dt:
+        return [], [(CellRecord.timestamp.between(start_dt, end_dt),)]
+    hour_lo = _ceil_bucket(max(start_dt, cover_from), "hour")
+    hour_hi = sketch_bucket(end_dt, "hour")
+    if hour_lo >= hour_hi:
+        return [], [(CellRecord.timestamp.between(start_dt, end_dt),)]
+    raw_ranges = [
+        (CellRecord.timestamp >= start_dt, CellRecord.timestamp < hour_lo),
+        (CellRecord.timestamp >= hour_hi, CellRecord.timestamp <= end_dt),
+    ]
+    day_lo = _ceil_bucket(hour_lo, "day")
+    day_hi = sketch_bucket(hour_hi, "day")
+    if day_lo < day_hi:
+        return [("hour", hour_lo, day_lo), ("day", day_lo, day_hi), ("hour", day_hi, hour_hi)], raw_ranges
+    return [("hour", hour_lo, hour_hi)], raw_ranges
+
+
+#  Approximate distinct device_ids in a window: the union of the covering sketches plus the device_ids
+#  of the raw edges (all of the window until rebuild_device_sketches has run), archived or not.
+#  Returns (estimate, number of sketches merged).
+def distinct_devices(start_dt, end_dt, operator=None, network_type=None):
+    sketch_ranges, raw_ranges = window_plan(start_dt, end_dt, sketches_cover_from())
+    sketch_filters = []
+    if operator is not None:
+        sketch_filters.append(DeviceSketch.operator == operator)
+    if network_type is not None:
+        sketch_filters.append(DeviceSketch.network_type == network_type)
+
+    sketches = []
+    for granularity, lo, hi in sketch_ranges:
+        if lo < hi:
+            rows = db.session.query(DeviceSketch.registers).filter(
+                DeviceSketch.granularity == granularity,
+                DeviceSketch.bucket_start >= lo,
+                DeviceSketch.bucket_start < hi,
+                *sketch_filters
+            ).all()
+            sketches += [HyperLogLog.from_bytes(registers) for (registers,) in rows]
+
+    merged = merge_all(sketches)
+    for time_filters in raw_ranges:
+        for device_ids in scatter(_edge_device_ids, time_filters, operator, network_type):
+            merged.update(device_ids)
+        merged.update(archive_device_ids([*time_filters, *_record_filters(operator, network_type)]))
+    return merged.estimate(), len(sketches)
+
+
+def _edge_device_ids(time_filters, operator, network_type):
+    return [device_id for (device_id,) in db.session.query(CellRecord.device_id).filter(
+        *time_filters, *_record_filters(operator, network_type)
+    ).distinct()]
+
+
+#  exact=true fallback: COUNT(DISTINCT device_id) over the raw window. A device lives on exactly one
+#  shard, so the per-shard counts add up to the exact total. A device can have both archived and live
+#  rows, so with archived rows in the window the device_ids themselves are united instead.
+def exact_distinct_devices(start_dt, end_dt, operator=None, network_type=None):
+    time_filters = (CellRecord.timestamp.between(start_dt, end_dt),)
+    archived = archive_device_ids([*time_filters, *_record_filters(operator, network_type)])
+    if not archived:
+        return sum(scatter(_exact_distinct_devices, start_dt, end_dt, operator, network_type))
+    for device_ids in scatter(_edge_device_ids, time_filters, operator, network_type):
+        archived.update(device_ids)
+    return len(archived)
+
+
+def _exact_distinct_devices(start_dt, end_dt, operator, network_type):
+    return db.session.query(func.count(CellRecord.device_id.distinct())).filter(
+        CellRecord.timestamp.between(start_dt, end_dt), *_record_filters(operator, network_type)
+    ).scalar()
+
+
+def _record_filters(operator, network_type):
+    filters = [CellRecord.device_id.isnot(None)]
+    if operator is not None:
+        filters.append(CellRecord.operator == operator)
+    if network_type is not None:
+        filters.append(CellRecord.network_type == network_type)
+    return filters
+
+
+#  Build sketches from CellRecord, one day at a time (existing data, or after the feature was off),
+#  then record where the sketches' coverage starts. Sketches merge idempotently, so this is safe to
+#  run next to live ingest and to repeat.
+def rebuild_device_sketches(since=None):
+    bounds = scatter(_timestamp_bounds)
+    lows = [low for low, _ in bounds if low is not None]
+    highs = [high for _, high in bounds if high is not None]
+    first = since or (min(lows) if lows else None) or datetime.utcnow()
+    last = max(highs) if highs else first
+    written = 0
+    day = sketch_bucket(first, "day")
+    while day <= last:
+        next_day = day + SKETCH_GRANULARITIES["day"]
+        rows = [row for partial in scatter(_day_devices, day, next_day) for row in partial]
+        sketches = {}
+        for label, operator, network_type, device_id in rows:
+            hashed = hash64(device_id)
+            hour = datetime.strptime(label, "%Y-%m-%d %H:%M")
+            for key in (_sketch_key("hour", hour, operator, network_type), _sketch_key("day", day, operator, network_type)):
+                sketch = sketches.get(key)
+                if sketch is None:
+                    sketch = sketches[key] = HyperLogLog()
+                sketch.add_hash(hashed)
+        store_sketches(sketches)
+        db.session.commit()
+        written += len(sketches)
+        day = next_day
+
+    cover_from = sketch_bucket(first, "day")
+    state = db.session.get(RollupState, SKETCH_STATE)
+    if state:
+        state.compacted_until = min(state.compacted_until, cover_from)
+    else:
+        db.session.add(RollupState(granularity=SKETCH_STATE, compacted_until=cover_from))
+    db.session.commit()
+    return written
+
+
+def _timestamp_bounds():
+    return db.session.query(func.min(CellRecord.timestamp), func.max(CellRecord.timestamp)).one()
+
+
+def _day_devices(day, next_day):
+    bucket = time_bucket(CellRecord.timestamp, "hour")
+    return db.session.query(bucket, CellRecord.operator, CellRecord.network_type, CellRecord.device_id).filter(
+        CellRecord.timestamp >= day, CellRecord.timestamp < next_day, CellRecord.device_id.isnot(None)
+    ).distinct().all()
+
+
+#  Keep sketches up to date on ingest when DEVICE_SKETCHES_ENABLED
+def init_device_sketches(app):
+    if not app.config.get('DEVICE_SKETCHES_ENABLED'):
+        return None
+    buffer = DeviceSketchBuffer(app, flush_interval=app.config.get('DEVICE_SKETCH_FLUSH_INTERVAL', 5.0))
+    app.extensions['device_sketches'] = buffer
+    register_ingest_listener(app, buffer.on_ingest)
+    return buffer
+
+
+def get_device_sketches(app):
+    return app.extensions.get('device_sketches')
@@ -0,0 +1,182 @@
+import csv
+import heapq
+import io
+import json
+import math
+from datetime import datetime
+from itertools import chain, islice
+from operator import itemgetter
+
+import numpy as np
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import Integer, literal_column, select
+
+from models import db, CellRecord
+from utils.archive import NUMERIC_COLUMNS, archive_days
+from utils.db_routing import shard_scope
+from utils.pagination import decode_cursor, encode_cursor, keyset_after
+from utils.sharding import get_shards, shard_results
+
+EXPORT_COLUMNS = (
+    "id", "timestamp", "username", "device_id", "operator", "network_type", "frequency_band",
+    "cell_id", "signal_power", "sinr", "device_ip", "device_mac"
+)
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# With shards, ids are only unique per shard: pages are ordered by (timestamp, shard, id)
+_SHARD_KEY = literal_column("shard", Integer)
+# Archived rows keep their database id and shard as source_id / source_shard
+_ARCHIVE_NAMES = [name for name in EXPORT_COLUMNS if name != "id"] + ["source_shard", "source_id"]
+
+
+#  Filters for an export request; raises ValueError on missing or malformed parameters
+def export_filters(args, username=None):
+    start_date = args.get('start_date')
+    end_date = args.get('end_date')
+    if not start_date or not end_date:
+        raise ValueError("Start and end dates required")
+
+    filters = [CellRecord.timestamp.between(datetime.fromisoformat(start_date), datetime.fromisoformat(end_date))]
+    if username is not None:
+        filters.append(CellRecord.username == username)
+    for name in ("device_id", "operator", "network_type"):
+        value = args.get(name)
+        if value:
+            filters.append(getattr(CellRecord, name) == value)
+    return filters
+
+
+#  Rows in time order through a server-side cursor, one partition of EXPORT_BATCH_SIZE rows at a time.
+#  With shards, every shard streams its rows and they are merged by timestamp, and so are the archived
+#  rows of days before the retention horizon, one day at a time.
+def _partitions(filters):
+    stmt = select(*(getattr(CellRecord, name) for name in EXPORT_COLUMNS)).where(*filters).order_by(
+        CellRecord.timestamp, CellRecord.id
+    ).execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    results = shard_results(stmt)
+    archived = _archived_rows(filters)
+    first = next(archived, None)
+    if len(results) == 1 and first is None:
+        yield from results[0].partitions()
+        return
+    if first is not None:
+        results.append(chain([first], archived))
+    rows = heapq.merge(*results, key=itemgetter(EXPORT_COLUMNS.index("timestamp")))
+    while True:
+        partition = list(islice(rows, EXPORT_BATCH_SIZE))
+        if not partition:
+            return
+        yield partition
+
+
+#  Archived rows as EXPORT_COLUMNS tuples in time order (source_id as the id, NaN as None)
+def _archived_rows(filters):
+    for selected in archive_days(_ARCHIVE_NAMES, filters):
+        yield from _archive_tuples(selected, np.arange(len(selected["timestamp"])))
+
+
+def _archive_tuples(selected, indexes):
+    columns = []
+    for name in EXPORT_COLUMNS:
+        values = selected["source_id" if name == "id" else name][indexes].tolist()
+        if name in NUMERIC_COLUMNS:
+            values = [None if math.isnan(value) else value for value in values]
+        columns.append(values)
+    return zip(*columns)
+
+
+def _row_values(row):
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
+
+
+def _ndjson_chunks(filters):
+    for rows in _partitions(filters):
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, _row_values(row)))) + "\n" for row in rows)
+
+
+def _csv_chunks(filters):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in _partitions(filters):
+        writer.writerows(_row_values(row) for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+#  One keyset page of raw measurements in (timestamp, id) order, rows shaped like the NDJSON export.
+#  Each source returns its next limit + 1 rows after the cursor: the database or every shard (ordered by
+#  (timestamp, shard, id) then), and the archive for days before the retention horizon. The merged page
+#  keeps the first limit of them.
+def record_page(filters, limit, after=None):
+    query = db.session.query(*(getattr(CellRecord, name) for name in EXPORT_COLUMNS)).filter(*filters)
+    shards = get_shards(current_app)
+    key_columns = [CellRecord.timestamp, _SHARD_KEY, CellRecord.id] if shards else [CellRecord.timestamp, CellRecord.id]
+    cursor = decode_cursor(after, key_columns) if after is not None else None
+    if shards:
+        candidates = _shard_candidates(query, shards.count, limit, cursor)
+    else:
+        if cursor is not None:
+            query = query.filter(keyset_after(key_columns, cursor))
+        rows = query.order_by(CellRecord.timestamp, CellRecord.id).limit(limit + 1).all()
+        candidates = [((row.timestamp, row.id), row) for row in rows]
+    candidates += _archive_candidates(filters, limit, cursor, bool(shards))
+
+    page = heapq.nsmallest(limit + 1, candidates, key=itemgetter(0))
+    next_cursor = encode_cursor(page[limit - 1][0]) if len(page) > limit else None
+    return [dict(zip(EXPORT_COLUMNS, _row_values(row))) for _, row in page[:limit]], next_cursor
+
+
+#  Next limit + 1 rows of every shard after the cursor (timestamp, shard, id), as (key, row)
+def _shard_candidates(query, shard_count, limit, cursor):
+    if cursor is not None:
+        timestamp, cursor_shard, cursor_id = cursor
+    candidates = []
+    for shard in range(shard_count):
+        shard_query = query
+        if cursor is not None:
+            if shard < cursor_shard:
+                shard_query = query.filter(CellRecord.timestamp > timestamp)
+            elif shard == cursor_shard:
+                shard_query = query.filter(keyset_after([CellRecord.timestamp, CellRecord.id], [timestamp, cursor_id]))
+            else:
+                shard_query = query.filter(CellRecord.timestamp >= timestamp)
+        with shard_scope(shard):
+            rows = shard_query.order_by(CellRecord.timestamp, CellRecord.id).limit(limit + 1).all()
+        candidates += [((row.timestamp, shard, row.id), row) for row in rows]
+    return candidates
+
+
+#  Next limit + 1 archived rows after the cursor, keyed like the database rows by source_shard / source_id
+def _archive_candidates(filters, limit, cursor, sharded):
+    if cursor is not None:
+        filters = [*filters, CellRecord.timestamp >= cursor[0]]
+    candidates = []
+    for selected in archive_days(_ARCHIVE_NAMES, filters):
+        timestamps, sources, ids = selected["timestamp"], selected["source_shard"], selected["source_id"]
+        order = np.lexsort((ids, sources, timestamps) if sharded else (ids, timestamps))
+        head = limit + 1 - len(candidates)
+        if cursor is not None:
+            head += int(np.count_nonzero(timestamps == np.datetime64(cursor[0], "us")))
+        order = order[:head]
+        keys = zip(timestamps[order].tolist(), sources[order].tolist(), ids[order].tolist())
+        for (timestamp, source, row_id), row in zip(keys, _archive_tuples(selected, order)):
+            key = (timestamp, source, row_id) if sharded else (timestamp, row_id)
+            if cursor is None or key > tuple(cursor):
+                candidates.append((key, row))
+        if len(candidates) > limit:
+            return candidates[:limit + 1]
+    return candidates
+
+
+#  Streaming response: the first bytes go out before the query has been fully read
+def export_response(filters, fmt):
+    chunks = _csv_chunks(filters) if fmt == "csv" else _ndjson_chunks(filters)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f"attachment; filename=cell_records.{fmt}"}
+    )
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event
+
+from models import User
+
+# What verify_token hands to the routes: the columns they read, detached from any session
+Identity = namedtuple("Identity", ["id", "username", "role"])
+
+
+#  Bounded LRU of verified identities keyed by user id, each entry valid for `ttl` seconds
+class IdentityCache:
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, identity):
+        with self._lock:
+            self._entries[identity.id] = (identity, time.monotonic() + self.ttl)
+            self._entries.move_to_end(identity.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+#  Enable the cache when AUTH_CACHE_TTL > 0. Deleting a user or changing their username/role through
+#  the ORM drops the entry in this worker; other workers pick the change up within the TTL. Admin routes
+#  never use a cached identity (verify_admin_token), so revoked admin access ends at once everywhere.
+def init_identity_cache(app):
+    ttl = app.config.get('AUTH_CACHE_TTL', 0)
+    if not ttl:
+        return None
+    cache = IdentityCache(maxsize=app.config.get('AUTH_CACHE_SIZE', 10000), ttl=ttl)
+    app.extensions['identity_cache'] = cache
+
+    def invalidate_user(mapper, connection, user):
+        cache.invalidate(user.id)
+
+    event.listen(User, 'after_update', invalidate_user)
+    event.listen(User, 'after_delete', invalidate_user)
+    return cache
+
+
+def get_identity_cache(app):
+    return app.extensions.get('identity_cache')
@@ -0,0 +1,18 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+#  Register fn(rows) to be called after CellRecord rows are committed by any ingest path
+def register_ingest_listener(app, fn):
+    app.extensions.setdefault('ingest_listeners', []).append(fn)
+
+
+#  Called by submit_data, the batch endpoint and the write-behind flusher after their commit.
+#  A failing listener is logged and never fails the ingest itself.
+def notify_ingest(app, rows):
+    for listener in app.extensions.get('ingest_listeners', []):
+        try:
+            listener(rows)
+        except Exception:
+            logger.exception("Ingest listener %r failed", listener)
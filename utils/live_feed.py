@@ -0,0 +1,280 @@
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+from utils.device_registry import CONNECTED_WINDOW, device_summary
+from utils.ingest_hooks import register_ingest_listener
+
+logger = logging.getLogger(__name__)
+
+# Minute buckets whose record counts the snapshot carries; same labels as
+# /admin/device_activity_trend?interval=minute
+ACTIVITY_WINDOW = timedelta(minutes=5)
+MINUTE_FORMAT = "%Y-%m-%d %H:%M"
+CHANNEL = "cell-live-feed"
+
+
+def format_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+
+#  What one ingest adds to the feed: the newest measurement per (username, device_id) and the rows per
+#  minute bucket, as JSON-ready values
+def ingest_delta(rows):
+    devices, counts = {}, {}
+    for row in rows:
+        timestamp = row["timestamp"]
+        label = timestamp.strftime(MINUTE_FORMAT)
+        counts[label] = counts.get(label, 0) + 1
+        if row.get("device_id") is None:
+            continue
+        key = (row["username"], row["device_id"])
+        if key not in devices or timestamp >= devices[key][0]:
+            devices[key] = (timestamp, row.get("device_ip"), row.get("device_mac"))
+    return {
+        "devices": [[username, device_id, timestamp.isoformat(), ip, mac]
+                    for (username, device_id), (timestamp, ip, mac) in devices.items()],
+        "counts": counts,
+    }
+
+
+#  Deltas stay in this process: each gunicorn worker's feed sees the ingests that worker handles
+class LocalChannel:
+    def __init__(self):
+        self.receive = None
+
+    def publish(self, delta):
+        self.receive(delta)
+
+    def start(self):
+        pass
+
+
+#  Deltas go through Redis pub/sub (optional dependency: pip install redis), so every worker's feed
+#  sees every worker's ingests. The listener thread starts with the worker's first stream.
+class RedisChannel:
+    def __init__(self, url, channel=CHANNEL, retry_pause=1.0):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LIVE_FEED_URL is set but the redis package is not installed")
+        self._redis = redis.Redis.from_url(url)
+        self.channel = channel
+        self.retry_pause = retry_pause
+        self.receive = None
+        self.errors = 0
+        self._thread = None
+
+    def publish(self, delta):
+        self._redis.publish(self.channel, json.dumps(delta))
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="live-feed-listener", daemon=True)
+            self._thread.start()
+
+    #  Deltas published while the connection is down are missed; reconnecting clients get a new snapshot
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self.receive(json.loads(message["data"]))
+            except Exception:
+                self.errors += 1
+                logger.exception("Live feed channel failed, resubscribing")
+                time.sleep(self.retry_pause)
+
+
+#  One SSE stream: a bounded queue of formatted events. A stream that falls queue_size events behind
+#  is marked overflowed and closed; the browser's EventSource reconnects and starts from a new snapshot.
+class Subscription:
+    def __init__(self, queue_size):
+        self.events = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+
+#  Pub/sub behind /admin/live_feed, fed by ingest: the ingest listener turns committed rows into a delta
+#  and publishes it on the channel, and every feed receiving it folds it into pending state under a lock.
+#  A publisher thread turns that into device_join / device_leave / activity events every interval
+#  seconds and hands them to subscribers without ever waiting on a slow one. Only the snapshot of a new
+#  stream reads the database; devices leave when no measurement of theirs arrived for CONNECTED_WINDOW.
+class LiveFeed:
+    def __init__(self, channel, max_streams=20, queue_size=256, interval=1.0, heartbeat=15.0):
+        self.channel = channel
+        self.channel.receive = self.receive
+        self.max_streams = max_streams
+        self.queue_size = queue_size
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._connected = {}  # (username, device_id) -> [last_seen, summary]
+        self._pending_joins = {}
+        self._pending_counts = {}  # minute bucket label -> rows ingested since the last publish
+        self._counters = {
+            "events_published": 0,
+            "streams_opened": 0,
+            "streams_rejected": 0,
+            "streams_overflowed": 0,
+            "publish_errors": 0,
+        }
+        self._thread = None
+
+    #  Register a stream, or None when this worker already serves max_streams of them
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self.max_streams:
+                self._counters["streams_rejected"] += 1
+                return None
+            subscription = Subscription(self.queue_size)
+            self._subscribers.add(subscription)
+            self._counters["streams_opened"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-feed-publisher", daemon=True)
+                self._thread.start()
+        self.channel.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    #  Merge the registry's connected devices into the tracked set and return the snapshot payload, with
+    #  the record counts of the last ACTIVITY_WINDOW minute buckets that activity events add to.
+    #  Called after subscribe(), so rows ingested meanwhile show up as (idempotent) join events and
+    #  may be counted in both.
+    def seed(self, devices, activity):
+        with self._lock:
+            for device in devices:
+                key = (device.username, device.device_id)
+                entry = self._connected.get(key)
+                if entry is None or device.last_seen > entry[0]:
+                    self._connected[key] = [device.last_seen, device_summary(device)]
+        return {"devices": [device_summary(device) for device in devices], "activity": activity}
+
+    #  Ingest listener: runs on the request or flusher thread after the commit. Without subscribers
+    #  anywhere to reach, a local delta is not even built.
+    def on_ingest(self, rows):
+        if isinstance(self.channel, LocalChannel) and not self._subscribers:
+            return
+        self.channel.publish(ingest_delta(rows))
+
+    #  Fold a delta from the channel into the pending events; only dictionaries are updated
+    def receive(self, delta):
+        if not self._subscribers:
+            return
+        cutoff = datetime.utcnow() - CONNECTED_WINDOW
+        with self._lock:
+            for label, count in delta["counts"].items():
+                self._pending_counts[label] = self._pending_counts.get(label, 0) + count
+            for username, device_id, last_seen, ip, mac in delta["devices"]:
+                last_seen = datetime.fromisoformat(last_seen)
+                if last_seen < cutoff:
+                    continue
+                key = (username, device_id)
+                entry = self._connected.get(key)
+                if entry is not None and last_seen < entry[0]:
+                    continue
+                summary = {"username": username, "device_id": device_id, "ip": ip, "mac": mac}
+                if entry is None:
+                    self._pending_joins[key] = summary
+                self._connected[key] = [last_seen, summary]
+
+    #  SSE body for one subscription: snapshot first, then live events with keep-alive comments
+    def stream(self, subscription, snapshot):
+        try:
+            yield format_event("snapshot", snapshot)
+            while not subscription.overflowed:
+                try:
+                    yield subscription.events.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+            yield format_event("overflow", {"error": "Stream fell behind, reconnect for a new snapshot"})
+        finally:
+            self.unsubscribe(subscription)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["streams"] = len(self._subscribers)
+            stats["connected_devices"] = len(self._connected)
+        stats["max_streams"] = self.max_streams
+        stats["channel"] = type(self.channel).__name__
+        stats["channel_errors"] = getattr(self.channel, "errors", 0)
+        return stats
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self._publish()
+            except Exception:
+                self._count("publish_errors")
+                logger.exception("Live feed publish failed")
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _publish(self):
+        cutoff = datetime.utcnow() - CONNECTED_WINDOW
+        with self._lock:
+            if not self._subscribers:
+                # Nobody is watching: drop the tracked state, the next subscriber seeds it again
+                self._connected.clear()
+                self._pending_joins.clear()
+                self._pending_counts.clear()
+                return
+            joins, self._pending_joins = self._pending_joins, {}
+            counts, self._pending_counts = self._pending_counts, {}
+            stale = [key for key, (last_seen, _) in self._connected.items() if last_seen < cutoff]
+            leaves = [self._connected.pop(key)[1] for key in stale]
+            subscribers = list(self._subscribers)
+
+        events = [format_event("device_join", summary) for summary in joins.values()]
+        events += [format_event("device_leave", summary) for summary in leaves]
+        if counts:
+            events.append(format_event("activity", {"interval": "minute", "counts": dict(sorted(counts.items()))}))
+        if not events:
+            return
+
+        overflowed = 0
+        for subscription in subscribers:
+            for event in events:
+                if subscription.overflowed:
+                    break
+                try:
+                    subscription.events.put_nowait(event)
+                except queue.Full:
+                    subscription.overflowed = True
+                    overflowed += 1
+        with self._lock:
+            self._counters["events_published"] += len(events)
+            self._counters["streams_overflowed"] += overflowed
+
+
+#  Enable the feed when LIVE_FEED_ENABLED; streams are capped per worker by LIVE_FEED_MAX_STREAMS.
+#  LIVE_FEED_URL=redis://... shares ingest deltas between workers.
+def init_live_feed(app):
+    if not app.config.get('LIVE_FEED_ENABLED'):
+        return None
+    url = app.config.get('LIVE_FEED_URL')
+    feed = LiveFeed(
+        RedisChannel(url) if url else LocalChannel(),
+        max_streams=app.config.get('LIVE_FEED_MAX_STREAMS', 20),
+        queue_size=app.config.get('LIVE_FEED_QUEUE_SIZE', 256),
+        interval=app.config.get('LIVE_FEED_INTERVAL', 1.0),
+        heartbeat=app.config.get('LIVE_FEED_HEARTBEAT', 15.0),
+    )
+    app.extensions['live_feed'] = feed
+    register_ingest_listener(app, feed.on_ingest)
+    return feed
+
+
+def get_live_feed(app):
+    return app.extensions.get('live_feed')
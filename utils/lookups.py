@@ -0,0 +1,176 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, insert, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db, CellRecord, DeviceCode, FrequencyBandCode, NetworkTypeCode, OperatorCode, User
+from utils.db_routing import RoutingSession
+
+# Lookup table and value column per dictionary-encoded CellRecord column. Codes are the tables'
+# autoincrement ids, so values added since the last refresh have higher codes than any cached one.
+LOOKUPS = {
+    "operator": (OperatorCode, OperatorCode.value),
+    "network_type": (NetworkTypeCode, NetworkTypeCode.value),
+    "frequency_band": (FrequencyBandCode, FrequencyBandCode.value),
+    "device_id": (DeviceCode, DeviceCode.value),
+    "username": (User, User.username),
+}
+# Users are created by registration; the other lookups grow as new values are inserted
+REGISTERED_KINDS = ("operator", "network_type", "frequency_band", "device_id")
+# Values found in no lookup table answer None without a query for this long (filters on unknown
+# values), so a value registered by another worker can be missed by this one for as long
+MISSING_TTL = 5.0
+MISSING_LIMIT = 10000
+
+
+#  Per-process cache of the lookup tables, both ways ({value: code} and {code: value}). A miss
+#  loads the rows added since the last refresh, then falls back to the single row (ids can commit out
+#  of order). Lookup rows are read and written on the primary, outside the caller's transaction.
+class LookupCache:
+    def __init__(self):
+        self._codes = {kind: {} for kind in LOOKUPS}
+        self._values = {kind: {} for kind in LOOKUPS}
+        self._missing = {kind: {} for kind in LOOKUPS}  # value -> monotonic time until it is known missing
+        self._lock = threading.Lock()
+        self._counters = {"refreshes": 0, "registered": 0, "misses": 0, "missing_hits": 0}
+
+    #  Code of a value, None when it is not in the lookup table
+    def code(self, kind, value):
+        value = str(value)
+        code = self._codes[kind].get(value)
+        if code is not None:
+            return code
+        if self._missing[kind].get(value, 0) > time.monotonic():
+            self._count("missing_hits")
+            return None
+        self._refresh(kind)
+        code = self._codes[kind].get(value)
+        if code is None:
+            code = self._load_one(kind, LOOKUPS[kind][1] == value)
+        if code is None:
+            with self._lock:
+                missing = self._missing[kind]
+                if len(missing) >= MISSING_LIMIT:
+                    missing.clear()
+                missing[value] = time.monotonic() + MISSING_TTL
+        return code
+
+    def value(self, kind, code):
+        value = self._values[kind].get(code)
+        if value is None:
+            self._refresh(kind)
+            value = self._values[kind].get(code)
+        if value is None:
+            self._load_one(kind, LOOKUPS[kind][0].id == code)
+            value = self._values[kind].get(code)
+        return value
+
+    #  The live {value: code} / {code: value} dicts of a kind, for the column type's processors
+    def codes(self, kind):
+        return self._codes[kind]
+
+    def values(self, kind):
+        return self._values[kind]
+
+    #  Add the missing categorical values of CellRecord rows (dicts) to their lookup tables
+    def register(self, rows):
+        for kind in REGISTERED_KINDS:
+            values = {row.get(kind) for row in rows}
+            values.discard(None)
+            missing = {str(value) for value in values} - self._codes[kind].keys()
+            if missing:
+                self._register(kind, missing)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            for kind in LOOKUPS:
+                stats[f"{kind}_cached"] = len(self._codes[kind])
+        return stats
+
+    #  All missing values of a batch in one statement that skips the ones another worker registered
+    #  meanwhile, then one read of their codes: two round trips whatever the number of new values
+    def _register(self, kind, values):
+        model, column = LOOKUPS[kind]
+        values = sorted(values)
+        with db.engine.begin() as connection:
+            dialect = connection.dialect.name
+            if dialect == "sqlite":
+                stmt = sqlite_insert(model).on_conflict_do_nothing(index_elements=[column.key])
+            elif dialect == "mysql":
+                stmt = insert(model).prefix_with("IGNORE")
+            else:
+                stmt = None
+            if stmt is not None:
+                connection.execute(stmt, [{column.key: value} for value in values])
+        if stmt is None:
+            self._register_each(kind, values)
+        self._count("registered", len(values))
+        self._load(kind, column.in_(values))
+
+    #  One transaction per value, for databases without an insert that skips duplicates
+    def _register_each(self, kind, values):
+        model, column = LOOKUPS[kind]
+        for value in values:
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(model).values({column.key: value}))
+            except IntegrityError:
+                pass  # registered concurrently by another worker
+
+    def _refresh(self, kind):
+        model, column = LOOKUPS[kind]
+        known = max(self._values[kind], default=0)
+        with db.engine.connect() as connection:
+            rows = connection.execute(select(model.id, column).where(model.id > known)).all()
+        self._store(kind, rows)
+        self._count("refreshes")
+
+    def _load_one(self, kind, condition):
+        self._count("misses")
+        rows = self._load(kind, condition)
+        return rows[0][0] if rows else None
+
+    def _load(self, kind, condition):
+        model, column = LOOKUPS[kind]
+        with db.engine.connect() as connection:
+            rows = connection.execute(select(model.id, column).where(condition)).all()
+        self._store(kind, rows)
+        return rows
+
+    def _store(self, kind, rows):
+        with self._lock:
+            for code, value in rows:
+                self._codes[kind][value] = code
+                self._values[kind][code] = value
+                self._missing[kind].pop(value, None)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+
+#  ORM-added CellRecord objects register their values before the flush inserts them
+def _register_new_records(session, flush_context, instances):
+    rows = [
+        {kind: getattr(record, kind) for kind in REGISTERED_KINDS}
+        for record in session.new if isinstance(record, CellRecord)
+    ]
+    if rows:
+        get_lookups(current_app).register(rows)
+
+
+#  Lookup cache of the dictionary-encoded CellRecord columns (always on: the schema needs it)
+def init_lookups(app):
+    lookups = LookupCache()
+    app.extensions['lookups'] = lookups
+    if not event.contains(RoutingSession, "before_flush", _register_new_records):
+        event.listen(RoutingSession, "before_flush", _register_new_records)
+    return lookups
+
+
+def get_lookups(app):
+    return app.extensions.get('lookups')
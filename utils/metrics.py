@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, request, has_app_context, has_request_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 1000, 10000, 100000, 1000000)
+SLOW_LOG_MAX_STATEMENTS = 20
+
+METRIC_HELP = {
+    "http_request_duration_seconds": ("histogram", "Request latency by route, method and status"),
+    "db_queries_per_request": ("histogram", "SQL statements executed per request"),
+    "db_query_seconds_per_request": ("histogram", "Time spent in SQL per request"),
+    "db_rows_per_request": ("histogram", "Rows returned per request (where the driver reports them)"),
+    "db_queries_total": ("counter", "SQL statements executed"),
+    "db_query_seconds_total": ("counter", "Time spent executing SQL"),
+    "section_duration_seconds": ("histogram", "Time spent in instrumented sections"),
+    "password_hash_seconds": ("histogram", "bcrypt hash/check time in the password pool"),
+    "password_pool_wait_seconds": ("histogram", "Time a hash/check waited for a password pool slot"),
+    "login_attempts_total": ("counter", "Login and registration attempts by endpoint and outcome"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+#  Process-local counters and histograms, rendered in the Prometheus text exposition format.
+#  Every gunicorn worker keeps its own registry.
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                histogram = self._series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    #  gauges: extra (name, labels dict, value) samples collected at scrape time
+    def render(self, gauges=()):
+        lines = []
+        described = set()
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: item[0])
+            for (name, labels), value in series:
+                if name not in described and name in METRIC_HELP:
+                    kind, help_text = METRIC_HELP[name]
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    described.add(name)
+                if isinstance(value, Histogram):
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f"{name}_bucket{_labels(labels, le=f'{bound:g}')} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {value.total}")
+                    lines.append(f"{name}_sum{_labels(labels)} {value.sum:.6f}")
+                    lines.append(f"{name}_count{_labels(labels)} {value.total}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {value:g}")
+        for name, labels, value in gauges:
+            if name not in described:
+                lines.append(f"# TYPE {name} gauge")
+                described.add(name)
+            lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for key, value in pairs
+    ) + "}"
+
+
+def get_metrics(app):
+    return app.extensions.get('metrics')
+
+
+#  Time a block and record it as section_duration_seconds{section=name} (no-op when metrics are off)
+@contextmanager
+def timed_section(name):
+    registry = get_metrics(current_app) if has_app_context() else None
+    if registry is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("section_duration_seconds", time.perf_counter() - start, {"section": name})
+
+
+#  JSON provider that times serialization of every jsonify() response
+class TimedJSONProvider(DefaultJSONProvider):
+    def response(self, *args, **kwargs):
+        with timed_section("serialization"):
+            return super().response(*args, **kwargs)
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+    g.db_rows = 0
+    g.db_statements = []
+
+
+def _after_request(response):
+    registry = get_metrics(current_app)
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    app = current_app._get_current_object()
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    record = (app, registry, g._get_current_object(), start, route, request.method, str(response.status_code),
+              request.full_path)
+    if response.is_streamed:
+        # The body is produced after this hook: time the request once the server has sent it and closed it
+        response.call_on_close(lambda: _record_request(*record))
+    else:
+        _record_request(*record)
+    return response
+
+
+#  `stats` is the request's g, still counting the statements a streamed body runs (stream_with_context)
+def _record_request(app, registry, stats, start, route, method, status, path):
+    elapsed = time.perf_counter() - start
+    registry.observe("http_request_duration_seconds", elapsed, {"route": route, "method": method, "status": status})
+    registry.observe("db_queries_per_request", stats.db_queries, {"route": route}, COUNT_BUCKETS)
+    registry.observe("db_query_seconds_per_request", stats.db_seconds, {"route": route})
+    registry.observe("db_rows_per_request", stats.db_rows, {"route": route}, COUNT_BUCKETS)
+
+    slow_ms = app.config.get('SLOW_REQUEST_MS', 0)
+    if slow_ms and elapsed * 1000 >= slow_ms:
+        logger.warning(
+            "Slow request %s %s: %.1f ms, %d queries in %.1f ms\n%s",
+            method, path, elapsed * 1000, stats.db_queries, stats.db_seconds * 1000,
+            "\n".join(f"  [{seconds * 1000:.1f} ms] {statement}" for statement, seconds in stats.db_statements)
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if not has_app_context():
+        return
+    app = current_app._get_current_object()
+    registry = get_metrics(app)
+    if registry is None:
+        return
+    registry.inc("db_queries_total")
+    registry.inc("db_query_seconds_total", amount=elapsed)
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+        if cursor.rowcount and cursor.rowcount > 0 and statement.lstrip()[:6].upper() == "SELECT":
+            g.db_rows += cursor.rowcount
+        if app.config.get('SLOW_REQUEST_MS') and len(g.db_statements) < SLOW_LOG_MAX_STATEMENTS:
+            g.db_statements.append((statement, elapsed))
+
+
+#  A statement that raised in the cursor never reaches after_cursor_execute: drop its start time, or the
+#  connection would keep it and the next statement on it would pop the wrong one. Errors compiling the
+#  statement (no execution context yet) never pushed one.
+def _handle_error(context):
+    if context.connection is None or context.execution_context is None:
+        return
+    starts = context.connection.info.get('metrics_query_start')
+    if starts:
+        starts.pop()
+
+
+#  Per-route latency histograms, per-request SQL counters and section timers, when METRICS_ENABLED
+def init_metrics(app):
+    if not app.config.get('METRICS_ENABLED'):
+        return None
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+    app.json = TimedJSONProvider(app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    return registry
@@ -0,0 +1,146 @@
+import logging
+
+from flask import current_app
+from sqlalchemy import MetaData, Table, func, insert, inspect, select, text
+from sqlalchemy.schema import DropConstraint
+
+from models import db, CellRecord
+from utils.db_routing import SHARDED_TABLES, shard_bind
+from utils.lookups import get_lookups
+from utils.sharding import create_shard_tables
+
+logger = logging.getLogger(__name__)
+
+# Old-schema cell_record tables (text categories and username) are renamed to this and copied over
+LEGACY_CELL_RECORD = "cell_record_legacy"
+COPY_BATCH = 5000
+
+
+#  Bring an existing database up to the current models: create missing tables, nullable columns and
+#  indexes, on the primary and on every shard, and convert old-schema cell_record tables to the compact one.
+#  Safe to run repeatedly; returns the names of everything it created or converted.
+def upgrade_schema():
+    engines = _cell_record_engines()
+    dropped = []
+    for name, engine in engines.items():
+        _retire_legacy_cell_records(engine)
+        if _drop_device_cell_rollups(engine):
+            dropped.append(f"{name}cell_stat_rollup (per-device rollups dropped, recompacted by compact-rollups)")
+
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = [table.name for table in db.metadata.sorted_tables if table.name not in existing_tables]
+    db.create_all()
+    created += _add_missing_columns(db.engine, db.metadata.sorted_tables)
+
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                index.create(db.engine)
+                created.append(index.name)
+    created += create_shard_tables()
+    for name, engine in engines.items():
+        if name:
+            tables = [table for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+            created += [f"{name}{column}" for column in _add_missing_columns(engine, tables)]
+
+    for name, engine in engines.items():
+        copied = _copy_legacy_cell_records(engine)
+        if copied is not None:
+            created.append(f"{name}cell_record ({copied} rows converted from {LEGACY_CELL_RECORD})")
+    return created + dropped
+
+
+#  ALTER TABLE ... ADD COLUMN for the nullable model columns an existing table lacks; returns "table.column"
+def _add_missing_columns(engine, tables):
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as connection:
+        for table in tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    added.append(f"{table.name}.{column.name}")
+    return added
+
+
+#  {"" or "shardN.": engine} of every database holding a cell_record table
+def _cell_record_engines():
+    engines = {"": db.engine}
+    shard = 0
+    while shard_bind(shard) in db.engines:
+        engines[f"{shard_bind(shard)}."] = db.engines[shard_bind(shard)]
+        shard += 1
+    return engines
+
+
+#  Rename an old-schema cell_record (no user_id column) out of the way, without its indexes and
+#  foreign keys, whose names the new table reuses
+def _retire_legacy_cell_records(engine):
+    inspector = inspect(engine)
+    if "cell_record" not in inspector.get_table_names():
+        return
+    if "user_id" in {column['name'] for column in inspector.get_columns("cell_record")}:
+        return
+    legacy = Table("cell_record", MetaData(), autoload_with=engine)
+    with engine.begin() as connection:
+        if engine.dialect.name != "sqlite":
+            for constraint in legacy.foreign_key_constraints:
+                connection.execute(DropConstraint(constraint))
+        for index in legacy.indexes:
+            index.drop(connection)
+        connection.execute(text(f"ALTER TABLE cell_record RENAME TO {LEGACY_CELL_RECORD}"))
+    logger.info("Renamed old-schema cell_record to %s on %s", LEGACY_CELL_RECORD, engine.url)
+
+
+#  Drop a cell_stat_rollup of per-device rows (device_id column) and its watermark: the per-cell
+#  rollups are derived data, recreated empty and rebuilt by the next "cell" compaction. Returns whether
+#  it was dropped.
+def _drop_device_cell_rollups(engine):
+    inspector = inspect(engine)
+    if "cell_stat_rollup" not in inspector.get_table_names():
+        return False
+    if "device_id" not in {column['name'] for column in inspector.get_columns("cell_stat_rollup")}:
+        return False
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE cell_stat_rollup"))
+        if "rollup_state" in inspector.get_table_names():
+            connection.execute(text("DELETE FROM rollup_state WHERE granularity = 'cell'"))
+    logger.info("Dropped per-device cell_stat_rollup on %s", engine.url)
+    return True
+
+
+#  Copy the rows of cell_record_legacy into the compact cell_record, keeping their ids, in batches
+#  (resumes after the last copied id). The app must be stopped meanwhile: new rows would take ids of
+#  rows still to copy. The legacy table is kept; drop it once the conversion is verified.
+#  Returns the rows copied, None without a legacy table.
+def _copy_legacy_cell_records(engine):
+    if LEGACY_CELL_RECORD not in inspect(engine).get_table_names():
+        return None
+    legacy = Table(LEGACY_CELL_RECORD, MetaData(), autoload_with=engine)
+    table = CellRecord.__table__
+    with engine.connect() as connection:
+        last_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+
+    lookups = get_lookups(current_app)
+    copied = 0
+    while True:
+        with engine.connect() as connection:
+            rows = connection.execute(select(legacy).where(
+                legacy.c.id > last_id
+            ).order_by(legacy.c.id).limit(COPY_BATCH)).mappings().all()
+        if not rows:
+            return copied
+        lookups.register(rows)
+        with engine.begin() as connection:
+            connection.execute(insert(table), [{column.key: row[column.key] for column in table.columns} for row in rows])
+        copied += len(rows)
+        last_id = rows[-1]["id"]
+        logger.info("Converted %d cell_record rows on %s", copied, engine.url)
@@ -0,0 +1,91 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import DateTime, Integer, and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+#  limit/after query parameters; raises ValueError on malformed values
+def page_params(args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit, args.get('after') or None
+
+
+#  Opaque cursor: the sort key of the last row of a page, base64url-encoded JSON
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        for column, value in zip(columns, values):
+            if isinstance(column.type, Integer) and (not isinstance(value, int) or isinstance(value, bool)):
+                raise ValueError
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+
+
+#  Rows strictly after the cursor in (columns...) order. The leading column also gets a plain >= bound,
+#  which MySQL turns into an index range instead of evaluating the OR chain row by row.
+def keyset_after(columns, values):
+    condition = columns[-1] > values[-1]
+    for column, value in zip(reversed(columns[:-1]), reversed(values[:-1])):
+        condition = or_(column > value, and_(column == value, condition))
+    if len(columns) > 1:
+        condition = and_(columns[0] >= values[0], condition)
+    return condition
+
+
+#  One keyset page of query ordered by columns (unique together, ideally an index prefix).
+#  Fetches limit + 1 rows to know whether there is a next page; returns (rows, next cursor or None).
+def keyset_page(query, columns, limit, after=None):
+    if after is not None:
+        query = query.filter(keyset_after(columns, decode_cursor(after, columns)))
+    rows = query.order_by(*columns).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+
+
+#  Every row of query in keyset pages of page_size, so callers never hold the full result
+def iter_keyset(query, columns, page_size=MAX_PAGE_SIZE):
+    after = None
+    while True:
+        rows, after = keyset_page(query, columns, page_size, after)
+        yield from rows
+        if after is None:
+            return
+
+
+#  Unpaginated listing kept for existing clients: the JSON array is streamed from keyset pages
+#  instead of being built in the worker
+def stream_json_array(items, flush_every=500):
+    def chunks():
+        parts = ["["]
+        for index, item in enumerate(items):
+            parts.append(("," if index else "") + json.dumps(item))
+            if len(parts) >= flush_every:
+                yield "".join(parts)
+                parts = []
+        parts.append("]")
+        yield "".join(parts)
+    return Response(stream_with_context(chunks()), mimetype="application/json")
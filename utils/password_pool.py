@@ -0,0 +1,117 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, request
+from sqlalchemy import update
+
+from models import db, bcrypt, User
+from utils.metrics import get_metrics
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+#  Bounded pool for bcrypt hashing/verification. bcrypt releases the GIL, so a small thread pool caps
+#  how many hashes a worker runs at once; requests beyond max_pending wait at most wait_timeout for a
+#  slot and are then shed (PasswordPoolBusy -> 503) instead of piling up and starving ingest.
+#  The waiting happens on request threads, so the bound only matters with threaded workers
+#  (gunicorn.conf.py); across the deployment at most WEB_CONCURRENCY * workers hashes run at once.
+class PasswordPool:
+    def __init__(self, workers=2, max_pending=8, wait_timeout=1.0, rounds=12, metrics=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.wait_timeout = wait_timeout
+        self.rounds = rounds
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-pool")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._counters = {"hashed": 0, "checked": 0, "rejected": 0, "pending": 0}
+
+    def hash_password(self, password):
+        return self._run("hash", bcrypt.generate_password_hash, password, self.rounds).decode('utf-8')
+
+    def check_password(self, hashed_password, password):
+        return self._run("check", bcrypt.check_password_hash, hashed_password, password)
+
+    #  Hashes made with another cost factor are upgraded on the next successful login
+    def needs_rehash(self, hashed_password):
+        parts = hashed_password.split("$")
+        return len(parts) < 3 or not parts[2].isdigit() or int(parts[2]) != self.rounds
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["workers"] = self.workers
+        stats["max_pending"] = self.max_pending
+        stats["rounds"] = self.rounds
+        return stats
+
+    def _run(self, operation, fn, *args):
+        queued = time.perf_counter()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            self._count("rejected")
+            raise PasswordPoolBusy()
+        self._count("pending")
+        try:
+            return self._executor.submit(self._timed, operation, queued, fn, *args).result()
+        finally:
+            self._count("pending", -1)
+            self._count("hashed" if operation == "hash" else "checked")
+            self._slots.release()
+
+    def _timed(self, operation, queued, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if self.metrics is not None:
+                labels = {"operation": operation}
+                self.metrics.observe("password_pool_wait_seconds", start - queued, labels)
+                self.metrics.observe("password_hash_seconds", time.perf_counter() - start, labels)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+
+#  Pool sizes from PASSWORD_POOL_*; the cost factor for new hashes from BCRYPT_LOG_ROUNDS
+def init_password_pool(app):
+    pool = PasswordPool(
+        workers=app.config.get('PASSWORD_POOL_WORKERS', 2),
+        max_pending=app.config.get('PASSWORD_POOL_MAX_PENDING', 8),
+        wait_timeout=app.config.get('PASSWORD_POOL_WAIT_TIMEOUT', 1.0),
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', 12),
+        metrics=get_metrics(app),
+    )
+    app.extensions['password_pool'] = pool
+    return pool
+
+
+def get_password_pool(app):
+    return app.extensions['password_pool']
+
+
+#  After a successful login: re-hash with the configured cost factor if it changed (best effort). Called
+#  with no connection checked out; the hash is only replaced if no other login changed it meanwhile.
+def upgrade_hash(user_id, hashed_password, password):
+    pool = get_password_pool(current_app)
+    if not pool.needs_rehash(hashed_password):
+        return
+    try:
+        new_hash = pool.hash_password(password)
+    except PasswordPoolBusy:
+        return
+    db.session.execute(update(User).where(
+        User.id == user_id, User.hashed_password == hashed_password
+    ).values(hashed_password=new_hash))
+    db.session.commit()
+
+
+#  login_attempts_total{endpoint, outcome}: success | invalid | busy | missing_fields
+def record_login(outcome):
+    registry = get_metrics(current_app)
+    if registry is not None:
+        registry.inc("login_attempts_total", {"endpoint": request.path, "outcome": outcome})
@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from utils.ingest_hooks import register_ingest_listener
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+#  In-process LRU backend: entries carry an expiry and the time range they cover. Invalidations only
+#  reach the worker that ingested the late rows, so other workers rely on the (short) past window TTL.
+class MemoryBackend:
+    shared = False
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            payload, expires_at, _, _ = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload, ttl, start_dt, end_dt):
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (payload, expires_at, start_dt, end_dt)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    #  Drop every entry whose window overlaps [lo, hi]; returns how many were dropped
+    def invalidate_range(self, lo, hi):
+        with self._lock:
+            stale = [key for key, (_, _, start, end) in self._entries.items() if start <= hi and end >= lo]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def size(self):
+        return len(self._entries)
+
+
+#  Shared backend on Redis (optional dependency: pip install redis), usable across gunicorn workers.
+#  Every cached window is a member "start|end|key" of two sorted sets: "ranges" scored by the window's
+#  end, so late measurements only scan the windows ending after them, and "expiry" scored by when the
+#  payload expires, so members of expired payloads are pruned on every store and invalidation.
+class RedisBackend:
+    shared = True
+
+    def __init__(self, url, prefix="cell-cache:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RESPONSE_CACHE_URL is set but the redis package is not installed")
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, payload, ttl, start_dt, end_dt):
+        member = f"{start_dt.isoformat()}|{end_dt.isoformat()}|{key}"
+        pipe = self._redis.pipeline()
+        pipe.set(self.prefix + key, json.dumps(payload), ex=max(1, int(ttl)))
+        pipe.zadd(self.prefix + "ranges", {member: _epoch_seconds(end_dt)})
+        pipe.zadd(self.prefix + "expiry", {member: time.time() + ttl})
+        pipe.execute()
+        self._prune()
+
+    def invalidate_range(self, lo, hi):
+        self._prune()
+        stale = []
+        for member in self._redis.zrangebyscore(self.prefix + "ranges", _epoch_seconds(lo), "+inf"):
+            start, _, key = member.decode().split("|", 2)
+            if datetime.fromisoformat(start) <= hi:
+                stale.append((member, key))
+        if stale:
+            pipe = self._redis.pipeline()
+            pipe.delete(*(self.prefix + key for _, key in stale))
+            pipe.zrem(self.prefix + "ranges", *(member for member, _ in stale))
+            pipe.zrem(self.prefix + "expiry", *(member for member, _ in stale))
+            pipe.execute()
+        return len(stale)
+
+    def size(self):
+        return self._redis.zcard(self.prefix + "ranges")
+
+    def _prune(self):
+        now = time.time()
+        expired = self._redis.zrangebyscore(self.prefix + "expiry", "-inf", now)
+        if expired:
+            pipe = self._redis.pipeline()
+            pipe.zrem(self.prefix + "ranges", *expired)
+            pipe.zremrangebyscore(self.prefix + "expiry", "-inf", now)
+            pipe.execute()
+
+
+def _epoch_seconds(dt):
+    return (dt - EPOCH).total_seconds()
+
+
+#  Cache of admin analytics payloads keyed by endpoint, normalized date range and extra parameters.
+#  Windows ending before now - past_after are cached for past_ttl; windows overlapping "now" use live_ttl.
+#  Ingest of measurements older than past_after invalidates the cached windows that contain them.
+class ResponseCache:
+    def __init__(self, backend, live_ttl=15.0, past_after=timedelta(days=1), past_ttl=300.0):
+        self.backend = backend
+        self.live_ttl = live_ttl
+        self.past_after = past_after
+        self.past_ttl = past_ttl
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(endpoint, start_dt, end_dt, **params):
+        extra = "&".join(f"{name}={params[name]}" for name in sorted(params) if params[name] is not None)
+        return f"{endpoint}|{start_dt.isoformat()}|{end_dt.isoformat()}|{extra}"
+
+    #  Return the cached payload for this request, computing and storing it on a miss
+    def get_or_compute(self, endpoint, start_dt, end_dt, compute, **params):
+        key = self.make_key(endpoint, start_dt, end_dt, **params)
+        payload = self.backend.get(key)
+        if payload is not None:
+            self._count("hits")
+            return payload
+
+        self._count("misses")
+        payload = compute()
+        is_past = end_dt < datetime.utcnow() - self.past_after
+        self.backend.set(key, payload, self.past_ttl if is_past else self.live_ttl, start_dt, end_dt)
+        self._count("stores")
+        return payload
+
+    #  Ingest listener: only late rows matter, live windows expire on their own
+    def on_ingest(self, rows):
+        cutoff = datetime.utcnow() - self.past_after
+        late = [row["timestamp"] for row in rows if row["timestamp"] < cutoff]
+        if late:
+            self._count("invalidations", self.backend.invalidate_range(min(late), max(late)))
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["size"] = self.backend.size()
+        stats["evictions"] = self.backend.evictions
+        stats["backend"] = type(self.backend).__name__
+        return stats
+
+
+#  Enable the cache when RESPONSE_CACHE_ENABLED; RESPONSE_CACHE_URL selects the shared Redis backend.
+#  Past windows stay RESPONSE_CACHE_PAST_TTL seconds: a day on Redis, where every worker's late ingests
+#  invalidate them, but only 5 minutes per process, which is how stale other workers' copies can get.
+def init_response_cache(app):
+    if not app.config.get('RESPONSE_CACHE_ENABLED'):
+        return None
+    url = app.config.get('RESPONSE_CACHE_URL')
+    backend = RedisBackend(url) if url else MemoryBackend(app.config.get('RESPONSE_CACHE_SIZE', 512))
+    past_ttl = app.config.get('RESPONSE_CACHE_PAST_TTL')
+    cache = ResponseCache(
+        backend,
+        live_ttl=app.config.get('RESPONSE_CACHE_LIVE_TTL', 15.0),
+        past_after=timedelta(seconds=app.config.get('RESPONSE_CACHE_PAST_AFTER', 86400)),
+        past_ttl=float(past_ttl) if past_ttl else (86400.0 if backend.shared else 300.0)
+    )
+    app.extensions['response_cache'] = cache
+    register_ingest_listener(app, cache.on_ingest)
+    return cache
+
+
+def get_response_cache(app):
+    return app.extensions.get('response_cache')
+
+
+#  Cached payload when the cache is enabled, otherwise compute() straight away
+def cached_payload(app, endpoint, start_dt, end_dt, compute, **params):
+    cache = get_response_cache(app)
+    if not cache:
+        return compute()
+    return cache.get_or_compute(endpoint, start_dt, end_dt, compute, **params)
@@ -0,0 +1,129 @@
+import logging
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+
+from models import db, CellRecord, CellRollup, CellStatRollup
+from utils.aggregations import TOTAL_FIELDS
+from utils.archive import ARCHIVE_COLUMNS, ARCHIVE_PARTITION, NUMERIC_COLUMNS, get_archive, group_totals, partition_day
+from utils.db_routing import current_shard
+from utils.rollups import GRANULARITIES, compact_rollups, compacted_until
+from utils.sharding import get_shards, partition_rows, scatter
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH = 1000
+ROLLUP_KEYS = ("bucket", "operator", "network_type", "username", "device_id")
+
+
+#  Move raw measurements older than `older_than` (whole days) from CellRecord into the cold archive,
+#  keeping their per-device hour rollups and dropping their minute and per-cell rollups. Rollups are compacted first,
+#  and no day past the oldest hour watermark is archived. Each day is written to its archive partition,
+#  then its hour rollups are rebuilt from the partition and its raw rows deleted, shard by shard, and
+#  then the archive horizon moves past it. Raw rows that arrive for an archived day are merged into its
+#  partition on the next run. Returns {"days", "records", "archived_until"}.
+def apply_retention(older_than, now=None):
+    archive = get_archive(current_app)
+    if archive is None:
+        raise RuntimeError("No archive configured (ARCHIVE_DIR)")
+
+    now = now or datetime.utcnow()
+    for granularity in GRANULARITIES:
+        scatter(compact_rollups, granularity, now=now)
+    cutoff = partition_day(now - older_than)
+    watermarks = [until for until in scatter(compacted_until, "hour") if until is not None]
+    if watermarks:
+        cutoff = min(cutoff, partition_day(min(watermarks)))
+
+    oldest = [first for first in scatter(_oldest_record) if first is not None]
+    summary = {"days": 0, "records": 0}
+    day = partition_day(min(oldest)) if oldest else cutoff
+    while day < cutoff:
+        next_day = day + ARCHIVE_PARTITION
+        batches = [(shard, rows) for shard, rows in scatter(_day_records, day, next_day) if rows]
+        if batches:
+            partition = archive.append(day, _archive_columns(batches))
+            ids = {shard: [row.id for row in rows] for shard, rows in batches}
+            scatter(_retire_day, day, next_day, ids, _by_shard(_hour_rollups(partition)))
+            archive.set_horizon(max(next_day, archive.horizon() or next_day))
+            records = sum(len(rows) for _, rows in batches)
+            summary["days"] += 1
+            summary["records"] += records
+            logger.info("Archived %d records of %s", records, day.date())
+        day = next_day
+
+    scatter(_drop_rollups, cutoff)
+    horizon = archive.horizon()
+    if horizon is None or horizon < cutoff:
+        archive.set_horizon(cutoff)
+    summary["archived_until"] = archive.horizon()
+    return summary
+
+
+def _oldest_record():
+    return db.session.query(func.min(CellRecord.timestamp)).scalar()
+
+
+def _day_records(day, next_day):
+    rows = db.session.execute(select(CellRecord.id, *(getattr(CellRecord, name) for name in ARCHIVE_COLUMNS)).where(
+        CellRecord.timestamp >= day, CellRecord.timestamp < next_day
+    ).order_by(CellRecord.id)).all()
+    return current_shard(), rows
+
+
+#  Archive columns of [(shard, rows)], rows as read by _day_records
+def _archive_columns(batches):
+    rows = [row for _, shard_rows in batches for row in shard_rows]
+    columns = {name: [getattr(row, name) for row in rows] for name in ARCHIVE_COLUMNS}
+    columns["source_shard"] = [-1 if shard is None else shard for shard, shard_rows in batches for _ in shard_rows]
+    columns["source_id"] = [row.id for row in rows]
+    return columns
+
+
+#  CellRollup values of the day's hour buckets, aggregated from the whole archived partition
+def _hour_rollups(partition):
+    columns = {name: partition.column(name) for name in ROLLUP_KEYS[1:] + NUMERIC_COLUMNS}
+    columns["bucket"] = np.datetime_as_string(partition.column("timestamp").astype("datetime64[h]"), unit="m")
+    values = []
+    for (bucket, operator, network_type, username, device_id), totals in group_totals(columns, ROLLUP_KEYS).items():
+        values.append({
+            "granularity": "hour",
+            "bucket_start": datetime.fromisoformat(bucket),
+            "operator": operator,
+            "network_type": network_type,
+            "username": username,
+            "device_id": device_id,
+            "record_count": totals["count"],
+            **{field: totals[field] for field in TOTAL_FIELDS if field != "count"}
+        })
+    return values
+
+
+#  {shard: rows} of rows with a device_id ({None: rows} without shards)
+def _by_shard(rows):
+    shards = get_shards(current_app)
+    return partition_rows(rows, shards.count) if shards else {None: rows}
+
+
+#  On this shard, in one transaction: replace the day's hour rollups, drop its minute rollups and delete
+#  its archived raw rows
+def _retire_day(day, next_day, ids, rollups):
+    shard = current_shard()
+    db.session.execute(delete(CellRollup).where(
+        CellRollup.bucket_start >= day, CellRollup.bucket_start < next_day
+    ))
+    if rollups.get(shard):
+        db.session.execute(insert(CellRollup), rollups[shard])
+    shard_ids = ids.get(shard, [])
+    for start in range(0, len(shard_ids), DELETE_BATCH):
+        db.session.execute(delete(CellRecord).where(CellRecord.id.in_(shard_ids[start:start + DELETE_BATCH])))
+    db.session.commit()
+
+
+#  Archived days are read from the archive at minute and cell level, so only their hour rollups are kept
+def _drop_rollups(cutoff):
+    db.session.execute(delete(CellRollup).where(CellRollup.granularity == "minute", CellRollup.bucket_start < cutoff))
+    db.session.execute(delete(CellStatRollup).where(CellStatRollup.bucket_start < cutoff))
+    db.session.commit()
@@ -0,0 +1,326 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, delete, insert, select, update
+
+from models import db, CellRecord, CellRollup, CellStatRollup, RollupState
+from utils.aggregations import (
+    TOTAL_FIELDS, grouped_totals, query_totals, totals_from_row, merge_totals, counts_of, averages_of,
+    time_bucket
+)
+from utils.archive import archive_horizon, archive_totals, archive_trend
+from utils.hll import hash64, pack_sparse, register_of
+from utils.sharding import LATE_WINDOW, scatter, device_shard
+
+# "cell" is the per-cell hour rollup of /admin/cell_summary and /admin/worst_cells (CellStatRollup)
+GRANULARITIES = {"minute": timedelta(minutes=1), "hour": timedelta(hours=1), "cell": timedelta(hours=1)}
+CELL_ROLLUP_KEYS = ("operator", "network_type", "cell_id", "frequency_band")
+COMPACT_CHUNK = timedelta(days=1)
+COMPACT_BATCH_SIZE = 5000
+DEFAULT_LATE_WINDOW = LATE_WINDOW
+
+
+def floor_bucket(dt, granularity):
+    if granularity == "minute":
+        return dt.replace(second=0, microsecond=0)
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_bucket(dt, granularity):
+    floored = floor_bucket(dt, granularity)
+    return floored if floored == dt else floored + GRANULARITIES[granularity]
+
+
+#  Read as a column, not through the identity map: each shard has its own RollupState rows
+def compacted_until(granularity):
+    return db.session.query(RollupState.compacted_until).filter(RollupState.granularity == granularity).scalar()
+
+
+#  Rebuild the rollups of one granularity up to the last closed bucket.
+#  Each run re-aggregates `late_window` before the previous watermark to pick up late measurements,
+#  and from the dirty_from marker that inserts of older rows leave behind (utils/sharding.py).
+#  Archived days are never re-aggregated: their raw rows are gone, and retention wrote their hour
+#  rollups from the archive.
+def compact_rollups(granularity, now=None, late_window=DEFAULT_LATE_WINDOW, rebuild_from=None):
+    close_until = floor_bucket(now or datetime.utcnow(), granularity)
+    state = db.session.get(RollupState, granularity)
+    dirty_from = state.dirty_from if state else None
+
+    if rebuild_from is not None:
+        start = floor_bucket(rebuild_from, granularity)
+    elif state:
+        start = floor_bucket(state.compacted_until - late_window, granularity)
+    else:
+        first = db.session.query(func.min(CellRecord.timestamp)).scalar()
+        if first is None:
+            return 0
+        start = floor_bucket(first, granularity)
+    if dirty_from is not None:
+        start = min(start, floor_bucket(dirty_from, granularity))
+    horizon = archive_horizon()
+    if horizon is not None:
+        start = max(start, horizon)
+
+    written = 0
+    chunk_start = start
+    while chunk_start < close_until:
+        chunk_end = min(chunk_start + COMPACT_CHUNK, close_until)
+        if granularity == "cell":
+            written += _compact_cells(chunk_start, chunk_end)
+        else:
+            written += _compact_range(granularity, chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+    if dirty_from is not None:
+        # Only clear the marker this run started from: an insert meanwhile may have lowered it again
+        db.session.execute(update(RollupState).where(
+            RollupState.granularity == granularity, RollupState.dirty_from == dirty_from
+        ).values(dirty_from=None))
+    if state:
+        state.compacted_until = max(state.compacted_until, close_until)
+    else:
+        db.session.add(RollupState(granularity=granularity, compacted_until=close_until))
+    db.session.commit()
+    return written
+
+
+def _compact_range(granularity, start, end):
+    bucket = time_bucket(CellRecord.timestamp, granularity)
+    rows = db.session.query(
+        bucket, CellRecord.operator, CellRecord.network_type, CellRecord.username, CellRecord.device_id,
+        func.count(),
+        func.count(CellRecord.signal_power),
+        func.sum(CellRecord.signal_power),
+        func.sum(CellRecord.signal_power * CellRecord.signal_power),
+        func.count(CellRecord.sinr),
+        func.sum(CellRecord.sinr),
+        func.sum(CellRecord.sinr * CellRecord.sinr)
+    ).filter(
+        CellRecord.timestamp >= start, CellRecord.timestamp < end
+    ).group_by(
+        bucket, CellRecord.operator, CellRecord.network_type, CellRecord.username, CellRecord.device_id
+    ).all()
+
+    db.session.execute(delete(CellRollup).where(
+        CellRollup.granularity == granularity,
+        CellRollup.bucket_start >= start,
+        CellRollup.bucket_start < end
+    ))
+    values = []
+    for label, operator, network_type, username, device_id, *totals in rows:
+        totals = totals_from_row(totals)
+        values.append({
+            "granularity": granularity,
+            "bucket_start": datetime.strptime(label, "%Y-%m-%d %H:%M"),
+            "operator": operator,
+            "network_type": network_type,
+            "username": username,
+            "device_id": device_id,
+            "record_count": totals["count"],
+            **{field: totals[field] for field in TOTAL_FIELDS if field != "count"}
+        })
+    if values:
+        db.session.execute(insert(CellRollup), values)
+    return len(values)
+
+
+#  Distinct values of a metric with their counts, stored as packed (float64, uint32) records in ascending
+#  value order: histograms of several buckets are merged by concatenating their bytes
+HISTOGRAM = np.dtype([("value", "<f8"), ("count", "<u4")])
+
+
+def pack_histogram(pairs):
+    return np.array(sorted(pairs), dtype=HISTOGRAM).tobytes() if pairs else None
+
+
+#  Per-cell hour rollups of [start, end): records per cell and frequency band, the histogram of each
+#  metric and the sketch of the devices, counted from one scan of the chunk streamed COMPACT_BATCH_SIZE
+#  rows at a time (rows without a cell id are skipped, as in load_cells)
+def _compact_cells(start, end):
+    rows = db.session.execute(select(
+        time_bucket(CellRecord.timestamp, "cell"), *(getattr(CellRecord, key) for key in CELL_ROLLUP_KEYS),
+        CellRecord.device_id, CellRecord.signal_power, CellRecord.sinr
+    ).where(
+        CellRecord.cell_id.isnot(None), CellRecord.timestamp >= start, CellRecord.timestamp < end
+    ).execution_options(stream_results=True, yield_per=COMPACT_BATCH_SIZE))
+    rollups = {}
+    device_registers = {}
+    for row in rows:
+        key = tuple(row[:5])
+        rollup = rollups.get(key)
+        if rollup is None:
+            rollup = rollups[key] = {"record_count": 0, "devices": {}, "signal_power": Counter(), "sinr": Counter()}
+        rollup["record_count"] += 1
+        register = device_registers.get(row[5])
+        if register is None:
+            register = device_registers[row[5]] = register_of(hash64(row[5]))
+        index, rank = register
+        if rank > rollup["devices"].get(index, 0):
+            rollup["devices"][index] = rank
+        if row[6] is not None:
+            rollup["signal_power"][row[6]] += 1
+        if row[7] is not None:
+            rollup["sinr"][row[7]] += 1
+
+    db.session.execute(delete(CellStatRollup).where(
+        CellStatRollup.bucket_start >= start,
+        CellStatRollup.bucket_start < end
+    ))
+    values = []
+    for (label, *key), rollup in rollups.items():
+        values.append({
+            "bucket_start": datetime.strptime(label, "%Y-%m-%d %H:%M"),
+            **dict(zip(CELL_ROLLUP_KEYS, key)),
+            "record_count": rollup["record_count"],
+            "devices": pack_sparse(rollup["devices"]),
+            "signal_power_values": pack_histogram(rollup["signal_power"].items()),
+            "sinr_values": pack_histogram(rollup["sinr"].items())
+        })
+    if values:
+        db.session.execute(insert(CellStatRollup), values)
+    return len(values)
+
+
+#  Split [start_dt, end_dt] into compacted whole buckets and raw edges.
+#  Returns (rollup_lo, rollup_hi, raw_ranges); rollup_lo is None when no bucket can be served from rollups.
+def split_window(start_dt, end_dt, granularity):
+    watermark = compacted_until(granularity)
+    if watermark is not None:
+        rollup_lo = ceil_bucket(start_dt, granularity)
+        rollup_hi = floor_bucket(min(end_dt, watermark), granularity)
+        if rollup_lo < rollup_hi:
+            raw_ranges = [
+                (CellRecord.timestamp >= start_dt, CellRecord.timestamp < rollup_lo),
+                (CellRecord.timestamp >= rollup_hi, CellRecord.timestamp <= end_dt),
+            ]
+            return rollup_lo, rollup_hi, raw_ranges
+    return None, None, [(CellRecord.timestamp.between(start_dt, end_dt),)]
+
+
+#  The part of [start_dt, end_dt] that rollups never serve for archived days, so it is read from the
+#  archive: the edges around whole hours ("hour"; the window itself without one), or all of it
+#  ("minute": retention drops the minute rollups of archived days)
+def archived_ranges(start_dt, end_dt, granularity):
+    if granularity == "hour":
+        rollup_lo, rollup_hi = ceil_bucket(start_dt, "hour"), floor_bucket(end_dt, "hour")
+        if rollup_lo < rollup_hi:
+            return [
+                (CellRecord.timestamp >= start_dt, CellRecord.timestamp < rollup_lo),
+                (CellRecord.timestamp >= rollup_hi, CellRecord.timestamp <= end_dt),
+            ]
+    return [(CellRecord.timestamp.between(start_dt, end_dt),)]
+
+
+def _record_filters(username, device_id):
+    filters = []
+    if username is not None:
+        filters.append(CellRecord.username == username)
+    if device_id is not None:
+        filters.append(CellRecord.device_id == device_id)
+    return filters
+
+
+def _rollup_filters(granularity, rollup_lo, rollup_hi, username, device_id):
+    filters = [
+        CellRollup.granularity == granularity,
+        CellRollup.bucket_start >= rollup_lo,
+        CellRollup.bucket_start < rollup_hi
+    ]
+    if username is not None:
+        filters.append(CellRollup.username == username)
+    if device_id is not None:
+        filters.append(CellRollup.device_id == device_id)
+    return filters
+
+
+def _group_columns(model, group_key):
+    if group_key is None:
+        return []
+    keys = group_key if isinstance(group_key, tuple) else (group_key,)
+    return [getattr(model, key) for key in keys]
+
+
+#  Per-group totals over a window: hour rollups for the whole buckets, raw rows for the edges.
+#  group_key is None, a column name, or a tuple of column names (see query_totals for the result keys).
+#  A device's totals come from its shard alone; global totals are merged from every shard's partial totals.
+#  Edges on archived days come from the archive, once for all shards.
+def window_totals(group_key, start_dt, end_dt, username=None, device_id=None):
+    if device_id is not None:
+        with device_shard(device_id):
+            totals = _window_totals(group_key, start_dt, end_dt, username, device_id)
+    else:
+        totals = {}
+        for partial in scatter(_window_totals, group_key, start_dt, end_dt, username, device_id):
+            merge_totals(totals, partial)
+    for time_filters in archived_ranges(start_dt, end_dt, "hour"):
+        merge_totals(totals, archive_totals(group_key, [*time_filters, *_record_filters(username, device_id)]))
+    return totals
+
+
+def _window_totals(group_key, start_dt, end_dt, username, device_id):
+    rollup_lo, rollup_hi, raw_ranges = split_window(start_dt, end_dt, "hour")
+
+    totals = {}
+    for time_filters in raw_ranges:
+        filters = [*time_filters, *_record_filters(username, device_id)]
+        merge_totals(totals, grouped_totals(_group_columns(CellRecord, group_key), filters))
+
+    if rollup_lo is not None:
+        merge_totals(totals, query_totals(_group_columns(CellRollup, group_key), [
+            func.sum(CellRollup.record_count),
+            func.sum(CellRollup.signal_power_count),
+            func.sum(CellRollup.signal_power_sum),
+            func.sum(CellRollup.signal_power_sq_sum),
+            func.sum(CellRollup.sinr_count),
+            func.sum(CellRollup.sinr_sum),
+            func.sum(CellRollup.sinr_sq_sum)
+        ], _rollup_filters("hour", rollup_lo, rollup_hi, username, device_id)))
+
+    return {group: values for group, values in totals.items() if values["count"]}
+
+
+#  {group: record count} over a window
+def window_counts(group_key, start_dt, end_dt, username=None, device_id=None):
+    return counts_of(window_totals(group_key, start_dt, end_dt, username, device_id))
+
+
+#  {group: average of value ("signal_power" or "sinr")} over a window, None for all-null groups
+def window_averages(value, group_key, start_dt, end_dt, username=None, device_id=None):
+    return averages_of(window_totals(group_key, start_dt, end_dt, username, device_id), value)
+
+
+#  Record count per minute/hour bucket label over a window, oldest first (summed over the shards and
+#  the archive)
+def activity_trend(start_dt, end_dt, interval):
+    granularity = "minute" if interval == "minute" else "hour"
+    partials = scatter(_activity_trend, start_dt, end_dt, granularity)
+    partials += [archive_trend(time_filters, granularity) for time_filters in archived_ranges(start_dt, end_dt, granularity)]
+    trend = {}
+    for partial in partials:
+        for label, count in partial.items():
+            trend[label] = trend.get(label, 0) + count
+
+    timestamps = sorted(trend.keys())
+    return timestamps, [trend[ts] for ts in timestamps]
+
+
+def _activity_trend(start_dt, end_dt, granularity):
+    rollup_lo, rollup_hi, raw_ranges = split_window(start_dt, end_dt, granularity)
+    label_format = "%Y-%m-%d %H:%M" if granularity == "minute" else "%Y-%m-%d %H:00"
+
+    trend = {}
+    bucket = time_bucket(CellRecord.timestamp, granularity)
+    for time_filters in raw_ranges:
+        rows = db.session.query(bucket, func.count()).filter(*time_filters).group_by(bucket).all()
+        for label, count in rows:
+            trend[label] = trend.get(label, 0) + count
+
+    if rollup_lo is not None:
+        rows = db.session.query(CellRollup.bucket_start, func.sum(CellRollup.record_count)).filter(
+            *_rollup_filters(granularity, rollup_lo, rollup_hi, None, None)
+        ).group_by(CellRollup.bucket_start).all()
+        for bucket_start, count in rows:
+            label = bucket_start.strftime(label_format)
+            trend[label] = trend.get(label, 0) + int(count)
+    return trend
@@ -0,0 +1,336 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from hashlib import blake2b
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, inspect, or_, select, update
+from sqlalchemy.schema import CreateTable
+
+from models import db, CellRecord, CellRollup, RollupState
+from utils.db_routing import SHARDED_TABLES, shard_bind, shard_scope
+from utils.lookups import get_lookups
+
+logger = logging.getLogger(__name__)
+
+REBALANCE_BATCH = 5000
+REBALANCE_DEVICES = 200
+# The rollup compactor always re-aggregates this much before its watermark; inserted rows older than
+# that mark their rollup buckets dirty (utils/rollups.py compact_rollups)
+LATE_WINDOW = timedelta(hours=1)
+
+
+#  Shard of a device_id: jump consistent hash of a stable 64-bit hash, so growing from N to N + 1
+#  shards only moves the ~1/(N + 1) of devices that now belong to the new shard.
+#  Never change this mapping: it decides where existing rows live.
+def shard_of(device_id, shards):
+    key = int.from_bytes(blake2b(str(device_id).encode(), digest_size=8).digest(), "big")
+    bucket, candidate = -1, 0
+    while candidate < shards:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+#  The configured shards and a thread pool that runs one query function on all of them in parallel
+class ShardSet:
+    def __init__(self, app, count, workers):
+        self.app = app
+        self.count = count
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard-scatter")
+        self._lock = threading.Lock()
+        self._counters = {"scatters": 0, "failed_scatters": 0, "scatter_seconds_total": 0.0, "max_scatter_seconds": 0.0}
+        atexit.register(self.stop)
+
+    def shard_of(self, device_id):
+        return shard_of(device_id, self.count)
+
+    #  fn(*args, **kwargs) on every shard, each in its own app context and session; results in shard order
+    def scatter(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        futures = [self._executor.submit(self._call, index, fn, args, kwargs) for index in range(self.count)]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            self._count("failed_scatters")
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._counters["scatters"] += 1
+                self._counters["scatter_seconds_total"] += elapsed
+                self._counters["max_scatter_seconds"] = max(self._counters["max_scatter_seconds"], elapsed)
+
+    def stop(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["shards"] = self.count
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _call(self, index, fn, args, kwargs):
+        with self.app.app_context(), shard_scope(index):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+
+#  Partial results of fn from every shard, to be merged by the caller; [fn()] on the primary without shards.
+#  fn must not scatter itself.
+def scatter(fn, *args, **kwargs):
+    shards = get_shards(current_app)
+    if not shards:
+        return [fn(*args, **kwargs)]
+    return shards.scatter(fn, *args, **kwargs)
+
+
+#  Scope for the queries of one device: only its shard is touched
+def device_shard(device_id):
+    shards = get_shards(current_app)
+    return shard_scope(shards.shard_of(device_id)) if shards else nullcontext()
+
+
+def _fetch(stmt):
+    return db.session.execute(stmt).all()
+
+
+#  Rows of a SELECT on CellRecord: from the device's shard when device_id is given, else from every shard
+def read_rows(stmt, device_id=None):
+    if device_id is not None:
+        with device_shard(device_id):
+            return _fetch(stmt)
+    return [row for rows in scatter(_fetch, stmt) for row in rows]
+
+
+#  Streaming results of a SELECT, one per shard (a single one without shards), all on the caller's session
+def shard_results(stmt):
+    shards = get_shards(current_app)
+    if not shards:
+        return [db.session.execute(stmt)]
+    results = []
+    for index in range(shards.count):
+        with shard_scope(index):
+            results.append(db.session.execute(stmt))
+    return results
+
+
+#  {shard: rows} for CellRecord values
+def partition_rows(rows, shards):
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(shard_of(row.get("device_id"), shards), []).append(row)
+    return partitions
+
+
+#  CellRecord values grouped by their device's shard (one group without shards). Commit each group on its
+#  own: a session spanning several shards commits them one after the other, so a failure can leave part
+#  of the rows stored while the whole group is reported as failed.
+def shard_groups(rows):
+    shards = get_shards(current_app)
+    if not shards:
+        return [rows]
+    return list(partition_rows(rows, shards.count).values())
+
+
+#  Insert CellRecord rows, each into its device's shard; runs in the caller's transaction
+#  (new categorical values are added to their lookup tables first, in their own). A Core executemany
+#  on the table: rows are complete column dicts, so the ORM's per-row bulk bookkeeping is skipped.
+def insert_records(rows):
+    get_lookups(current_app).register(rows)
+    shards = get_shards(current_app)
+    if not shards:
+        db.session.execute(insert(CellRecord.__table__), rows)
+        _mark_dirty_rollups(rows)
+        return
+    for index, shard_rows in partition_rows(rows, shards.count).items():
+        with shard_scope(index):
+            db.session.execute(insert(CellRecord.__table__), shard_rows)
+            _mark_dirty_rollups(shard_rows)
+
+
+#  Lower dirty_from of the rollup granularities already compacted past the oldest late row. Rows within
+#  LATE_WINDOW of now are skipped without a query: the compactor's late window re-aggregates them anyway.
+def _mark_dirty_rollups(rows):
+    cutoff = datetime.utcnow() - LATE_WINDOW
+    late = [row["timestamp"] for row in rows if row["timestamp"] < cutoff]
+    if not late:
+        return
+    earliest = min(late)
+    db.session.execute(update(RollupState).where(
+        RollupState.granularity.in_(("minute", "hour", "cell")),
+        RollupState.compacted_until > earliest,
+        or_(RollupState.dirty_from.is_(None), RollupState.dirty_from > earliest)
+    ).values(dirty_from=earliest))
+
+
+#  Create missing sharded tables and indexes on every configured shard bind. Users live on the primary,
+#  so the shard copies are created without foreign keys. Returns "bind.name" of everything created.
+def create_shard_tables():
+    created = []
+    tables = [table for table in db.metadata.sorted_tables if table.name in SHARDED_TABLES]
+    shard = 0
+    while shard_bind(shard) in db.engines:
+        bind = shard_bind(shard)
+        engine = db.engines[bind]
+        existing_tables = set(inspect(engine).get_table_names())
+        with engine.begin() as connection:
+            for table in tables:
+                if table.name not in existing_tables:
+                    connection.execute(CreateTable(table, include_foreign_key_constraints=[]))
+                    created.append(f"{bind}.{table.name}")
+        inspector = inspect(engine)
+        for table in tables:
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for table_index in table.indexes:
+                if table_index.name not in existing_indexes:
+                    table_index.create(engine)
+                    created.append(f"{bind}.{table_index.name}")
+        shard += 1
+    return created
+
+
+def _device_filter(model, device_ids):
+    present = [device_id for device_id in device_ids if device_id is not None]
+    condition = model.device_id.in_(present)
+    return or_(condition, model.device_id.is_(None)) if None in device_ids else condition
+
+
+#  Copy the rows of device_ids from one shard to another in id order, deleting each batch from the source
+#  once the copy has committed. Ids are reassigned by the target. The target commits first and the source
+#  delete in a later transaction, so a run that stops in between leaves the batch on both shards, never
+#  on neither: rows the target already holds with every column equal are not copied again on a re-run.
+def _move_rows(model, source, target, device_ids, batch_size):
+    columns = [column for column in model.__table__.columns if column.name != "id"]
+    time_column = model.__table__.c.timestamp if model is CellRecord else model.__table__.c.bucket_start
+    moved = 0
+    last_id = 0
+    while True:
+        with shard_scope(source):
+            rows = db.session.execute(select(model.__table__.c.id, *columns).where(
+                _device_filter(model, device_ids), model.id > last_id
+            ).order_by(model.id).limit(batch_size)).all()
+        if not rows:
+            return moved
+        times = [row._mapping[time_column] for row in rows if row._mapping[time_column] is not None]
+        window = [time_column.between(min(times), max(times))] if times else []
+        if len(times) < len(rows):
+            window.append(time_column.is_(None))
+        with shard_scope(target):
+            copied = Counter(tuple(row) for row in db.session.execute(
+                select(*columns).where(_device_filter(model, device_ids), or_(*window))
+            ))
+            values = []
+            for row in rows:
+                key = tuple(row)[1:]
+                if copied[key]:
+                    copied[key] -= 1
+                else:
+                    values.append({column.key: row._mapping[column] for column in columns})
+            if values:
+                db.session.execute(insert(model), values)
+        db.session.commit()
+        with shard_scope(source):
+            db.session.execute(delete(model).where(model.id.in_([row.id for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+        last_id = rows[-1].id
+
+
+#  Moved rollups are only complete up to the source's watermark: lower the target's to match, so the next
+#  compaction re-aggregates the rest from the moved raw rows (no source watermark: drop the target's)
+def _lower_watermarks(target, source_watermarks):
+    with shard_scope(target):
+        for granularity, until in db.session.execute(select(RollupState.granularity, RollupState.compacted_until)).all():
+            source_until = source_watermarks.get(granularity)
+            if source_until is None:
+                db.session.execute(delete(RollupState).where(RollupState.granularity == granularity))
+            elif source_until < until:
+                db.session.execute(update(RollupState).where(
+                    RollupState.granularity == granularity
+                ).values(compacted_until=source_until))
+    db.session.commit()
+
+
+#  The per-cell rollups of both shards cover the devices moved between them: lower both "cell" watermarks
+#  to the hour of the oldest record to move, before moving it. Both shards then read those hours from raw
+#  rows wherever the records are, and the next compaction re-aggregates them from there.
+def _lower_cell_watermarks(source, target, earliest):
+    hour = earliest.replace(minute=0, second=0, microsecond=0)
+    for shard in (source, target):
+        with shard_scope(shard):
+            db.session.execute(update(RollupState).where(
+                RollupState.granularity == "cell", RollupState.compacted_until > hour
+            ).values(compacted_until=hour))
+        db.session.commit()
+
+
+#  Move every device's records and rollups to the shard it hashes to under the current shard count
+#  (per-cell rollups are not per device: they are re-aggregated instead, see _lower_cell_watermarks).
+#  Run after appending a shard (and deploying the new SHARD_DATABASE_URLS): new measurements already go to
+#  their new shard, and until a device has been moved its history is split between two shards.
+#  Runs on one session with shard scopes, so only column rows are read (never ORM identities, which
+#  could collide between shards). Returns rows moved per table.
+def rebalance_shards(include_primary=False, batch_size=REBALANCE_BATCH):
+    shards = get_shards(current_app)
+    if not shards:
+        raise RuntimeError("No shards configured (SHARD_DATABASE_URLS)")
+
+    models = (CellRecord, CellRollup)
+    moved = {model.__tablename__: 0 for model in models}
+    for source in ([None] if include_primary else []) + list(range(shards.count)):
+        with shard_scope(source):
+            device_ids = set()
+            for model in models:
+                device_ids |= {device_id for (device_id,) in db.session.execute(select(model.device_id).distinct())}
+            watermarks = dict(db.session.execute(select(RollupState.granularity, RollupState.compacted_until)).all())
+        db.session.commit()
+
+        targets = {}
+        for device_id in device_ids:
+            target = shards.shard_of(device_id)
+            if target != source:
+                targets.setdefault(target, []).append(device_id)
+
+        for target, devices in targets.items():
+            for start in range(0, len(devices), REBALANCE_DEVICES):
+                chunk = devices[start:start + REBALANCE_DEVICES]
+                with shard_scope(source):
+                    earliest = db.session.execute(select(func.min(CellRecord.timestamp)).where(
+                        _device_filter(CellRecord, chunk)
+                    )).scalar()
+                db.session.commit()
+                if earliest is not None:
+                    _lower_cell_watermarks(source, target, earliest)
+                for model in models:
+                    moved[model.__tablename__] += _move_rows(model, source, target, chunk, batch_size)
+            _lower_watermarks(target, watermarks)
+            logger.info("Moved %d devices from %s to shard %d", len(devices),
+                        "the primary" if source is None else f"shard {source}", target)
+    return moved
+
+
+#  Shard CellRecord when SHARD_COUNT binds are configured
+def init_sharding(app):
+    count = app.config.get('SHARD_COUNT', 0)
+    if count < 1:
+        return None
+    shards = ShardSet(app, count, app.config.get('SHARD_SCATTER_WORKERS', count))
+    app.extensions['shards'] = shards
+    return shards
+
+
+def get_shards(app):
+    return app.extensions.get('shards')
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select
+
+from models import db, CellRecord
+from utils.analytics import METRICS
+from utils.archive import ARCHIVE_PARTITION, archive_days, archive_horizon, partition_day
+from utils.sharding import device_shard
+
+DEFAULT_MAX_POINTS = 500
+MAX_POINTS_LIMIT = 5000
+STREAM_BATCH_SIZE = 5000
+EPOCH = datetime(1970, 1, 1)
+
+
+#  Largest-Triangle-Three-Buckets downsampling of a series of `total` points arriving in time order, in
+#  chunks. The first and last points are kept and the others split into max_points - 2 buckets of equal
+#  count; each bucket keeps the point forming the largest triangle with the point kept before it and the
+#  average of the next bucket. Only that bucket and the next one are held in memory. Series of at most
+#  max_points points are kept whole.
+class LTTBSampler:
+    def __init__(self, total, max_points):
+        self.every = (total - 2) / (max_points - 2) if total > max_points else None
+        self.buckets = max_points - 2
+        self.times = []  # kept points, times in microseconds since the epoch
+        self.values = []
+        self._seen = 0
+        self._bucket = 0  # bucket being filled
+        self._waiting = None  # (times, values) of the complete bucket waiting for the next one's average
+        self._filling = []
+
+    #  Add the next chunk of points (int64 microsecond times, float values; NaN values are skipped)
+    def add(self, times, values):
+        valid = ~np.isnan(values)
+        times, values = times[valid], values[valid]
+        if self.every is None:
+            self.times += times.tolist()
+            self.values += values.tolist()
+            return
+        position = 0
+        if self._seen == 0 and len(times):
+            self._keep(times[0], values[0])
+            position = self._seen = 1
+        while position < len(times):
+            if self._bucket < self.buckets:
+                take = min(len(times) - position, self._bucket_end() - self._seen)
+            else:
+                take = len(times) - position  # after the last bucket: normally only the last point
+            self._filling.append((times[position:position + take], values[position:position + take]))
+            position += take
+            self._seen += take
+            if self._bucket < self.buckets and self._seen == self._bucket_end():
+                self._close_bucket()
+
+    #  Kept points as (times, values). A series that ended early (or ran over its count) merges what
+    #  is left into one last bucket before the last point.
+    def finish(self):
+        if self.every is None or self._seen == 0:
+            return self.times, self.values
+        tail = self._take_filling()
+        if not len(tail[0]):
+            if self._waiting is None:
+                return self.times, self.values
+            tail, self._waiting = self._waiting, None
+        last_time, last_value = tail[0][-1], tail[1][-1]
+        rest = (tail[0][:-1], tail[1][:-1])
+        if self._waiting is not None:
+            rest = (np.concatenate([self._waiting[0], rest[0]]), np.concatenate([self._waiting[1], rest[1]]))
+        if len(rest[0]):
+            self._keep_largest(*rest, last_time, last_value)
+        self._keep(last_time, last_value)
+        return self.times, self.values
+
+    def _bucket_end(self):
+        return int((self._bucket + 1) * self.every) + 1
+
+    def _close_bucket(self):
+        times, values = self._take_filling()
+        if self._waiting is not None:
+            self._keep_largest(*self._waiting, times.mean(), values.mean())
+        self._waiting = (times, values)
+        self._bucket += 1
+
+    def _take_filling(self):
+        chunks, self._filling = self._filling, []
+        if not chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+        return np.concatenate([times for times, _ in chunks]), np.concatenate([values for _, values in chunks])
+
+    def _keep_largest(self, times, values, next_time, next_value):
+        kept_time, kept_value = self.times[-1], self.values[-1]
+        areas = np.abs(
+            (kept_time - next_time) * (values - kept_value) - (kept_time - times.astype(float)) * (next_value - kept_value)
+        )
+        index = int(np.argmax(areas))
+        self._keep(times[index], values[index])
+
+    def _keep(self, time, value):
+        self.times.append(int(time))
+        self.values.append(float(value))
+
+
+#  (int64 microsecond times, {metric: float values}) of timestamp-first row tuples
+def _row_chunk(rows, metrics):
+    columns = list(zip(*rows))
+    times = np.array(columns[0], dtype="datetime64[us]").astype(np.int64)
+    return times, {metric: np.array(column, dtype=float) for metric, column in zip(metrics, columns[1:])}
+
+
+def _day_chunk(selected, metrics):
+    return selected["timestamp"].astype("datetime64[us]").astype(np.int64), {metric: selected[metric] for metric in metrics}
+
+
+def _merge_chunks(first, second):
+    times = np.concatenate([first[0], second[0]])
+    order = np.argsort(times, kind="stable")
+    return times[order], {metric: np.concatenate([first[1][metric], second[1][metric]])[order] for metric in first[1]}
+
+
+def _split_chunk(chunk, until):
+    cut = int(np.searchsorted(chunk[0], until))
+    return (
+        (chunk[0][:cut], {metric: values[:cut] for metric, values in chunk[1].items()}),
+        (chunk[0][cut:], {metric: values[cut:] for metric, values in chunk[1].items()}),
+    )
+
+
+#  Time-ordered chunks of the window: archived days one at a time, each with the late rows that arrived
+#  for it since the last retention run, then the database rows after the horizon through a server-side
+#  cursor. Runs on the device's shard.
+def _chunks(filters, metrics, horizon):
+    columns = [CellRecord.timestamp] + [getattr(CellRecord, metric) for metric in metrics]
+    stmt = select(*columns).where(*filters).order_by(CellRecord.timestamp, CellRecord.id)
+    if horizon is not None:
+        late = db.session.execute(stmt.where(CellRecord.timestamp < horizon)).all()
+        late = _row_chunk(late, metrics) if late else None
+        for selected in archive_days(["timestamp", *metrics], filters):
+            chunk = _day_chunk(selected, metrics)
+            if late is not None:
+                day_end = np.datetime64(partition_day(selected["timestamp"][0].astype(datetime)) + ARCHIVE_PARTITION, "us")
+                arrived, late = _split_chunk(late, day_end.astype(np.int64))
+                chunk = _merge_chunks(arrived, chunk)
+            yield chunk
+        if late is not None:
+            yield late
+        stmt = stmt.where(CellRecord.timestamp >= horizon)
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE))
+    for rows in result.partitions():
+        yield _row_chunk(rows, metrics)
+
+
+#  {metric: {"count": values in the window, "points": [[timestamp, value], ...]}} of one device's window,
+#  downsampled to at most max_points points per metric in a single pass over the rows
+def timeseries_points(filters, device_id, metrics, max_points):
+    horizon = archive_horizon()
+    counts = {metric: 0 for metric in metrics}
+    if horizon is not None:
+        for selected in archive_days(["timestamp", *metrics], filters):
+            for metric in metrics:
+                counts[metric] += int(np.count_nonzero(~np.isnan(selected[metric])))
+
+    with device_shard(device_id):
+        live = db.session.execute(
+            select(*(func.count(getattr(CellRecord, metric)) for metric in metrics)).where(*filters)
+        ).one()
+        for metric, count in zip(metrics, live):
+            counts[metric] += count
+        samplers = {metric: LTTBSampler(counts[metric], max_points) for metric in metrics}
+        for times, values in _chunks(filters, metrics, horizon):
+            for metric, sampler in samplers.items():
+                sampler.add(times, values[metric])
+
+    series = {}
+    for metric, sampler in samplers.items():
+        times, values = sampler.finish()
+        series[metric] = {
+            "count": counts[metric],
+            "points": [[(EPOCH + timedelta(microseconds=time)).isoformat(), value] for time, value in zip(times, values)]
+        }
+    return series
+
+
+#  Parse metrics / max_points query parameters; raises ValueError on bad input
+def timeseries_params(args):
+    metrics = tuple(metric for metric in args.get('metrics', ",".join(METRICS)).split(",") if metric)
+    if not metrics or any(metric not in METRICS for metric in metrics):
+        raise ValueError(f"metrics must be a comma-separated subset of: {', '.join(METRICS)}")
+    try:
+        max_points = int(args.get('max_points', DEFAULT_MAX_POINTS))
+    except ValueError:
+        raise ValueError(f"max_points must be an integer between 3 and {MAX_POINTS_LIMIT}")
+    if not 3 <= max_points <= MAX_POINTS_LIMIT:
+        raise ValueError(f"max_points must be an integer between 3 and {MAX_POINTS_LIMIT}")
+    return metrics, max_points
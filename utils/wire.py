@@ -0,0 +1,108 @@
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import msgpack
+import zstandard
+
+LEGACY_TIMESTAMP_FORMAT = "%d %b %Y %I:%M %p"
+MAX_BODY_BYTES = 16 * 1024 * 1024  # decompressed; guards against compression bombs
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+MONTHS = {name: index for index, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), start=1
+)}
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+#  Decompress (Content-Encoding: gzip | zstd) and decode (JSON or msgpack) an ingest request body.
+#  Raises UnsupportedEncoding for unknown encodings/types and ValueError for malformed bodies.
+def decode_body(req):
+    raw = req.get_data(cache=False)
+    encoding = req.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding == 'gzip':
+        raw = _gunzip(raw)
+    elif encoding == 'zstd':
+        raw = _unzstd(raw)
+    elif encoding not in ('', 'identity'):
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding '{encoding}', use gzip or zstd")
+
+    content_type = (req.mimetype or '').lower()
+    try:
+        if content_type in MSGPACK_TYPES:
+            return msgpack.unpackb(raw, raw=False)
+        if content_type == 'application/json' or content_type.endswith('+json'):
+            return json.loads(raw)
+    except (ValueError, TypeError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+        # TypeError: msgpack maps with unhashable keys (arrays or maps as keys)
+        raise ValueError(f"Malformed request body: {e}")
+    raise UnsupportedEncoding("Unsupported Content-Type, use application/json or application/msgpack")
+
+
+def _gunzip(raw):
+    try:
+        body = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(raw, MAX_BODY_BYTES + 1)
+    except zlib.error as e:
+        raise ValueError(f"Malformed gzip body: {e}")
+    return _within_limit(body)
+
+
+def _unzstd(raw):
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(raw)) as reader:
+            body = reader.read(MAX_BODY_BYTES + 1)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Malformed zstd body: {e}")
+    return _within_limit(body)
+
+
+def _within_limit(body):
+    if len(body) > MAX_BODY_BYTES:
+        raise ValueError(f"Decompressed body exceeds {MAX_BODY_BYTES} bytes")
+    return body
+
+
+#  Measurement timestamp: epoch milliseconds (int/float, stored as naive UTC) or the legacy
+#  "12 Mar 2025 10:15 AM" string the app has always sent
+def parse_timestamp(value):
+    if isinstance(value, bool):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError("Invalid epoch-millisecond timestamp")
+    if isinstance(value, str):
+        return parse_legacy_timestamp(value)
+    raise ValueError(f"Invalid timestamp, expected epoch milliseconds or format '{LEGACY_TIMESTAMP_FORMAT}'")
+
+
+#  Legacy strings have minute resolution, so a fleet reports the same few strings over and over:
+#  cache them, and split by hand instead of going through strptime on a miss. The clock is checked
+#  as strictly as strptime's %I:%M %p would: hours 1-12, minutes 0-59, AM or PM.
+@lru_cache(maxsize=4096)
+def parse_legacy_timestamp(value):
+    try:
+        day, month, year, clock, meridiem = value.split()
+        meridiem = meridiem.upper()
+        hour, minute = clock.split(":")
+        if meridiem not in ("AM", "PM") or not _clock_field(hour) or not _clock_field(minute):
+            raise ValueError
+        hour, minute = int(hour), int(minute)
+        if not 1 <= hour <= 12 or not 0 <= minute <= 59:
+            raise ValueError
+        hour = hour % 12 + (12 if meridiem == "PM" else 0)
+        return datetime(int(year), MONTHS[month.capitalize()], int(day), hour, minute)
+    except (ValueError, KeyError):
+        try:
+            return datetime.strptime(value, LEGACY_TIMESTAMP_FORMAT)
+        except ValueError:
+            raise ValueError(f"Invalid timestamp, expected epoch milliseconds or format '{LEGACY_TIMESTAMP_FORMAT}'")
+
+
+def _clock_field(text):
+    return 1 <= len(text) <= 2 and text.isascii() and text.isdigit()
@@ -0,0 +1,187 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from models import db
+from utils.device_registry import record_devices
+from utils.ingest_hooks import notify_ingest
+from utils.sharding import insert_records, shard_groups
+
+logger = logging.getLogger(__name__)
+
+# A flush that fails with OperationalError (database unavailable, lock timeout) is retried whole this
+# many times, with doubling pauses, before its rows are dead-lettered
+FLUSH_RETRIES = 3
+RETRY_PAUSE = 0.5
+
+
+#  Bounded in-process queue of measurements, group-committed by a background thread
+class WriteBehindBuffer:
+    def __init__(self, app, max_queue=10000, batch_size=500, flush_interval=1.0, block_timeout=0.0,
+                 dead_letter_path=None):
+        self.app = app
+        self.dead_letter_path = dead_letter_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "rejected": 0,
+            "flushed_rows": 0,
+            "failed_rows": 0,
+            "flush_retries": 0,
+            "split_flushes": 0,
+            "flushes": 0,
+            "flush_seconds_total": 0.0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    #  Queue one row of CellRecord values, False when the buffer is full (backpressure)
+    def submit(self, values):
+        if self._stop.is_set():
+            return False
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(values, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(values)
+        except queue.Full:
+            self._count("rejected")
+            return False
+        self._count("enqueued")
+        return True
+
+    #  Stop accepting rows and flush whatever is still queued (graceful shutdown)
+    def stop(self, timeout=30):
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        return stats
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._drain()
+            if batch:
+                self._flush(batch)
+
+    #  Collect up to batch_size rows, or whatever arrived within flush_interval
+    def _drain(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                if self._stop.is_set():
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                if self._stop.is_set():
+                    break
+        return batch
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                for group in shard_groups(batch):
+                    self._write(group)
+            finally:
+                db.session.remove()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._counters["flushes"] += 1
+            self._counters["flush_seconds_total"] += elapsed
+            self._counters["last_flush_seconds"] = elapsed
+            self._counters["max_flush_seconds"] = max(self._counters["max_flush_seconds"], elapsed)
+
+    #  Commit rows of one shard in one transaction. The rows were already acknowledged, so a failing group
+    #  is split in halves and each half retried: only rows that fail on their own are dead-lettered.
+    def _write(self, rows, attempt=0):
+        try:
+            insert_records(rows)
+            record_devices(rows)
+            db.session.commit()
+        except OperationalError:
+            db.session.rollback()
+            unavailable = True
+            if attempt == FLUSH_RETRIES:
+                logger.exception("Write-behind flush of %d rows failed %d times", len(rows), attempt + 1)
+        except Exception:
+            db.session.rollback()
+            unavailable = False
+            if len(rows) == 1:
+                logger.exception("Write-behind row failed: %r", rows[0])
+        else:
+            self._count("flushed_rows", len(rows))
+            notify_ingest(self.app, rows)
+            return
+
+        if unavailable and attempt < FLUSH_RETRIES:
+            self._count("flush_retries")
+            time.sleep(RETRY_PAUSE * 2 ** attempt)
+            self._write(rows, attempt + 1)
+        elif unavailable or len(rows) == 1:
+            self._dead_letter(rows)
+        else:
+            self._count("split_flushes")
+            middle = len(rows) // 2
+            self._write(rows[:middle])
+            self._write(rows[middle:])
+
+    #  Rows that could not be stored, appended as NDJSON to WRITE_BEHIND_DEAD_LETTER (when set) for replay
+    def _dead_letter(self, rows):
+        self._count("failed_rows", len(rows))
+        if not self.dead_letter_path:
+            return
+        try:
+            with open(self.dead_letter_path, "a") as file:
+                for row in rows:
+                    file.write(json.dumps(row, default=str) + "\n")
+        except OSError:
+            logger.exception("Could not write %d dead-lettered rows to %s", len(rows), self.dead_letter_path)
+
+
+#  Start the write-behind buffer when WRITE_BEHIND_ENABLED is set
+def init_write_behind(app):
+    if not app.config.get('WRITE_BEHIND_ENABLED'):
+        return None
+    buffer = WriteBehindBuffer(
+        app,
+        max_queue=app.config.get('WRITE_BEHIND_QUEUE_SIZE', 10000),
+        batch_size=app.config.get('WRITE_BEHIND_BATCH_SIZE', 500),
+        flush_interval=app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', 1.0),
+        block_timeout=app.config.get('WRITE_BEHIND_BLOCK_TIMEOUT', 0.0),
+        dead_letter_path=app.config.get('WRITE_BEHIND_DEAD_LETTER'),
+    )
+    app.extensions['write_behind'] = buffer
+    return buffer
+
+
+def get_write_behind(app):
+    return app.extensions.get('write_behind')